@@ -181,11 +181,26 @@ float readTDS() {
   return lastTDSValue;
 }
 
-void publishRelayStatus(bool isOn) {
-  char payload[128];
+// Value of a top-level "key":"value" string field, or "" if absent (enough for the flat command payloads)
+String jsonStringField(const String& s, const char* key) {
+  String quoted = String("\"") + key + "\"";
+  int keyPos = s.indexOf(quoted);
+  if (keyPos < 0) return "";
+  int colonPos = s.indexOf(':', keyPos + quoted.length());
+  if (colonPos < 0) return "";
+  int openQ = s.indexOf('"', colonPos + 1);
+  if (openQ < 0) return "";
+  int closeQ = s.indexOf('"', openQ + 1);
+  if (closeQ <= openQ) return "";
+  return s.substring(openQ + 1, closeQ);
+}
+
+// Status replies echo the command's correlation id ("cid") so the backend can match the acknowledgement
+void publishRelayStatus(bool isOn, const String& cid = "") {
+  char payload[160];
   int n = snprintf(payload, sizeof(payload), 
-                   "{\"relay\":{\"state\":\"%s\",\"timestamp\":%lu}}", 
-                   isOn ? "on" : "off", millis());
+                   "{\"relay\":{\"state\":\"%s\",\"timestamp\":%lu},\"cid\":\"%s\"}", 
+                   isOn ? "on" : "off", millis(), cid.c_str());
   if (n > 0 && n < (int)sizeof(payload)) {
     bool ok = mqttClient.publish(statusTopic, payload, false);
     Serial.print("[STATUS] Relay -> ");
@@ -195,11 +210,11 @@ void publishRelayStatus(bool isOn) {
   }
 }
 
-void publishLEDStatus(bool isOn) {
-  char payload[128];
+void publishLEDStatus(bool isOn, const String& cid = "") {
+  char payload[160];
   int n = snprintf(payload, sizeof(payload), 
-                   "{\"light\":{\"state\":\"%s\",\"timestamp\":%lu}}", 
-                   isOn ? "on" : "off", millis());
+                   "{\"light\":{\"state\":\"%s\",\"timestamp\":%lu},\"cid\":\"%s\"}", 
+                   isOn ? "on" : "off", millis(), cid.c_str());
   if (n > 0 && n < (int)sizeof(payload)) {
     bool ok = mqttClient.publish(statusTopic, payload, false);
     Serial.print("[STATUS] Light -> ");
@@ -290,17 +305,19 @@ void handleControlMessage(char* topic, byte* payload, unsigned int length) {
   Serial.print("[MQTT] Payload: ");
   Serial.println(s);
 
+  String cid = jsonStringField(s, "cid");
+
   // Check if this is a status request
   String topicStr = String(topic);
   if (topicStr.indexOf("/status/request") >= 0) {
     Serial.println("[STATUS] Status request received");
     // Publish current relay status
     bool currentRelayState = digitalRead(RELAY_PIN) == LOW; // LOW = ON (as per your logic)
-    publishRelayStatus(currentRelayState);
+    publishRelayStatus(currentRelayState, cid);
     
     // Publish current LED status (reverse logic for LED_ACTIVE_LOW)
     bool currentLEDState = digitalRead(LED_BUILTIN) == (LED_ACTIVE_LOW ? LOW : HIGH);
-    publishLEDStatus(currentLEDState);
+    publishLEDStatus(currentLEDState, cid);
     return;
   }
 
@@ -335,7 +352,7 @@ void handleControlMessage(char* topic, byte* payload, unsigned int length) {
     Serial.println(")");
     
     // Publish current relay state
-    publishRelayStatus(turnOn);
+    publishRelayStatus(turnOn, cid);
   } else {
     // LED control: {"command":"light","desired_state":"on",...}
     bool turnOn = false;
@@ -367,7 +384,7 @@ void handleControlMessage(char* topic, byte* payload, unsigned int length) {
     Serial.println(")");
     
     // Publish current LED state (reverse logic)
-    publishLEDStatus(turnOn);
+    publishLEDStatus(turnOn, cid);
   }
 }
 
@@ -380,9 +397,12 @@ void ensureMqttConnected() {
     Serial.print(MQTT_PORT);
     Serial.print(" as ");
     Serial.println(clientId);
-    if (mqttClient.connect(clientId.c_str())) {
+    // Last Will: the broker publishes {"online":false} (retained) if this device drops off without disconnecting
+    if (mqttClient.connect(clientId.c_str(), statusTopic, 1, true, "{\"online\":false}")) {
       Serial.println("[MQTT] Connected");
       mqttConnected = true;
+      // Replace the retained Last Will so late subscribers see the device as online
+      mqttClient.publish(statusTopic, "{\"online\":true}", true);
       if (mqttClient.subscribe(controlTopic, 1)) {
         Serial.print("[MQTT] Subscribed: ");
         Serial.println(controlTopic);
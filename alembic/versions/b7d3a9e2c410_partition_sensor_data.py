@@ -0,0 +1,58 @@
+"""partition sensor_data by month
+
+Revision ID: b7d3a9e2c410
+Revises: 5c2e8f1d7a34
+Create Date: 2026-10-18 11:40:03.118502
+"""
+from datetime import date, datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7d3a9e2c410'
+down_revision: Union[str, None] = '5c2e8f1d7a34'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _next_month(d: date) -> date:
+    return date(d.year + (d.month == 12), d.month % 12 + 1, 1)
+
+
+def upgrade() -> None:
+    # Range partitioning is MySQL-only; other backends (SQLite in tests) keep a plain table.
+    bind = op.get_bind()
+    if bind.dialect.name != 'mysql':
+        return
+    # InnoDB partitioned tables support neither foreign keys nor unique keys that omit the
+    # partitioning column, so the FK goes and ts joins the primary key.
+    fk_names = [
+        fk['name'] for fk in sa.inspect(bind).get_foreign_keys('sensor_data')
+        if fk['referred_table'] == 'sensors'
+    ]
+    for name in fk_names:
+        op.drop_constraint(name, 'sensor_data', type_='foreignkey')
+    op.execute('ALTER TABLE sensor_data DROP PRIMARY KEY, ADD PRIMARY KEY (id, ts)')
+
+    oldest = bind.execute(sa.text('SELECT MIN(ts) FROM sensor_data')).scalar()
+    month = (oldest or datetime.utcnow()).date().replace(day=1)
+    stop = _next_month(_next_month(datetime.utcnow().date().replace(day=1)))
+    partitions = []
+    while month < stop:
+        upper = _next_month(month)
+        partitions.append(f"PARTITION p{month:%Y%m} VALUES LESS THAN (TO_DAYS('{upper:%Y-%m-%d}'))")
+        month = upper
+    partitions.append('PARTITION pmax VALUES LESS THAN MAXVALUE')
+    op.execute(f"ALTER TABLE sensor_data PARTITION BY RANGE (TO_DAYS(ts)) ({', '.join(partitions)})")
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name != 'mysql':
+        return
+    op.execute('ALTER TABLE sensor_data REMOVE PARTITIONING')
+    op.execute('ALTER TABLE sensor_data DROP PRIMARY KEY, ADD PRIMARY KEY (id)')
+    op.create_foreign_key(None, 'sensor_data', 'sensors', ['sensor_id'], ['id'])
@@ -0,0 +1,43 @@
+"""unique sensor reading per timestamp
+
+Revision ID: c4e1f7a9d2b8
+Revises: b7d3a9e2c410
+Create Date: 2026-10-18 15:02:27.640913
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e1f7a9d2b8'
+down_revision: Union[str, None] = 'b7d3a9e2c410'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name == 'mysql':
+        # Second precision would make two readings in the same second collide on the new key.
+        op.alter_column('sensor_data', 'ts', existing_type=sa.DateTime(), type_=mysql.DATETIME(fsp=3), existing_nullable=False)
+        op.execute(
+            'DELETE d FROM sensor_data d JOIN sensor_data k '
+            'ON d.sensor_id = k.sensor_id AND d.ts = k.ts AND d.id > k.id'
+        )
+    else:
+        op.execute(
+            'DELETE FROM sensor_data WHERE id NOT IN '
+            '(SELECT MIN(id) FROM sensor_data GROUP BY sensor_id, ts)'
+        )
+    op.drop_index('ix_sensor_data_sensor_ts', table_name='sensor_data')
+    op.create_index('ux_sensor_data_sensor_ts', 'sensor_data', ['sensor_id', 'ts'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ux_sensor_data_sensor_ts', table_name='sensor_data')
+    op.create_index('ix_sensor_data_sensor_ts', 'sensor_data', ['sensor_id', 'ts'], unique=False)
+    if op.get_bind().dialect.name == 'mysql':
+        op.alter_column('sensor_data', 'ts', existing_type=mysql.DATETIME(fsp=3), type_=sa.DateTime(), existing_nullable=False)
@@ -0,0 +1,33 @@
+"""control log correlation id and acknowledgement
+
+Revision ID: d2f8b6c1e4a7
+Revises: c4e1f7a9d2b8
+Create Date: 2026-10-18 16:12:09.418305
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2f8b6c1e4a7'
+down_revision: Union[str, None] = 'c4e1f7a9d2b8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('control_logs') as batch_op:
+        batch_op.add_column(sa.Column('correlation_id', sa.String(length=32), nullable=True))
+        batch_op.add_column(sa.Column('acked_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('latency_ms', sa.Float(), nullable=True))
+        batch_op.create_index('ux_control_logs_correlation_id', ['correlation_id'], unique=True)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('control_logs') as batch_op:
+        batch_op.drop_index('ux_control_logs_correlation_id')
+        batch_op.drop_column('latency_ms')
+        batch_op.drop_column('acked_at')
+        batch_op.drop_column('correlation_id')
@@ -0,0 +1,30 @@
+"""rollup dirty marks written by ingestion processes
+
+Revision ID: e6a1c3d5b7f9
+Revises: d2f8b6c1e4a7
+Create Date: 2026-10-18 18:40:27.113904
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e6a1c3d5b7f9'
+down_revision: Union[str, None] = 'd2f8b6c1e4a7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'rollup_dirty',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('since', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('rollup_dirty')
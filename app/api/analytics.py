@@ -0,0 +1,144 @@
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+
+from app.db.deps import get_db
+from app.models.models import Device, Sensor
+from app.services.aggregation import ceil_ts, naive_utc
+from app.services.analytics import (
+    SeriesTooLarge,
+    analytics_cache,
+    light_hours,
+    load_series,
+    tds_drift,
+    value_before,
+    vpd,
+    water_usage,
+)
+
+router = APIRouter(prefix="/analytics", tags=["analytics"])
+
+MAX_RANGE = timedelta(days=366)
+
+
+def _range(start: Optional[datetime], end: Optional[datetime]) -> tuple[datetime, datetime]:
+    # A default "now" is rounded up to the minute so repeated requests share a cache entry.
+    end = naive_utc(end) or ceil_ts(datetime.utcnow(), 60)
+    start = naive_utc(start) or end - timedelta(days=7)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if end - start > MAX_RANGE:
+        raise HTTPException(status_code=400, detail="Range too large; at most 366 days")
+    return start, end
+
+
+def _compute(key: tuple, end: datetime, compute: Callable[[], Any]) -> Any:
+    try:
+        return analytics_cache.get_or_compute(key, end, compute)
+    except SeriesTooLarge as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+def _sensor_pk(db: Session, sensor_id: str, sensor_type: str) -> int:
+    sensor = db.query(Sensor.id, Sensor.type).filter(Sensor.sensor_id == sensor_id).first()
+    if sensor is None or sensor.type != sensor_type:
+        raise HTTPException(status_code=404, detail=f"{sensor_type} sensor not found")
+    return sensor.id
+
+
+def _device_sensor_pk(db: Session, device_id: str, sensor_type: str) -> int:
+    # A device may have several sensors of one type; the first registered is used, so results are stable.
+    sensor = (
+        db.query(Sensor.id)
+        .join(Device, Sensor.device_id == Device.id)
+        .filter(Device.device_id == device_id, Sensor.type == sensor_type)
+        .order_by(Sensor.id)
+        .first()
+    )
+    if sensor is None:
+        raise HTTPException(status_code=404, detail=f"Device has no {sensor_type} sensor")
+    return sensor.id
+
+
+@router.get("/light-hours/{device_id}")
+def device_light_hours(
+    device_id: str,
+    db: Session = Depends(get_db),
+    target: str = Query("light", pattern="^(light|relay)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    """Hours per day the device's light (or relay) was on, from its recorded on/off states."""
+    start, end = _range(start, end)
+    sensor_pk = _device_sensor_pk(db, device_id, target)
+
+    def compute():
+        # The state at ``start`` is whatever was last reported before it.
+        previous = value_before(db, sensor_pk, start)
+        initial_on = previous is not None and previous > 0.5
+        return light_hours(load_series(db, sensor_pk, start, end), start, end, initial_on=initial_on)
+
+    result = _compute(("light_hours", sensor_pk, start, end), end, compute)
+    return {"device_id": device_id, "target": target, "start": start, "end": end, **result}
+
+
+@router.get("/water-usage/{sensor_id}")
+def sensor_water_usage(
+    sensor_id: str,
+    db: Session = Depends(get_db),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    """Litres per day and cumulatively, integrated from a waterflow sensor's L/min readings."""
+    start, end = _range(start, end)
+    sensor_pk = _sensor_pk(db, sensor_id, "waterflow")
+    result = _compute(
+        ("water_usage", sensor_pk, start, end),
+        end,
+        lambda: water_usage(load_series(db, sensor_pk, start, end), start, end),
+    )
+    return {"sensor_id": sensor_id, "start": start, "end": end, **result}
+
+
+@router.get("/tds-drift/{sensor_id}")
+def sensor_tds_drift(
+    sensor_id: str,
+    db: Session = Depends(get_db),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    """Nutrient concentration trend (ppm/day) and daily means from a TDS sensor."""
+    start, end = _range(start, end)
+    sensor_pk = _sensor_pk(db, sensor_id, "tds")
+    result = _compute(
+        ("tds_drift", sensor_pk, start, end),
+        end,
+        lambda: tds_drift(load_series(db, sensor_pk, start, end), start, end),
+    )
+    return {"sensor_id": sensor_id, "start": start, "end": end, **result}
+
+
+@router.get("/vpd/{device_id}")
+def device_vpd(
+    device_id: str,
+    db: Session = Depends(get_db),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    """Vapour pressure deficit (kPa) per hour from the device's temperature and humidity sensors."""
+    start, end = _range(start, end)
+    temperature_pk = _device_sensor_pk(db, device_id, "temperature")
+    humidity_pk = _device_sensor_pk(db, device_id, "humidity")
+    result = _compute(
+        ("vpd", temperature_pk, humidity_pk, start, end),
+        end,
+        lambda: vpd(
+            load_series(db, temperature_pk, start, end),
+            load_series(db, humidity_pk, start, end),
+            start,
+            end,
+        ),
+    )
+    return {"device_id": device_id, "start": start, "end": end, **result}
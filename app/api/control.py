@@ -1,19 +1,47 @@
 from datetime import datetime
+import asyncio
 import json
-import os
 
-from fastapi import APIRouter, Depends, HTTPException, status
-import aiomqtt
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.schemas.control import ControlRequest, ControlResponse
+from app.core.config import get_settings
+from app.db.deps import get_async_db
+from app.models.models import Device
+from app.schemas.control import CommandStats, ControlRequest, ControlResponse
+from app.services.commands import command_tracker
+from app.services.mqtt_publisher import mqtt_publisher
+from app.services.registry import device_registry
 
 router = APIRouter(prefix="/control", tags=["control"])
 
 
+@router.get("/stats", response_model=dict[str, CommandStats])
+async def command_stats():
+    """Per-device command outcomes and acknowledgement latency (recent commands), from memory."""
+    return command_tracker.latency_stats()
+
+
 @router.post("/{device_id}", response_model=ControlResponse, status_code=status.HTTP_202_ACCEPTED)
-async def send_control(device_id: str, body: ControlRequest):
-    host = os.getenv("MQTT_BROKER_HOST", "localhost")
-    port = int(os.getenv("MQTT_BROKER_PORT", "1883"))
+async def send_control(
+    device_id: str,
+    body: ControlRequest,
+    response: Response,
+    wait: bool = Query(default=False, description="Wait for the device to acknowledge the command"),
+    timeout_s: float | None = Query(default=None, gt=0, le=60, description="Acknowledgement timeout with wait=true"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    settings = get_settings()
+
+    device_pk = device_registry.device_pk(device_id)
+    if device_pk is None:
+        device_pk = (await db.execute(select(Device.id).where(Device.device_id == device_id))).scalar()
+    if device_pk is None:
+        raise HTTPException(status_code=404, detail="Device not found")
+    command = command_tracker.issue(
+        device_id, device_pk, body.target, body.desired_state, timeout_s=timeout_s if wait else None
+    )
 
     # Handle status request differently
     if body.target == "status" and body.desired_state == "request":
@@ -21,6 +49,7 @@ async def send_control(device_id: str, body: ControlRequest):
         topic = f"farm/{device_id}/status/request"
         payload = json.dumps({
             "command": "status_request",
+            "cid": command.correlation_id,
             "ts": int(datetime.utcnow().timestamp() * 1000),
             "issued_by": "api",
         })
@@ -30,19 +59,47 @@ async def send_control(device_id: str, body: ControlRequest):
         payload = json.dumps({
             "command": body.target,
             "desired_state": body.desired_state,
+            "cid": command.correlation_id,
             "ts": int(datetime.utcnow().timestamp() * 1000),
             "issued_by": "api",  # placeholder; wire auth later
         })
 
     try:
-        async with aiomqtt.Client(hostname=host, port=port) as client:
-            await client.publish(topic, payload.encode("utf-8"), qos=1, retain=True)
+        await mqtt_publisher.publish(
+            topic,
+            payload.encode("utf-8"),
+            qos=settings.mqtt_control_qos,
+            retain=True,
+            timeout=settings.mqtt_publish_timeout_s,
+        )
+    except asyncio.TimeoutError:
+        command_tracker.fail(command)
+        raise HTTPException(status_code=504, detail="MQTT publish timed out")
     except Exception as e:
+        command_tracker.fail(command)
         raise HTTPException(status_code=502, detail=f"MQTT publish failed: {e}")
+    published_at = datetime.utcnow()
+
+    result = latency_ms = None
+    if wait:
+        timeout_s = timeout_s or settings.control_ack_timeout_s
+        try:
+            result, latency_ms = await command_tracker.wait(command, timeout_s)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=504,
+                detail=f"Device did not acknowledge command {command.correlation_id} within {timeout_s}s",
+            )
+        if result != "acked":
+            raise HTTPException(status_code=504, detail=f"Command {command.correlation_id} {result}")
+        response.status_code = status.HTTP_200_OK
 
     return ControlResponse(
         device_id=device_id,
         target=body.target,
         desired_state=body.desired_state,
-        published_at=datetime.utcnow(),
+        published_at=published_at,
+        correlation_id=command.correlation_id,
+        result=result,
+        latency_ms=latency_ms,
     )
@@ -1,62 +1,79 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy import select, desc
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app.db.deps import get_db
+from app.core.config import get_settings
+from app.db.deps import get_async_db, get_db
 from app.models.models import Device, Sensor, SensorData
+from app.services.aggregation import BUCKETS, aggregate_buckets, lttb, naive_utc, raw_series
+from app.services.export import MEDIA_TYPES, arrow_available, iter_pages, stream_arrow, stream_csv, stream_ndjson
+from app.services.last_values import last_value_cache
+from app.services.response_cache import response_cache
 
 router = APIRouter(prefix="/data", tags=["data"])
 
+# LTTB reads every raw reading in the range into memory; cap it per sensor.
+LTTB_MAX_ROWS = 200_000
+
+
+@router.get("/latest")
+async def latest_bulk(
+    db: AsyncSession = Depends(get_async_db),
+    device_ids: Optional[str] = Query(None, description="Comma-separated device ids; omit for the whole farm"),
+):
+    wanted = [d for d in device_ids.split(",") if d] if device_ids else None
+    found, missing = last_value_cache.get_many(wanted)
+    if missing is None or missing:
+        found.update(await last_value_cache.load(db, missing))
+    return {
+        "devices": [
+            {"device_id": device_id, "latest": latest}
+            for device_id, latest in found.items()
+        ]
+    }
+
 
 @router.get("/latest/{device_id}")
-def latest_by_device(device_id: str, db: Session = Depends(get_db)):
-    device = db.query(Device).filter(Device.device_id == device_id).first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
-
-    sensors = db.query(Sensor).filter(Sensor.device_id == device.id).all()
-    result = {"device_id": device_id, "latest": []}
-    for s in sensors:
-        row = (
-            db.query(SensorData)
-            .filter(SensorData.sensor_id == s.id)
-            .order_by(SensorData.ts.desc())
-            .first()
-        )
-        if row:
-            result["latest"].append(
-                {
-                    "sensor_id": s.sensor_id,
-                    "type": s.type,
-                    "ts": row.ts,
-                    "value_numeric": row.value_numeric,
-                    "value_text": row.value_text,
-                }
-            )
-    return result
+async def latest_by_device(device_id: str, db: AsyncSession = Depends(get_async_db)):
+    latest = last_value_cache.get(device_id)
+    if latest is None:
+        latest = (await last_value_cache.load(db, [device_id])).get(device_id)
+        if latest is None:
+            raise HTTPException(status_code=404, detail="Device not found")
+    return {"device_id": device_id, "latest": latest}
 
 
 @router.get("/history/{sensor_id}")
-def history_by_sensor(
+async def history_by_sensor(
     sensor_id: str,
-    db: Session = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
     limit: int = Query(100, ge=1, le=1000),
     before: Optional[datetime] = None,
 ):
-    sensor = db.query(Sensor).filter(Sensor.sensor_id == sensor_id).first()
-    if not sensor:
+    lookup = await response_cache.alookup(f"history:{sensor_id}:{limit}:{before.isoformat() if before else ''}")
+    if lookup.entry is not None:
+        return response_cache.respond(request, lookup)
+
+    sensor_pk = await db.scalar(select(Sensor.id).where(Sensor.sensor_id == sensor_id))
+    if sensor_pk is None:
         raise HTTPException(status_code=404, detail="Sensor not found")
 
-    q = db.query(SensorData).filter(SensorData.sensor_id == sensor.id)
+    q = select(SensorData.ts, SensorData.value_numeric, SensorData.value_text).where(SensorData.sensor_id == sensor_pk)
     if before:
-        q = q.filter(SensorData.ts < before)
+        q = q.where(SensorData.ts < before)
     q = q.order_by(SensorData.ts.desc()).limit(limit)
 
-    rows = q.all()
-    return {
+    rows = (await db.execute(q)).all()
+    settings = get_settings()
+    # The newest page changes with every reading, so it only gets a short TTL; older pages change only on backfill.
+    ttl_s = settings.response_cache_ttl_s if before else settings.response_cache_history_ttl_s
+    await response_cache.astore(lookup, {
         "sensor_id": sensor_id,
         "count": len(rows),
         "data": [
@@ -67,4 +84,85 @@ def history_by_sensor(
             }
             for r in rows
         ],
+    }, ttl_s)
+    return response_cache.respond(request, lookup)
+
+
+@router.get("/aggregate")
+def aggregate_history(
+    sensor_ids: str = Query(..., description="Comma-separated sensor ids"),
+    db: Session = Depends(get_db),
+    bucket: str = Query("5m", pattern="^(1m|5m|1h|1d)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    downsample: Optional[str] = Query(None, pattern="^lttb$"),
+    points: int = Query(500, ge=3, le=10000),
+):
+    end = naive_utc(end) or datetime.utcnow()
+    start = naive_utc(start) or end - timedelta(days=1)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    bucket_s = BUCKETS[bucket]
+    if downsample is None and (end - start).total_seconds() / bucket_s > 10000:
+        raise HTTPException(status_code=400, detail="Range too large for bucket size; use a coarser bucket")
+
+    wanted = [s for s in sensor_ids.split(",") if s]
+    sensors = db.query(Sensor.id, Sensor.sensor_id, Sensor.type).filter(Sensor.sensor_id.in_(wanted)).all()
+    if not sensors:
+        raise HTTPException(status_code=404, detail="Sensor not found")
+
+    if downsample == "lttb":
+        series = []
+        for s in sensors:
+            rows = raw_series(db, s.id, start, end, limit=LTTB_MAX_ROWS + 1)
+            if len(rows) > LTTB_MAX_ROWS:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Range too large for lttb; at most {LTTB_MAX_ROWS} readings per sensor, narrow it",
+                )
+            sampled = lttb(rows, points)
+            series.append(
+                {
+                    "sensor_id": s.sensor_id,
+                    "type": s.type,
+                    "points": [{"ts": ts, "value": value} for ts, value in sampled],
+                }
+            )
+        return {"start": start, "end": end, "downsample": "lttb", "series": series}
+
+    buckets = aggregate_buckets(db, [s.id for s in sensors], bucket_s, start, end)
+    return {
+        "start": start,
+        "end": end,
+        "bucket": bucket,
+        "series": [
+            {"sensor_id": s.sensor_id, "type": s.type, "buckets": buckets[s.id]}
+            for s in sensors
+        ],
     }
+
+
+@router.get("/export/{sensor_id}")
+def export_history(
+    sensor_id: str,
+    db: Session = Depends(get_db),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    format: str = Query("ndjson", pattern="^(ndjson|csv|arrow)$"),
+    page_size: int = Query(5000, ge=100, le=50000),
+):
+    sensor = db.query(Sensor.id).filter(Sensor.sensor_id == sensor_id).first()
+    if not sensor:
+        raise HTTPException(status_code=404, detail="Sensor not found")
+    if format == "arrow" and not arrow_available():
+        raise HTTPException(status_code=400, detail="Arrow export requires pyarrow on the server")
+
+    # The generator opens its own session: the request-scoped one is closed before streaming starts.
+    pages = iter_pages(sensor.id, start, end, page_size)
+    encoders = {"ndjson": stream_ndjson, "csv": stream_csv, "arrow": stream_arrow}
+    extension = {"ndjson": "ndjson", "csv": "csv", "arrow": "arrows"}[format]
+    return StreamingResponse(
+        encoders[format](sensor_id, pages),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{sensor_id}.{extension}"'},
+    )
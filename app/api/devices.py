@@ -1,9 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Literal
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
 from sqlalchemy.orm import Session, joinedload
 
 from app.db.deps import get_db
 from app.models.models import Device, Sensor
-from app.schemas.devices import DeviceCreate, DeviceRead, SensorCreate, SensorRead
+from app.schemas.devices import DeviceCreate, DevicePresence, DeviceRead, SensorCreate, SensorRead
+from app.services.last_values import last_value_cache
+from app.services.presence import presence_tracker
+from app.services.registry import device_registry
+from app.services.response_cache import DEVICES_TAG, response_cache
 
 router = APIRouter(prefix="/devices", tags=["devices"])
 
@@ -13,17 +19,31 @@ def register_device(payload: DeviceCreate, db: Session = Depends(get_db)):
     existing = db.query(Device).options(joinedload(Device.sensors)).filter(Device.device_id == payload.device_id).first()
     if existing:
         return existing
-    device = Device(device_id=payload.device_id, type=payload.type, location=payload.location, status="online")
+    # Presence is set by the tracker once the device is actually heard from.
+    device = Device(device_id=payload.device_id, type=payload.type, location=payload.location)
     db.add(device)
     db.commit()
     db.refresh(device)
+    device_registry.invalidate_device(device.device_id)
+    last_value_cache.mark_empty(device.device_id)
+    presence_tracker.add(device.device_id, device.status)
+    response_cache.invalidate(DEVICES_TAG)
     return device
 
 
 @router.get("/", response_model=list[DeviceRead])
-def list_devices(db: Session = Depends(get_db)):
-    devices = db.query(Device).options(joinedload(Device.sensors)).order_by(Device.id.desc()).all()
-    return devices
+def list_devices(request: Request, db: Session = Depends(get_db)):
+    lookup = response_cache.lookup("devices", (DEVICES_TAG,))
+    if lookup.entry is None:
+        devices = db.query(Device).options(joinedload(Device.sensors)).order_by(Device.id.desc()).all()
+        response_cache.store(lookup, [DeviceRead.model_validate(d) for d in devices])
+    return response_cache.respond(request, lookup)
+
+
+@router.get("/presence", response_model=list[DevicePresence])
+def device_presence(state: Literal["online", "offline", "unknown"] | None = Query(default=None, alias="status")):
+    """Online/offline state of every device, served from memory without touching the DB."""
+    return presence_tracker.snapshot(state)
 
 
 @router.post("/{device_id}/sensors", response_model=SensorRead, status_code=status.HTTP_201_CREATED)
@@ -38,4 +58,6 @@ def add_sensor(device_id: str, payload: SensorCreate, db: Session = Depends(get_
     db.add(sensor)
     db.commit()
     db.refresh(sensor)
+    device_registry.invalidate_sensor(sensor.sensor_id)
+    response_cache.invalidate(DEVICES_TAG)
     return sensor
@@ -0,0 +1,42 @@
+from fastapi import APIRouter, HTTPException, Request
+
+from app.core.config import get_settings
+from app.schemas.inference import PredictionResponse
+from app.services.inference import ModelUnavailable, inference_service
+
+router = APIRouter(prefix="/inference", tags=["inference"])
+
+
+async def _read_image(request: Request, limit: int) -> bytes:
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith("image/") and content_type != "application/octet-stream":
+        raise HTTPException(status_code=415, detail="Send the image as the request body with an image/* content type")
+    declared = request.headers.get("content-length")
+    if declared is not None and declared.isdigit() and int(declared) > limit:
+        raise HTTPException(status_code=413, detail=f"Image larger than {limit} bytes")
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            raise HTTPException(status_code=413, detail=f"Image larger than {limit} bytes")
+    if not body:
+        raise HTTPException(status_code=400, detail="Empty request body")
+    return bytes(body)
+
+
+@router.post(
+    "/plant-disease",
+    response_model=PredictionResponse,
+    openapi_extra={"requestBody": {"content": {"image/*": {"schema": {"type": "string", "format": "binary"}}}, "required": True}},
+)
+async def classify_plant_disease(request: Request):
+    """Classify a leaf photo (JPEG/PNG bytes as the request body) with the plant disease model."""
+    if not inference_service.ready:
+        raise HTTPException(status_code=503, detail="No inference model loaded")
+    data = await _read_image(request, get_settings().inference_max_upload_bytes)
+    try:
+        return await inference_service.classify(data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ModelUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
@@ -1,16 +1,157 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+import asyncio
 import json
+from typing import Any
 
-from app.services.event_bus import event_bus
+from app.core.config import get_settings
+from app.core.metrics import Counter, Gauge
+from app.services.event_bus import Subscription, event_bus
+from app.services.farm_stream import FarmStream
 
 router = APIRouter(prefix="/realtime", tags=["realtime"])
 
+WS_CONNECTIONS = Gauge("websocket_connections", "Connected WebSocket clients", ("stream",))
+WS_MESSAGES_SENT = Counter("websocket_messages_sent_total", "Messages sent to WebSocket clients", ("stream",))
+WS_FRAMES_SENT = Counter("websocket_frames_sent_total", "WebSocket frames sent (one batch of messages each)", ("stream",))
+
+
+async def _close_on_disconnect(websocket: WebSocket, sub: Subscription) -> None:
+    # Clients never send on this stream, so any receive returning means they went away.
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+    finally:
+        sub.close()
+
 
 @router.websocket("/{device_id}")
 async def ws_device_stream(websocket: WebSocket, device_id: str):
     await websocket.accept()
+    sub = event_bus.open(device_id)
+    watcher = asyncio.create_task(_close_on_disconnect(websocket, sub))
+    WS_CONNECTIONS.inc(stream="device")
     try:
-        async for event in event_bus.subscribe(device_id):
+        async for event in sub:
             await websocket.send_text(json.dumps(event))
+            WS_MESSAGES_SENT.inc(stream="device")
+    except WebSocketDisconnect:
+        return
+    finally:
+        WS_CONNECTIONS.dec(stream="device")
+        watcher.cancel()
+        sub.close()
+
+
+def _names(value: Any) -> list[str] | None:
+    # Accepts a list or a comma-separated string, so query params and control messages share one parser.
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError("expected a list of strings")
+    return [item.strip() for item in value if item.strip()]
+
+
+def _apply_control(stream: FarmStream, message: Any) -> dict:
+    """Apply one client control message and return the acknowledgement to send back."""
+    if not isinstance(message, dict):
+        raise ValueError("control messages must be JSON objects")
+    action = message.get("action")
+    if action not in ("subscribe", "unsubscribe", "filter"):
+        raise ValueError("action must be subscribe, unsubscribe or filter")
+    throttle_ms = message.get("throttle_ms")
+    if throttle_ms is not None and (isinstance(throttle_ms, bool) or not isinstance(throttle_ms, (int, float)) or throttle_ms < 0):
+        raise ValueError("throttle_ms must be a non-negative number")
+    alerts_only = message.get("alerts_only")
+    if alerts_only is not None and not isinstance(alerts_only, bool):
+        raise ValueError("alerts_only must be a boolean")
+    devices = _names(message.get("devices")) or []
+    if action == "unsubscribe":
+        stream.unsubscribe(devices)
+    else:
+        stream.set_filter(
+            sensor_types=_names(message.get("sensor_types")),
+            alerts_only=alerts_only,
+            throttle_s=throttle_ms / 1000 if throttle_ms is not None else None,
+        )
+        stream.subscribe(devices)
+    return {
+        "type": "ack",
+        "action": action,
+        "devices": sorted(stream.devices),
+        "sensor_types": sorted(stream.sensor_types) if stream.sensor_types else None,
+        "alerts_only": stream.alerts_only,
+        "throttle_ms": round(stream.throttle_s * 1000),
+    }
+
+
+async def _read_controls(websocket: WebSocket, stream: FarmStream) -> None:
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            try:
+                control = json.loads(message.get("text") or message.get("bytes") or b"")
+            except ValueError:
+                stream.reply({"type": "error", "detail": "control messages must be JSON"})
+                continue
+            try:
+                stream.reply(_apply_control(stream, control))
+            except ValueError as exc:
+                stream.reply({"type": "error", "detail": str(exc)})
+    finally:
+        stream.close()
+
+
+@router.websocket("/farm/stream")
+async def ws_farm_stream(
+    websocket: WebSocket,
+    devices: str | None = None,
+    sensor_types: str | None = None,
+    alerts_only: bool = False,
+    throttle_ms: int = 0,
+):
+    """Many devices over one socket. Frames are ``{"type": "batch", "events": [...]}``.
+
+    Initial devices and filters may be given as query params; afterwards the client sends
+    ``{"action": "subscribe" | "unsubscribe" | "filter", "devices": [...], "sensor_types": [...],
+    "alerts_only": bool, "throttle_ms": int}`` and gets an ``ack`` (or ``error``) in the stream.
+    """
+    settings = get_settings()
+    await websocket.accept()
+    stream = FarmStream(
+        event_bus,
+        max_pending=settings.realtime_stream_queue_max,
+        max_devices=settings.realtime_max_devices,
+        batch_max=settings.realtime_batch_max,
+        batch_window_s=settings.realtime_batch_window_ms / 1000,
+        min_throttle_s=settings.realtime_min_throttle_ms / 1000,
+    )
+    if devices or sensor_types or alerts_only or throttle_ms:
+        try:
+            stream.reply(_apply_control(stream, {
+                "action": "subscribe",
+                "devices": devices,
+                "sensor_types": sensor_types,
+                "alerts_only": alerts_only,
+                "throttle_ms": throttle_ms,
+            }))
+        except ValueError as exc:
+            stream.reply({"type": "error", "detail": str(exc)})
+    reader = asyncio.create_task(_read_controls(websocket, stream))
+    WS_CONNECTIONS.inc(stream="farm")
+    try:
+        while (batch := await stream.next_batch()) is not None:
+            await websocket.send_text(json.dumps({"type": "batch", "events": batch}))
+            WS_MESSAGES_SENT.inc(len(batch), stream="farm")
+            WS_FRAMES_SENT.inc(stream="farm")
     except WebSocketDisconnect:
         return
+    finally:
+        WS_CONNECTIONS.dec(stream="farm")
+        reader.cancel()
+        stream.close()
@@ -1,21 +1,87 @@
 from fastapi import APIRouter
 
+from app.api.analytics import router as analytics_router
 from app.api.devices import router as devices_router
+from app.api.inference import router as inference_router
 from app.api.control import router as control_router
 from app.api.data import router as data_router
 from app.api.realtime import router as realtime_router
 from app.api.thresholds import router as thresholds_router
+from app.services.analytics import analytics_cache
+from app.services.event_bus import event_bus
+from app.services.inference import inference_service
+from app.services.ingest import ingest_pipeline
+from app.services.last_values import last_value_cache
+from app.services.mqtt_publisher import mqtt_publisher
+from app.services.registry import device_registry
+from app.services.response_cache import response_cache
+from app.services.retention import retention_manager
+from app.services.rollups import rollup_compactor
 
 api_router = APIRouter()
 
+# The stats handlers read state owned by the event loop, so they run on it rather than in the threadpool.
+
 
 @api_router.get("/health")
 def api_health():
     return {"status": "ok"}
 
 
+@api_router.get("/stats/ingest")
+async def ingest_stats():
+    return ingest_pipeline.stats()
+
+
+@api_router.get("/stats/registry")
+async def registry_stats():
+    return device_registry.stats()
+
+
+@api_router.get("/stats/publisher")
+async def publisher_stats():
+    return mqtt_publisher.stats()
+
+
+@api_router.get("/stats/event-bus")
+async def event_bus_stats():
+    return event_bus.stats()
+
+
+@api_router.get("/stats/last-values")
+async def last_values_stats():
+    return last_value_cache.stats()
+
+
+@api_router.get("/stats/rollups")
+async def rollup_stats():
+    return rollup_compactor.stats()
+
+
+@api_router.get("/stats/retention")
+async def retention_stats():
+    return retention_manager.stats()
+
+
+@api_router.get("/stats/analytics")
+async def analytics_stats():
+    return analytics_cache.stats()
+
+
+@api_router.get("/stats/inference")
+async def inference_stats():
+    return inference_service.stats()
+
+
+@api_router.get("/stats/response-cache")
+async def response_cache_stats():
+    return response_cache.stats()
+
+
 api_router.include_router(devices_router)
 api_router.include_router(control_router)
 api_router.include_router(data_router)
 api_router.include_router(realtime_router)
 api_router.include_router(thresholds_router)
+api_router.include_router(analytics_router)
+api_router.include_router(inference_router)
@@ -1,9 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
 
 from app.db.deps import get_db
 from app.models.models import Device, Threshold
+from app.services.response_cache import response_cache, thresholds_tag
+from app.services.threshold_engine import threshold_engine
 
 router = APIRouter(prefix="/thresholds", tags=["thresholds"])
 
@@ -37,6 +39,8 @@ def upsert_threshold(device_id: str, payload: ThresholdPayload, db: Session = De
         item.max_value = payload.max_value
     db.commit()
     db.refresh(item)
+    threshold_engine.set(item)
+    response_cache.invalidate(thresholds_tag(device_id))
     return {
         "device_id": device_id,
         "sensor_type": item.sensor_type,
@@ -46,16 +50,19 @@ def upsert_threshold(device_id: str, payload: ThresholdPayload, db: Session = De
 
 
 @router.get("/{device_id}")
-def list_thresholds(device_id: str, db: Session = Depends(get_db)):
-    device = db.query(Device).filter(Device.device_id == device_id).first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
-    rows = db.query(Threshold).filter(Threshold.device_id == device.id).all()
-    return [
-        {
-            "sensor_type": r.sensor_type,
-            "min_value": r.min_value,
-            "max_value": r.max_value,
-        }
-        for r in rows
-    ]
+def list_thresholds(device_id: str, request: Request, db: Session = Depends(get_db)):
+    lookup = response_cache.lookup(f"thresholds:{device_id}", (thresholds_tag(device_id),))
+    if lookup.entry is None:
+        device = db.query(Device).filter(Device.device_id == device_id).first()
+        if not device:
+            raise HTTPException(status_code=404, detail="Device not found")
+        rows = db.query(Threshold).filter(Threshold.device_id == device.id).all()
+        response_cache.store(lookup, [
+            {
+                "sensor_type": r.sensor_type,
+                "min_value": r.min_value,
+                "max_value": r.max_value,
+            }
+            for r in rows
+        ])
+    return response_cache.respond(request, lookup)
@@ -2,17 +2,114 @@ from pydantic_settings import BaseSettings
 from functools import lru_cache
 
 
-class Settings(BaseSettings):
+class DatabaseSettings(BaseSettings):
+    """Just what the database engine needs, so alembic and CLI jobs run without the app's secrets."""
+
+    db_url: str | None = None
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout_s: float = 30.0
+    db_pool_recycle_s: int = 3600
+
+    class Config:
+        env_file = ".env"
+        case_sensitive = False
+        # The .env file also holds every other setting.
+        extra = "ignore"
+
+
+class Settings(DatabaseSettings):
     app_env: str = "development"
     secret_key: str
     access_token_expire_minutes: int = 60 * 24 * 30
 
-    db_url: str | None = None
-
     mqtt_broker_host: str = "localhost"
     mqtt_broker_port: int = 1883
     mqtt_username: str | None = None
     mqtt_password: str | None = None
+    mqtt_publisher_queue_max: int = 1000
+    mqtt_publish_timeout_s: float = 5.0
+    mqtt_alert_qos: int = 1
+    mqtt_control_qos: int = 1
+    mqtt_ingest_in_api: bool = True
+    mqtt_shared_group: str | None = None
+    # Latest readings served by the API are reloaded from the DB after this long when other
+    # processes ingest some of the telemetry (ingest off in the API, or a shared subscription group)
+    last_value_cache_ttl_s: float = 5.0
+    # Commands not acknowledged by a status reply within this time are logged as timed out
+    control_ack_timeout_s: float = 10.0
+    control_log_flush_interval_s: float = 1.0
+
+    ingest_queue_max: int = 10000
+    ingest_batch_size: int = 500
+    ingest_flush_interval_s: float = 1.0
+    telemetry_max_clock_skew_s: float = 300.0
+    telemetry_max_backfill_s: float = 86400.0
+
+    alert_cooldown_s: float = 300.0
+    alert_hysteresis_ratio: float = 0.02
+    # Thresholds are reloaded from the DB this often, so edits reach ingestion workers; 0 disables
+    threshold_reload_interval_s: float = 30.0
+
+    # Streaming anomaly detection (spike, drift, rate of change, stuck sensor); see app/services/anomaly.py
+    anomaly_enabled: bool = True
+    anomaly_window: int = 500
+    anomaly_min_samples: int = 30
+    anomaly_z_threshold: float = 4.0
+    anomaly_drift_threshold: float = 3.0
+    anomaly_stuck_count: int = 30
+    anomaly_stuck_s: float = 600.0
+    anomaly_cooldown_s: float = 300.0
+    anomaly_max_rate_by_type: str | None = None
+    anomaly_snapshot_path: str | None = "anomaly_state.json"
+    anomaly_snapshot_interval_s: float = 60.0
+
+    rollup_enabled: bool = True
+    rollup_interval_s: float = 60.0
+    rollup_lag_s: float = 120.0
+
+    retention_enabled: bool = False
+    retention_raw_days: int = 90
+    retention_by_type: str | None = None
+    retention_archive_dir: str = "archive"
+    retention_archive_format: str = "csv"
+    retention_delete_chunk: int = 5000
+    retention_interval_s: float = 3600.0
+
+    event_bus_queue_max: int = 100
+    event_bus_policy: str = "drop_oldest"
+    # "memory" serves streams only from the ingesting process; "mqtt" fans events out through the broker.
+    event_bus_backend: str = "memory"
+    event_bus_topic_prefix: str = "vfarm/events"
+    # Multiplexed /realtime/farm/stream connections
+    realtime_stream_queue_max: int = 1000
+    realtime_max_devices: int = 500
+    realtime_batch_max: int = 200
+    realtime_batch_window_ms: int = 50
+    realtime_min_throttle_ms: int = 0
+
+    # Devices silent for this long are marked offline; presence is written back in batches
+    presence_offline_timeout_s: float = 120.0
+    presence_flush_interval_s: float = 5.0
+
+    # Plant disease classifier (.h5/.keras, or a converted .tflite/.onnx); unset disables /inference
+    inference_model_path: str | None = None
+    inference_labels_path: str | None = None
+    inference_img_size: int = 224
+    inference_batch_max: int = 16
+    inference_batch_window_ms: int = 10
+    inference_decode_workers: int = 2
+    inference_model_threads: int = 2
+    inference_cache_size: int = 1024
+    inference_max_upload_bytes: int = 10_000_000
+
+    # ETag'd response cache for the device list, thresholds and sensor history; "redis" shares it across processes
+    response_cache_enabled: bool = True
+    response_cache_backend: str = "memory"
+    response_cache_redis_url: str = "redis://localhost:6379/0"
+    response_cache_ttl_s: float = 30.0
+    response_cache_history_ttl_s: float = 5.0
+    response_cache_max_entries: int = 1024
 
     websocket_allowed_origins: str | None = None
     log_level: str = "INFO"
@@ -20,8 +117,14 @@ class Settings(BaseSettings):
     class Config:
         env_file = ".env"
         case_sensitive = False
+        extra = "forbid"
 
 
 @lru_cache
 def get_settings() -> Settings:
     return Settings()  # type: ignore[call-arg]
+
+
+@lru_cache
+def get_db_settings() -> DatabaseSettings:
+    return DatabaseSettings()
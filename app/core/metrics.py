@@ -0,0 +1,201 @@
+"""Minimal Prometheus-compatible metrics (text exposition format 0.0.4), no client library needed.
+
+Metrics register themselves on creation and are rendered by ``/metrics``::
+
+    MESSAGES = Counter("mqtt_messages_total", "MQTT messages handled", ("kind",))
+    MESSAGES.inc(kind="temperature")
+
+    COMMIT_SECONDS = Histogram("db_commit_seconds", "DB commit time", ("op",))
+    with timed(COMMIT_SECONDS, op="sensor_batch"):
+        ...
+
+Values that already live on a service (queue depths, running totals) are exported with ``fn=``
+so they are read at scrape time instead of being updated on the hot path. Several metrics read
+from one costly ``stats()`` call share it through ``per_scrape``.
+"""
+import asyncio
+import functools
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Iterable
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: list["Metric"] = []
+_registry_lock = threading.Lock()
+_scrape = 0
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        fn: Callable[[], float] | None = None,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.fn = fn
+        self._lock = threading.Lock()
+        self._values: dict[tuple[str, ...], Any] = {}
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: dict[str, Any]) -> tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterable[str]:
+        if self.fn is not None:
+            yield f"{self.name} {_format_value(self.fn())}"
+            return
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (last slot is +Inf), then sum.
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def time(self, **labels: Any) -> "timed":
+        return timed(self, **labels)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}"
+
+
+class timed:
+    """Observe elapsed seconds into a histogram; works as a context manager or a (sync/async) decorator."""
+
+    __slots__ = ("histogram", "labels", "_started")
+
+    def __init__(self, histogram: Histogram, **labels: Any) -> None:
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "timed":
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.histogram.observe(time.perf_counter() - self._started, **self.labels)
+
+    def __call__(self, func: Callable) -> Callable:
+        histogram, labels = self.histogram, self.labels
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with timed(histogram, **labels):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with timed(histogram, **labels):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+def per_scrape(fn: Callable[[], Any]) -> Callable[[], Any]:
+    """Wrap ``fn`` so it runs at most once per ``render()``."""
+    cached: list[Any] = [None, None]
+
+    def wrapper() -> Any:
+        if cached[0] != _scrape:
+            cached[:] = [_scrape, fn()]
+        return cached[1]
+
+    return wrapper
+
+
+def render() -> str:
+    global _scrape
+    with _registry_lock:
+        _scrape += 1
+        metrics = list(_registry)
+    return "\n".join(metric.render() for metric in metrics) + "\n"
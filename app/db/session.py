@@ -1,12 +1,27 @@
-from sqlalchemy import create_engine
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 import os
+import zlib
+
+from app.core.config import get_db_settings
+from app.core.metrics import Histogram
 
 
 class Base(DeclarativeBase):
     pass
 
 
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
 def build_db_url() -> str:
     db_url = os.getenv("DB_URL")
     if db_url:
@@ -20,5 +35,75 @@ def build_db_url() -> str:
     return f"mysql+pymysql://{user}:{password}@{host}:{port}/{database}"
 
 
-engine = create_engine(build_db_url(), pool_pre_ping=True, pool_recycle=3600)
+def build_async_db_url() -> str:
+    db_url = os.getenv("DB_ASYNC_URL")
+    if db_url:
+        return db_url
+    # Same database as the sync engine, through the matching asyncio driver
+    url = make_url(build_db_url())
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername)).render_as_string(hide_password=False)
+
+
+def _pool_options(url: str) -> dict:
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    settings = get_db_settings()
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout_s,
+        "pool_recycle": settings.db_pool_recycle_s,
+    }
+
+
+DB_COMMIT_SECONDS = Histogram("db_commit_seconds", "Time to execute and commit a database write", ("op",))
+
+engine = create_engine(build_db_url(), pool_pre_ping=True, **_pool_options(build_db_url()))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+
+@contextmanager
+def advisory_lock(name: str) -> Iterator[bool]:
+    """Hold a database-wide named lock for the block; yields False, without waiting, if another process has it.
+
+    Keeps periodic jobs to one process when the API runs several workers. MySQL ``GET_LOCK`` and PostgreSQL
+    advisory locks belong to a connection, so one is held open for the block. Other backends (SQLite) have
+    no such lock and always acquire.
+    """
+    dialect = engine.dialect.name
+    if dialect == "mysql":
+        acquire, release, params = "SELECT GET_LOCK(:key, 0)", "SELECT RELEASE_LOCK(:key)", {"key": name}
+    elif dialect == "postgresql":
+        acquire, release = "SELECT pg_try_advisory_lock(:key)", "SELECT pg_advisory_unlock(:key)"
+        params = {"key": zlib.crc32(name.encode())}
+    else:
+        yield True
+        return
+    with engine.connect() as conn:
+        acquired = bool(conn.execute(text(acquire), params).scalar())
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                conn.execute(text(release), params)
+
+
+_async_engine: AsyncEngine | None = None
+_async_sessionmaker: async_sessionmaker[AsyncSession] | None = None
+
+
+def get_async_engine() -> AsyncEngine:
+    # Created on first use so sync-only tooling (alembic, CLI jobs) doesn't need the async driver.
+    global _async_engine
+    if _async_engine is None:
+        url = build_async_db_url()
+        _async_engine = create_async_engine(url, pool_pre_ping=True, **_pool_options(url))
+    return _async_engine
+
+
+def AsyncSessionLocal() -> AsyncSession:
+    global _async_sessionmaker
+    if _async_sessionmaker is None:
+        _async_sessionmaker = async_sessionmaker(get_async_engine(), autoflush=False, expire_on_commit=False)
+    return _async_sessionmaker()
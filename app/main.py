@@ -1,18 +1,103 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 import asyncio
-import os
+import logging
+import time
 
 from app.api.routes import api_router
-from app.services.mqtt_service import mqtt_runner
+from app.core import metrics
+from app.core.config import get_settings
+from app.services.commands import command_tracker
+from app.services.event_bus import require_shared_event_bus
+from app.services.inference import inference_service
+from app.services.last_values import last_value_cache
+from app.services.mqtt_service import mqtt_runner, start_ingest_services, stop_ingest_services
+from app.services.response_cache import build_cache_backend, response_cache
+from app.services.retention import parse_retention, retention_manager
+from app.services.rollups import rollup_compactor
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Vertical Farming IoT Backend", version="0.1.0")
 
+HTTP_SECONDS = metrics.Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route", "status")
+)
+
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template, not raw path, so ids in URLs don't explode the series count.
+    route = request.scope.get("route")
+    HTTP_SECONDS.observe(
+        time.perf_counter() - started,
+        method=request.method,
+        route=route.path if route is not None else "unmatched",
+        status=response.status_code,
+    )
+    return response
+
 
 @app.on_event("startup")
 async def startup_event() -> None:
-    host = os.getenv("MQTT_BROKER_HOST", "localhost")
-    port = int(os.getenv("MQTT_BROKER_PORT", "1883"))
-    asyncio.create_task(mqtt_runner(host, port))
+    settings = get_settings()
+    if not settings.mqtt_ingest_in_api:
+        require_shared_event_bus(settings)
+    response_cache.configure(
+        enabled=settings.response_cache_enabled,
+        ttl_s=settings.response_cache_ttl_s,
+        backend=build_cache_backend(settings),
+    )
+    # The cache only stays current on its own when this process ingests every reading.
+    sole_ingester = settings.mqtt_ingest_in_api and not settings.mqtt_shared_group
+    last_value_cache.configure(ttl_s=None if sole_ingester else settings.last_value_cache_ttl_s)
+    await start_ingest_services(ingest=settings.mqtt_ingest_in_api)
+    command_tracker.configure(
+        ack_timeout_s=settings.control_ack_timeout_s,
+        flush_interval_s=settings.control_log_flush_interval_s,
+    )
+    command_tracker.start()
+    if settings.rollup_enabled:
+        rollup_compactor.configure(interval_s=settings.rollup_interval_s, lag_s=settings.rollup_lag_s)
+        rollup_compactor.start()
+    if settings.retention_enabled:
+        retention_manager.configure(
+            default_days=settings.retention_raw_days,
+            days_by_type=parse_retention(settings.retention_by_type),
+            archive_dir=settings.retention_archive_dir,
+            archive_format=settings.retention_archive_format,
+            chunk_size=settings.retention_delete_chunk,
+            interval_s=settings.retention_interval_s,
+        )
+        retention_manager.start()
+    if settings.inference_model_path:
+        inference_service.configure(
+            model_path=settings.inference_model_path,
+            labels_path=settings.inference_labels_path,
+            img_size=settings.inference_img_size,
+            batch_max=settings.inference_batch_max,
+            batch_window_ms=settings.inference_batch_window_ms,
+            decode_workers=settings.inference_decode_workers,
+            model_threads=settings.inference_model_threads,
+            cache_size=settings.inference_cache_size,
+        )
+        await inference_service.start()
+    if settings.mqtt_ingest_in_api:
+        # Off when ingestion runs in separate `python -m app.worker` processes.
+        asyncio.create_task(
+            mqtt_runner(settings.mqtt_broker_host, settings.mqtt_broker_port, shared_group=settings.mqtt_shared_group)
+        )
+
+
+@app.on_event("shutdown")
+async def shutdown_event() -> None:
+    await command_tracker.stop()
+    await stop_ingest_services()
+    await rollup_compactor.stop()
+    await retention_manager.stop()
+    await inference_service.stop()
 
 
 @app.get("/")
@@ -25,5 +110,11 @@ def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    # Runs on the event loop so the fn= gauges don't read service state from another thread.
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 # Versioned API
 app.include_router(api_router, prefix="/api/v1")
@@ -1,4 +1,5 @@
 from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Float, Text, Index
+from sqlalchemy.dialects import mysql
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from datetime import datetime
 
@@ -48,12 +49,18 @@ class Sensor(Base):
 class SensorData(Base):
     __tablename__ = "sensor_data"
     __table_args__ = (
-        Index("ix_sensor_data_sensor_ts", "sensor_id", "ts"),
+        # One reading per sensor and instant, so redelivered MQTT messages are not stored twice.
+        Index("ux_sensor_data_sensor_ts", "sensor_id", "ts", unique=True),
     )
 
+    # On MySQL the table is range-partitioned by ts (migration b7d3a9e2c410): the primary key there is
+    # (id, ts) and the foreign key below doesn't exist in the database, because InnoDB partitioned tables
+    # can't have one. It stays declared for the ORM relationship; alembic/env.py excludes it on MySQL.
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     sensor_id: Mapped[int] = mapped_column(ForeignKey("sensors.id"), index=True, nullable=False)
-    ts: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True, nullable=False)
+    ts: Mapped[datetime] = mapped_column(
+        DateTime().with_variant(mysql.DATETIME(fsp=3), "mysql"), default=datetime.utcnow, index=True, nullable=False
+    )
     value_numeric: Mapped[float | None] = mapped_column(Float, nullable=True)
     value_text: Mapped[str | None] = mapped_column(Text, nullable=True)
 
@@ -64,6 +71,7 @@ class ControlLog(Base):
     __tablename__ = "control_logs"
     __table_args__ = (
         Index("ix_control_logs_device_ts", "device_id", "ts"),
+        Index("ux_control_logs_correlation_id", "correlation_id", unique=True),
     )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -73,6 +81,10 @@ class ControlLog(Base):
     user_id: Mapped[int | None] = mapped_column(ForeignKey("users.id"), nullable=True)
     ts: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True, nullable=False)
     result: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    # Echoed back by the device in its status reply; acked_at/latency_ms are set when it arrives.
+    correlation_id: Mapped[str | None] = mapped_column(String(32), nullable=True)
+    acked_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    latency_ms: Mapped[float | None] = mapped_column(Float, nullable=True)
 
 
 class Threshold(Base):
@@ -87,3 +99,46 @@ class Threshold(Base):
     min_value: Mapped[float | None] = mapped_column(Float, nullable=True)
     max_value: Mapped[float | None] = mapped_column(Float, nullable=True)
     last_alerted_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+
+class SensorRollup1m(Base):
+    __tablename__ = "sensor_rollup_1m"
+    __table_args__ = (
+        Index("ux_sensor_rollup_1m_sensor_bucket", "sensor_id", "bucket_start", unique=True),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    sensor_id: Mapped[int] = mapped_column(ForeignKey("sensors.id"), nullable=False)
+    bucket_start: Mapped[datetime] = mapped_column(DateTime, index=True, nullable=False)
+    value_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    value_sum: Mapped[float] = mapped_column(Float, nullable=False)
+    value_min: Mapped[float] = mapped_column(Float, nullable=False)
+    value_max: Mapped[float] = mapped_column(Float, nullable=False)
+    last_ts: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    last_value: Mapped[float] = mapped_column(Float, nullable=False)
+
+
+class SensorRollup1h(Base):
+    __tablename__ = "sensor_rollup_1h"
+    __table_args__ = (
+        Index("ux_sensor_rollup_1h_sensor_bucket", "sensor_id", "bucket_start", unique=True),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    sensor_id: Mapped[int] = mapped_column(ForeignKey("sensors.id"), nullable=False)
+    bucket_start: Mapped[datetime] = mapped_column(DateTime, index=True, nullable=False)
+    value_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    value_sum: Mapped[float] = mapped_column(Float, nullable=False)
+    value_min: Mapped[float] = mapped_column(Float, nullable=False)
+    value_max: Mapped[float] = mapped_column(Float, nullable=False)
+    last_ts: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    last_value: Mapped[float] = mapped_column(Float, nullable=False)
+
+
+class RollupDirty(Base):
+    """Oldest reading of a batch that landed behind the rollup watermark; consumed by the compactor."""
+
+    __tablename__ = "rollup_dirty"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    since: Mapped[datetime] = mapped_column(DateTime, nullable=False)
@@ -12,3 +12,18 @@ class ControlResponse(BaseModel):
     target: str
     desired_state: str
     published_at: datetime
+    correlation_id: str
+    # Set only with wait=true: "acked" once the device's status reply arrives
+    result: str | None = None
+    latency_ms: float | None = None
+
+
+class CommandStats(BaseModel):
+    sent: int
+    acked: int
+    timeouts: int
+    failed: int
+    pending: int
+    p50_ms: float | None = None
+    p95_ms: float | None = None
+    max_ms: float | None = None
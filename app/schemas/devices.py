@@ -38,3 +38,10 @@ class DeviceRead(DeviceBase):
 
     class Config:
         from_attributes = True
+
+
+class DevicePresence(BaseModel):
+    device_id: str
+    status: str
+    last_seen_at: datetime | None
+    since: datetime | None
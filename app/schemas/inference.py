@@ -0,0 +1,17 @@
+from pydantic import BaseModel
+
+
+class ClassScore(BaseModel):
+    label: str
+    confidence: float
+
+
+class PredictionResponse(BaseModel):
+    label: str
+    confidence: float
+    top: list[ClassScore]
+    model: str
+    sha256: str
+    # True when an identical image was classified before and the cached result is returned
+    cached: bool
+    latency_ms: float
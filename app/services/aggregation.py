@@ -0,0 +1,236 @@
+from datetime import datetime, timedelta, timezone
+from typing import Any, Sequence
+
+from sqlalchemy import Integer, cast, func, select, text
+from sqlalchemy.orm import Session
+
+from app.models.models import SensorData, SensorRollup1h, SensorRollup1m
+
+BUCKETS = {"1m": 60, "5m": 300, "1h": 3600, "1d": 86400}
+ROLLUPS = ((SensorRollup1m, 60), (SensorRollup1h, 3600))
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def epoch_seconds(column, dialect: str):
+    """Portable naive-UTC DATETIME -> unix seconds expression."""
+    if dialect == "sqlite":
+        return cast(func.strftime("%s", column), Integer)
+    # TIMESTAMPDIFF ignores the session time zone, unlike UNIX_TIMESTAMP.
+    return func.timestampdiff(text("SECOND"), "1970-01-01 00:00:00", column)
+
+
+def naive_utc(ts: datetime | None) -> datetime | None:
+    """Readings are stored as naive UTC; convert an aware query bound to match."""
+    if ts is None or ts.tzinfo is None:
+        return ts
+    return ts.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def floor_ts(ts: datetime, bucket_s: int) -> datetime:
+    epoch = int((ts - EPOCH).total_seconds())
+    return EPOCH + timedelta(seconds=epoch - epoch % bucket_s)
+
+
+def ceil_ts(ts: datetime, bucket_s: int) -> datetime:
+    floored = floor_ts(ts, bucket_s)
+    return floored if floored == ts else floored + timedelta(seconds=bucket_s)
+
+
+def bucket_rows(
+    db: Session,
+    source,
+    bucket_s: int,
+    start: datetime,
+    end: datetime,
+    sensor_pks: Sequence[int] | None = None,
+):
+    """Per-(sensor, bucket) min/max/sum/count/last over raw readings or a rollup table, in one windowed scan.
+
+    Window functions need MySQL 8+ or SQLite 3.25+.
+    """
+    if source is SensorData:
+        ts_col = SensorData.ts
+        last_ts_col = SensorData.ts
+        last_col = SensorData.value_numeric
+        aggregates = (
+            func.min(SensorData.value_numeric),
+            func.max(SensorData.value_numeric),
+            func.sum(SensorData.value_numeric),
+            func.count(SensorData.value_numeric),
+        )
+        filters = [SensorData.value_numeric.is_not(None)]
+    else:
+        ts_col = source.bucket_start
+        last_ts_col = source.last_ts
+        last_col = source.last_value
+        aggregates = (
+            func.min(source.value_min),
+            func.max(source.value_max),
+            func.sum(source.value_sum),
+            func.sum(source.value_count),
+        )
+        filters = []
+    filters += [ts_col >= start, ts_col < end]
+    if sensor_pks is not None:
+        filters.append(source.sensor_id.in_(sensor_pks))
+
+    epoch = epoch_seconds(ts_col, db.get_bind().dialect.name)
+    bucket = func.floor(epoch / bucket_s) * bucket_s
+    window = {"partition_by": (source.sensor_id, bucket)}
+    vmin, vmax, vsum, vcount = aggregates
+    ranked = (
+        select(
+            source.sensor_id.label("sensor_id"),
+            bucket.label("bucket"),
+            vmin.over(**window).label("vmin"),
+            vmax.over(**window).label("vmax"),
+            vsum.over(**window).label("vsum"),
+            vcount.over(**window).label("vcount"),
+            last_ts_col.label("last_ts"),
+            last_col.label("last_value"),
+            func.row_number().over(**window, order_by=(last_ts_col.desc(), source.id.desc())).label("rn"),
+        )
+        .where(*filters)
+        .subquery()
+    )
+    stmt = select(
+        ranked.c.sensor_id,
+        ranked.c.bucket,
+        ranked.c.vmin,
+        ranked.c.vmax,
+        ranked.c.vsum,
+        ranked.c.vcount,
+        ranked.c.last_ts,
+        ranked.c.last_value,
+    ).where(ranked.c.rn == 1)
+    for row in db.execute(stmt):
+        yield (
+            row.sensor_id,
+            EPOCH + timedelta(seconds=int(row.bucket)),
+            row.vmin,
+            row.vmax,
+            float(row.vsum),
+            int(row.vcount),
+            row.last_ts,
+            row.last_value,
+        )
+
+
+def rollup_watermark(db: Session, table, size_s: int) -> datetime | None:
+    """End of the newest bucket the compactor has written to ``table``."""
+    newest = db.execute(select(func.max(table.bucket_start))).scalar()
+    return None if newest is None else newest + timedelta(seconds=size_s)
+
+
+def aggregate_buckets(
+    db: Session,
+    sensor_pks: Sequence[int],
+    bucket_s: int,
+    start: datetime,
+    end: datetime,
+) -> dict[int, list[dict[str, Any]]]:
+    """min/max/avg/count/last per (sensor, bucket).
+
+    Whole rollup buckets below the compaction watermark are read from the coarsest rollup table that
+    divides ``bucket_s``; only the unaligned head and the not-yet-compacted tail scan raw readings.
+    """
+    parts = []
+    raw_from, raw_to = start, end
+    for table, size_s in reversed(ROLLUPS):
+        if bucket_s % size_s:
+            continue
+        watermark = rollup_watermark(db, table, size_s)
+        if watermark is None:
+            continue
+        rollup_start = ceil_ts(start, size_s)
+        rollup_end = min(floor_ts(end, size_s), watermark)
+        if rollup_start < rollup_end:
+            parts.append((table, rollup_start, rollup_end))
+            if start < rollup_start:
+                parts.append((SensorData, start, rollup_start))
+            raw_from = rollup_end
+        break
+    if raw_from < raw_to:
+        parts.append((SensorData, raw_from, raw_to))
+
+    merged: dict[tuple[int, datetime], list] = {}
+    for source, part_start, part_end in parts:
+        for sensor_pk, bucket, vmin, vmax, vsum, vcount, last_ts, last_value in bucket_rows(
+            db, source, bucket_s, part_start, part_end, sensor_pks
+        ):
+            acc = merged.get((sensor_pk, bucket))
+            if acc is None:
+                merged[(sensor_pk, bucket)] = [vmin, vmax, vsum, vcount, last_ts, last_value]
+                continue
+            acc[0] = min(acc[0], vmin)
+            acc[1] = max(acc[1], vmax)
+            acc[2] += vsum
+            acc[3] += vcount
+            if last_ts >= acc[4]:
+                acc[4], acc[5] = last_ts, last_value
+
+    result: dict[int, list[dict[str, Any]]] = {pk: [] for pk in sensor_pks}
+    for (sensor_pk, bucket), (vmin, vmax, vsum, vcount, _, last_value) in sorted(merged.items()):
+        result[sensor_pk].append(
+            {
+                "ts": bucket,
+                "min": vmin,
+                "max": vmax,
+                "avg": vsum / vcount,
+                "count": vcount,
+                "last": last_value,
+            }
+        )
+    return result
+
+
+def raw_series(
+    db: Session, sensor_pk: int, start: datetime, end: datetime, limit: int | None = None
+) -> list[tuple[datetime, float]]:
+    stmt = (
+        select(SensorData.ts, SensorData.value_numeric)
+        .where(
+            SensorData.sensor_id == sensor_pk,
+            SensorData.ts >= start,
+            SensorData.ts < end,
+            SensorData.value_numeric.is_not(None),
+        )
+        .order_by(SensorData.ts)
+        .limit(limit)
+    )
+    return [(row.ts, row.value_numeric) for row in db.execute(stmt)]
+
+
+def lttb(points: Sequence[tuple[datetime, float]], threshold: int) -> list[tuple[datetime, float]]:
+    """Largest-Triangle-Three-Buckets downsampling, keeping the visual shape of the series."""
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(points)
+    xs = [p[0].timestamp() for p in points]
+    ys = [p[1] for p in points]
+    sampled = [points[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex.
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        span = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / span
+        avg_y = sum(ys[next_start:next_end]) / span
+
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        ax, ay = xs[a], ys[a]
+        best_area = -1.0
+        best = start
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+        sampled.append(points[best])
+        a = best
+    sampled.append(points[-1])
+    return sampled
@@ -0,0 +1,273 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Hashable
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models.models import SensorData
+from app.services.aggregation import EPOCH, floor_ts
+
+DAY_S = 86400
+
+# Flow readings further apart than this are treated as a gap in the data, not as continuous flow.
+MAX_FLOW_GAP_S = 600.0
+
+# Humidity must be this close in time to a temperature reading to pair with it for VPD.
+VPD_PAIR_TOLERANCE_S = 300.0
+
+# Target VPD band for leafy greens, kPa.
+VPD_BAND = (0.8, 1.2)
+
+# Readings of one sensor held in memory per request; about five weeks at a 5 s interval.
+MAX_SERIES_ROWS = 600_000
+
+
+class SeriesTooLarge(ValueError):
+    """The range holds more readings than ``MAX_SERIES_ROWS``."""
+
+
+class Series:
+    __slots__ = ("ts", "values")
+
+    def __init__(self, ts: np.ndarray, values: np.ndarray) -> None:
+        self.ts = ts
+        self.values = values
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+
+def to_epoch(ts: datetime) -> float:
+    return (ts - EPOCH).total_seconds()
+
+
+def from_epoch(seconds: float) -> datetime:
+    return EPOCH + timedelta(seconds=float(seconds))
+
+
+def load_series(db: Session, sensor_pk: int, start: datetime, end: datetime) -> Series:
+    """All numeric readings of one sensor in [start, end), ordered by time, as float64 arrays.
+
+    Raises ``SeriesTooLarge`` rather than loading more than ``MAX_SERIES_ROWS`` readings.
+    """
+    stmt = (
+        select(SensorData.ts, SensorData.value_numeric)
+        .where(
+            SensorData.sensor_id == sensor_pk,
+            SensorData.ts >= start,
+            SensorData.ts < end,
+            SensorData.value_numeric.is_not(None),
+        )
+        .order_by(SensorData.ts)
+        .limit(MAX_SERIES_ROWS + 1)
+    )
+    rows = db.execute(stmt).all()
+    if len(rows) > MAX_SERIES_ROWS:
+        raise SeriesTooLarge(f"Range too large; at most {MAX_SERIES_ROWS} readings per sensor, narrow it")
+    if not rows:
+        return Series(np.empty(0), np.empty(0))
+    ts, values = zip(*rows)
+    epoch = (np.array(ts, dtype="datetime64[us]") - np.datetime64(EPOCH, "us")) / np.timedelta64(1, "s")
+    return Series(epoch.astype(np.float64), np.array(values, dtype=np.float64))
+
+
+def value_before(db: Session, sensor_pk: int, ts: datetime) -> float | None:
+    """The sensor's last numeric reading before ``ts``: the state in force at the start of a range."""
+    stmt = (
+        select(SensorData.value_numeric)
+        .where(SensorData.sensor_id == sensor_pk, SensorData.ts < ts, SensorData.value_numeric.is_not(None))
+        .order_by(SensorData.ts.desc())
+        .limit(1)
+    )
+    return db.execute(stmt).scalar()
+
+
+def day_edges(start: datetime, end: datetime) -> np.ndarray:
+    """Epoch seconds of ``start``, every UTC midnight inside the range, and ``end``."""
+    first_midnight = to_epoch(floor_ts(start, DAY_S)) + DAY_S
+    midnights = np.arange(first_midnight, to_epoch(end), DAY_S, dtype=np.float64)
+    return np.concatenate([[to_epoch(start)], midnights, [to_epoch(end)]])
+
+
+def _day_labels(edges: np.ndarray) -> list[str]:
+    return [from_epoch(t).date().isoformat() for t in edges[:-1]]
+
+
+def light_hours(series: Series, start: datetime, end: datetime, initial_on: bool = False) -> dict[str, Any]:
+    """Hours per UTC day that an actuator was on, from its on/off (1/0) state changes.
+
+    A state holds until the next reading; before the first reading the state is ``initial_on``.
+    """
+    edges = day_edges(start, end)
+    t0, t1 = edges[0], edges[-1]
+    # Prepend the assumed initial state at the range start so the integral is defined everywhere.
+    ts = np.concatenate([[t0], np.clip(series.ts, t0, t1)])
+    on = np.concatenate([[1.0 if initial_on else 0.0], (series.values > 0.5).astype(np.float64)])
+    # Cumulative on-seconds at each state change, then at each day edge by holding the last state.
+    cumulative = np.concatenate([[0.0], np.cumsum(on[:-1] * np.diff(ts))])
+    idx = np.searchsorted(ts, edges, side="right") - 1
+    at_edges = cumulative[idx] + on[idx] * (edges - ts[idx])
+    hours = np.diff(at_edges) / 3600.0
+    return {
+        "days": [{"day": day, "hours_on": round(float(h), 3)} for day, h in zip(_day_labels(edges), hours)],
+        "total_hours_on": round(float(hours.sum()), 3),
+        "switches": int(np.count_nonzero(np.diff(on))),
+    }
+
+
+def water_usage(series: Series, start: datetime, end: datetime) -> dict[str, Any]:
+    """Litres used per UTC day and cumulatively, integrating L/min flow readings (trapezoidal rule)."""
+    edges = day_edges(start, end)
+    labels = _day_labels(edges)
+    if len(series) < 2:
+        return {
+            "days": [{"day": day, "liters": 0.0} for day in labels],
+            "total_liters": 0.0,
+            "cumulative": [{"day": day, "liters": 0.0} for day in labels],
+            "gaps": 0,
+        }
+    dt = np.diff(series.ts)
+    liters = (series.values[:-1] + series.values[1:]) / 2.0 * dt / 60.0
+    liters[dt > MAX_FLOW_GAP_S] = 0.0
+    # Each interval is credited to the day it starts in.
+    day_index = np.clip(np.searchsorted(edges, series.ts[:-1], side="right") - 1, 0, len(labels) - 1)
+    per_day = np.bincount(day_index, weights=liters, minlength=len(labels))
+    return {
+        "days": [{"day": day, "liters": round(float(v), 3)} for day, v in zip(labels, per_day)],
+        "total_liters": round(float(liters.sum()), 3),
+        # End-of-day running total, enough to plot the curve without shipping every reading.
+        "cumulative": [
+            {"day": day, "liters": round(float(v), 3)}
+            for day, v in zip(labels, np.cumsum(per_day))
+        ],
+        "gaps": int(np.count_nonzero(dt > MAX_FLOW_GAP_S)),
+    }
+
+
+def tds_drift(series: Series, start: datetime, end: datetime) -> dict[str, Any]:
+    """Nutrient concentration trend: least-squares slope in ppm/day, daily means and overall change."""
+    edges = day_edges(start, end)
+    labels = _day_labels(edges)
+    day_index = np.clip(np.searchsorted(edges, series.ts, side="right") - 1, 0, len(labels) - 1)
+    counts = np.bincount(day_index, minlength=len(labels))
+    sums = np.bincount(day_index, weights=series.values, minlength=len(labels))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+    result: dict[str, Any] = {
+        "days": [
+            {"day": day, "mean_ppm": None if n == 0 else round(float(m), 2), "count": int(n)}
+            for day, m, n in zip(labels, means, counts)
+        ],
+        "count": len(series),
+        "slope_ppm_per_day": None,
+        "change_ppm": None,
+        "change_pct": None,
+    }
+    if len(series) >= 2 and series.ts[-1] > series.ts[0]:
+        slope, intercept = np.polyfit(series.ts - series.ts[0], series.values, 1)
+        fitted_start = intercept
+        fitted_end = intercept + slope * (series.ts[-1] - series.ts[0])
+        result["slope_ppm_per_day"] = round(float(slope * DAY_S), 3)
+        result["change_ppm"] = round(float(fitted_end - fitted_start), 2)
+        if fitted_start:
+            result["change_pct"] = round(float((fitted_end - fitted_start) / fitted_start * 100), 2)
+    return result
+
+
+def saturation_vapour_pressure(temp_c: np.ndarray) -> np.ndarray:
+    """Tetens equation, kPa."""
+    return 0.6108 * np.exp(17.27 * temp_c / (temp_c + 237.3))
+
+
+def vpd(temperature: Series, humidity: Series, start: datetime, end: datetime, bucket_s: int = 3600) -> dict[str, Any]:
+    """Vapour pressure deficit (kPa) at each temperature reading, paired with the nearest humidity reading."""
+    empty = {"buckets": [], "count": 0, "mean_kpa": None, "min_kpa": None, "max_kpa": None, "in_band_pct": None}
+    if len(temperature) == 0 or len(humidity) == 0:
+        return {**empty, "band_kpa": VPD_BAND}
+    # Nearest humidity reading for each temperature reading.
+    right = np.clip(np.searchsorted(humidity.ts, temperature.ts), 0, len(humidity) - 1)
+    left = np.clip(right - 1, 0, len(humidity) - 1)
+    nearest = np.where(
+        np.abs(humidity.ts[left] - temperature.ts) <= np.abs(humidity.ts[right] - temperature.ts), left, right
+    )
+    paired = np.abs(humidity.ts[nearest] - temperature.ts) <= VPD_PAIR_TOLERANCE_S
+    ts = temperature.ts[paired]
+    if len(ts) == 0:
+        return {**empty, "band_kpa": VPD_BAND}
+    rh = np.clip(humidity.values[nearest][paired], 0.0, 100.0)
+    deficit = saturation_vapour_pressure(temperature.values[paired]) * (1.0 - rh / 100.0)
+
+    bucket = ((ts - to_epoch(start)) // bucket_s).astype(np.int64)
+    n_buckets = int(bucket.max()) + 1
+    counts = np.bincount(bucket, minlength=n_buckets)
+    means = np.bincount(bucket, weights=deficit, minlength=n_buckets)
+    filled = np.nonzero(counts)[0]
+    low, high = VPD_BAND
+    return {
+        "buckets": [
+            {
+                "bucket_start": from_epoch(to_epoch(start) + b * bucket_s),
+                "mean_kpa": round(float(means[b] / counts[b]), 3),
+                "count": int(counts[b]),
+            }
+            for b in filled
+        ],
+        "count": int(len(deficit)),
+        "mean_kpa": round(float(deficit.mean()), 3),
+        "min_kpa": round(float(deficit.min()), 3),
+        "max_kpa": round(float(deficit.max()), 3),
+        "in_band_pct": round(float(np.mean((deficit >= low) & (deficit <= high)) * 100), 2),
+        "band_kpa": VPD_BAND,
+    }
+
+
+class AnalyticsCache:
+    """TTL + LRU cache of analysis results, keyed by (analysis, sensors, range).
+
+    Ranges that ended before ``open_margin_s`` ago can't change any more (ingest lag aside) and are
+    kept for ``closed_ttl_s``; ranges reaching into the present expire after ``open_ttl_s``.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        open_ttl_s: float = 60.0,
+        closed_ttl_s: float = 3600.0,
+        open_margin_s: float = 300.0,
+    ) -> None:
+        self.max_entries = max_entries
+        self.open_ttl_s = open_ttl_s
+        self.closed_ttl_s = closed_ttl_s
+        self.open_margin = timedelta(seconds=open_margin_s)
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key: Hashable, end: datetime, compute: Callable[[], Any]) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = compute()
+        closed = end < datetime.utcnow() - self.open_margin
+        with self._lock:
+            self._entries[key] = (now + (self.closed_ttl_s if closed else self.open_ttl_s), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def stats(self) -> dict[str, Any]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+analytics_cache = AnalyticsCache()
@@ -0,0 +1,322 @@
+import asyncio
+import json
+import logging
+import math
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, NamedTuple
+
+from app.core.metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+SPIKE = "spike"
+DRIFT = "drift"
+RATE = "rate_of_change"
+STUCK = "stuck"
+
+ANOMALIES = Counter("anomalies_detected_total", "Anomalies flagged by the streaming detector", ("type", "kind"))
+
+# Largest plausible change per second for each sensor type; faster moves are flagged as rate_of_change.
+DEFAULT_MAX_RATE = {
+    "temperature": 0.2,
+    "humidity": 1.0,
+    "waterlevel": 5.0,
+    "tds": 50.0,
+}
+
+SNAPSHOT_VERSION = 2
+
+
+def parse_rates(spec: str | None) -> dict[str, float]:
+    """Parse ``"temperature=0.1,tds=20"`` into per-sensor-type max change per second."""
+    result: dict[str, float] = {}
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        sensor_type, _, rate = item.partition("=")
+        result[sensor_type.strip()] = float(rate)
+    return result
+
+
+class Anomaly(NamedTuple):
+    kind: str
+    value: float
+    expected: float | None
+    detail: str
+
+
+class _SensorState:
+    """Everything the detector keeps per sensor: a handful of floats, updated in O(1)."""
+
+    __slots__ = ("n", "mean", "var", "ewma", "last_value", "last_ts", "same_count", "same_since", "alerted")
+
+    def __init__(self) -> None:
+        self.n = 0
+        self.mean = 0.0
+        self.var = 0.0
+        self.ewma = 0.0
+        self.last_value: float | None = None
+        self.last_ts: datetime | None = None
+        self.same_count = 0
+        self.same_since: datetime | None = None
+        # Last time each anomaly kind was reported, for the cooldown.
+        self.alerted: dict[str, datetime] = {}
+
+    def to_list(self) -> list[Any]:
+        return [
+            self.n,
+            self.mean,
+            self.var,
+            self.ewma,
+            self.last_value,
+            self.last_ts.isoformat() if self.last_ts else None,
+            self.same_count,
+            self.same_since.isoformat() if self.same_since else None,
+            {kind: ts.isoformat() for kind, ts in self.alerted.items()},
+        ]
+
+    @classmethod
+    def from_list(cls, values: list[Any]) -> "_SensorState":
+        state = cls()
+        n, mean, var, ewma, last_value, last_ts, same_count, same_since, alerted = values
+        state.n, state.mean, state.var, state.ewma = int(n), float(mean), float(var), float(ewma)
+        state.last_value = last_value
+        state.last_ts = datetime.fromisoformat(last_ts) if last_ts else None
+        state.same_count = int(same_count)
+        state.same_since = datetime.fromisoformat(same_since) if same_since else None
+        # Restoring the cooldowns keeps a restart from re-reporting an anomaly that is still going on.
+        state.alerted = {kind: datetime.fromisoformat(ts) for kind, ts in alerted.items()}
+        return state
+
+
+def snapshot_path_for(path: str | None, process_name: str) -> str | None:
+    """One snapshot file per ingesting process: ``anomaly_state.json`` -> ``anomaly_state.worker-1.json``."""
+    if not path:
+        return None
+    base = Path(path)
+    return str(base.with_name(f"{base.stem}.{process_name}{base.suffix}"))
+
+
+class AnomalyDetector:
+    """Per-sensor streaming statistics, checked inline with ingestion and without DB queries.
+
+    Mean and variance are Welford's running estimates: exact over the first ``window`` readings, then
+    exponentially weighted with weight ``1/window`` so they follow slow seasonal change. A faster EWMA
+    of the value tracks short-term level. A reading is flagged as:
+
+    - ``spike``: more than ``z_threshold`` standard deviations from the mean;
+    - ``drift``: the fast EWMA has moved more than ``drift_threshold`` standard deviations from the mean;
+    - ``rate_of_change``: it moved faster than the type's maximum plausible rate;
+    - ``stuck``: the same value for ``stuck_count`` readings spanning at least ``stuck_s`` seconds.
+
+    Statistical checks wait for ``min_samples`` readings. State is snapshotted to a JSON file, so a
+    restart doesn't repeat the warm-up. Each ingesting process keeps its own file (``snapshot_path_for``).
+    """
+
+    def __init__(
+        self,
+        window: int = 500,
+        min_samples: int = 30,
+        z_threshold: float = 4.0,
+        drift_threshold: float = 3.0,
+        ewma_alpha: float = 0.2,
+        stuck_count: int = 30,
+        stuck_s: float = 600.0,
+        cooldown_s: float = 300.0,
+        max_rate: dict[str, float] | None = None,
+    ) -> None:
+        self.enabled = True
+        self.window = window
+        self.min_samples = min_samples
+        self.z_threshold = z_threshold
+        self.drift_threshold = drift_threshold
+        self.ewma_alpha = ewma_alpha
+        self.stuck_count = stuck_count
+        self.stuck = timedelta(seconds=stuck_s)
+        self.cooldown = timedelta(seconds=cooldown_s)
+        self.max_rate = dict(DEFAULT_MAX_RATE if max_rate is None else max_rate)
+        self.snapshot_path: Path | None = None
+        self.snapshot_interval_s = 60.0
+        self._states: dict[int, _SensorState] = {}
+        self._task: asyncio.Task | None = None
+        self.observed = 0
+
+    def configure(
+        self,
+        enabled: bool,
+        window: int,
+        min_samples: int,
+        z_threshold: float,
+        drift_threshold: float,
+        stuck_count: int,
+        stuck_s: float,
+        cooldown_s: float,
+        max_rate: dict[str, float],
+        snapshot_path: str | None,
+        snapshot_interval_s: float,
+    ) -> None:
+        self.enabled = enabled
+        self.window = window
+        self.min_samples = min_samples
+        self.z_threshold = z_threshold
+        self.drift_threshold = drift_threshold
+        self.stuck_count = stuck_count
+        self.stuck = timedelta(seconds=stuck_s)
+        self.cooldown = timedelta(seconds=cooldown_s)
+        self.max_rate = {**DEFAULT_MAX_RATE, **max_rate}
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else None
+        self.snapshot_interval_s = snapshot_interval_s
+
+    def observe(self, sensor_pk: int, sensor_type: str, ts: datetime, value: float) -> list[Anomaly]:
+        """Check ``value`` against the sensor's history, then fold it in; returns anomalies to report."""
+        self.observed += 1
+        state = self._states.get(sensor_pk)
+        if state is None:
+            state = self._states[sensor_pk] = _SensorState()
+        if state.last_ts is not None and ts < state.last_ts:
+            # Backfilled or reordered reading: it says nothing about the current trend.
+            return []
+
+        found: list[Anomaly] = []
+        if state.n >= self.min_samples:
+            std = math.sqrt(state.var)
+            if std > 0:
+                z = abs(value - state.mean) / std
+                if z > self.z_threshold:
+                    found.append(Anomaly(SPIKE, value, state.mean, f"z={z:.1f}"))
+                ewma = state.ewma + self.ewma_alpha * (value - state.ewma)
+                drift = abs(ewma - state.mean) / std
+                if drift > self.drift_threshold:
+                    found.append(Anomaly(DRIFT, value, state.mean, f"ewma={ewma:.3f} ({drift:.1f} sd)"))
+        max_rate = self.max_rate.get(sensor_type)
+        if max_rate is not None and state.last_value is not None and state.last_ts is not None:
+            dt = (ts - state.last_ts).total_seconds()
+            if dt > 0:
+                rate = abs(value - state.last_value) / dt
+                if rate > max_rate:
+                    found.append(Anomaly(RATE, value, state.last_value, f"{rate:.3f}/s > {max_rate}/s"))
+
+        if state.last_value is not None and value == state.last_value:
+            state.same_count += 1
+            if (
+                STUCK not in state.alerted
+                and state.same_count >= self.stuck_count
+                and ts - (state.same_since or ts) >= self.stuck
+            ):
+                found.append(Anomaly(STUCK, value, None, f"unchanged for {state.same_count} readings"))
+        else:
+            state.same_count = 1
+            state.same_since = ts
+            # A changing value ends a stuck episode; the next one is reported afresh.
+            state.alerted.pop(STUCK, None)
+
+        self._update(state, value)
+        state.last_value = value
+        state.last_ts = ts
+
+        reported = []
+        for anomaly in found:
+            last = state.alerted.get(anomaly.kind)
+            if last is not None and ts - last < self.cooldown:
+                continue
+            state.alerted[anomaly.kind] = ts
+            ANOMALIES.inc(type=sensor_type, kind=anomaly.kind)
+            reported.append(anomaly)
+        return reported
+
+    def _update(self, state: _SensorState, value: float) -> None:
+        # Welford in its mean/variance form; with n capped at the window it becomes an exponential average.
+        if state.n < self.window:
+            state.n += 1
+        alpha = 1.0 / state.n
+        delta = value - state.mean
+        state.mean += alpha * delta
+        state.var = (1 - alpha) * (state.var + alpha * delta * delta)
+        state.ewma = value if state.n == 1 else state.ewma + self.ewma_alpha * (value - state.ewma)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "version": SNAPSHOT_VERSION,
+            "saved_at": datetime.utcnow().isoformat(),
+            "sensors": {str(pk): state.to_list() for pk, state in list(self._states.items())},
+        }
+
+    def restore(self, data: dict[str, Any]) -> int:
+        if data.get("version") != SNAPSHOT_VERSION:
+            return 0
+        states = {}
+        for pk, values in data.get("sensors", {}).items():
+            try:
+                states[int(pk)] = _SensorState.from_list(values)
+            except (AttributeError, TypeError, ValueError):
+                continue
+        # Live readings that arrived before the restore win.
+        states.update(self._states)
+        self._states = states
+        return len(states)
+
+    def save(self) -> None:
+        self.write(self.snapshot())
+
+    def write(self, data: dict[str, Any]) -> None:
+        """Write a ``snapshot()`` taken on the event loop; safe to run in a thread."""
+        if self.snapshot_path is None:
+            return
+        tmp = self.snapshot_path.with_suffix(self.snapshot_path.suffix + ".tmp")
+        tmp.parent.mkdir(parents=True, exist_ok=True)
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        # Atomic swap so a crash mid-write leaves the previous snapshot intact.
+        os.replace(tmp, self.snapshot_path)
+
+    def load(self) -> int:
+        if self.snapshot_path is None or not self.snapshot_path.exists():
+            return 0
+        try:
+            restored = self.restore(json.loads(self.snapshot_path.read_text(encoding="utf-8")))
+        except (OSError, ValueError):
+            logger.exception("anomaly snapshot unreadable; starting cold")
+            return 0
+        logger.info("anomaly state restored", extra={"sensors": restored})
+        return restored
+
+    def start(self) -> None:
+        if self._task is None and self.snapshot_path is not None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            await asyncio.to_thread(self.write, self.snapshot())
+        except Exception:
+            logger.exception("final anomaly snapshot failed")
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "sensors": len(self._states),
+            "warm_sensors": sum(1 for s in list(self._states.values()) if s.n >= self.min_samples),
+            "observed": self.observed,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.snapshot_interval_s)
+            try:
+                # observe() mutates state on the loop, so only the serialized copy goes to the thread.
+                await asyncio.to_thread(self.write, self.snapshot())
+            except Exception:
+                logger.exception("anomaly snapshot failed")
+
+
+anomaly_detector = AnomalyDetector()
+
+Gauge("anomaly_sensors_warm", "Sensors with enough history for statistical anomaly checks", fn=lambda: anomaly_detector.stats()["warm_sensors"])
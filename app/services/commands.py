@@ -0,0 +1,303 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Any
+
+from sqlalchemy import bindparam, insert, update
+
+from app.core.metrics import Counter, Gauge, Histogram, timed
+from app.db.session import DB_COMMIT_SECONDS, get_async_engine
+from app.models.models import ControlLog
+from app.services.event_bus import event_bus
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+ACKED = "acked"
+TIMEOUT = "timeout"
+PUBLISH_FAILED = "publish_failed"
+
+COMMANDS = Counter("control_commands_total", "Control commands by outcome", ("target", "result"))
+COMMAND_ACK_SECONDS = Histogram(
+    "control_command_ack_seconds",
+    "Time from publishing a command to the device's status reply",
+    ("target",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+CONTROL_LOG_DROPPED = Counter(
+    "control_log_rows_dropped_total", "control_logs inserts and updates dropped after repeated write failures", ("kind",)
+)
+
+_logs = ControlLog.__table__
+_UPDATE_RESULT = (
+    update(_logs)
+    .where(_logs.c.correlation_id == bindparam("b_correlation_id"))
+    .values(result=bindparam("b_result"), acked_at=bindparam("b_acked_at"), latency_ms=bindparam("b_latency_ms"))
+)
+
+
+class Command:
+    __slots__ = ("correlation_id", "device_id", "target", "desired_state", "issued_at", "started", "deadline", "done")
+
+    def __init__(self, device_id: str, target: str, desired_state: str, timeout_s: float) -> None:
+        self.correlation_id = uuid.uuid4().hex
+        self.device_id = device_id
+        self.target = target
+        self.desired_state = desired_state
+        self.issued_at = datetime.utcnow()
+        self.started = time.perf_counter()
+        self.deadline = self.started + timeout_s
+        # Resolves to (result, latency_ms) once acknowledged, timed out or failed.
+        self.done: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class CommandTracker:
+    """Correlates control commands with the status replies that acknowledge them.
+
+    Devices echo the command's ``cid`` in their ``farm/<id>/status`` reply; replies without one (older
+    firmware) acknowledge the oldest pending command whose target now reports the desired state.
+    Status replies reach the tracker through the event bus, so they are matched even when ingestion
+    runs in separate workers, provided every process uses the mqtt event bus backend (see
+    ``require_shared_event_bus``). ``control_logs`` rows are written behind in batches; a batch that
+    keeps failing is retried row by row and the rows that still fail are logged and dropped.
+    """
+
+    # Event bus sink attributes: nothing is buffered per device here.
+    dropped = 0
+    depth = 0
+
+    def __init__(
+        self,
+        ack_timeout_s: float = 10.0,
+        flush_interval_s: float = 1.0,
+        latency_window: int = 200,
+        max_flush_attempts: int = 5,
+    ) -> None:
+        self.ack_timeout_s = ack_timeout_s
+        self.flush_interval_s = flush_interval_s
+        self.latency_window = latency_window
+        self.max_flush_attempts = max_flush_attempts
+        self._failed_flushes = 0
+        self.dropped_rows = 0
+        self._commands: dict[str, Command] = {}
+        self._by_device: dict[str, list[Command]] = {}
+        self._inserts: list[dict[str, Any]] = []
+        self._updates: list[dict[str, Any]] = []
+        self._device_stats: dict[str, dict[str, Any]] = {}
+        self._task: asyncio.Task | None = None
+
+    def configure(self, ack_timeout_s: float, flush_interval_s: float, max_flush_attempts: int = 5) -> None:
+        self.ack_timeout_s = ack_timeout_s
+        self.flush_interval_s = flush_interval_s
+        self.max_flush_attempts = max_flush_attempts
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("final control log flush failed")
+
+    def issue(
+        self, device_id: str, device_pk: int, target: str, desired_state: str, timeout_s: float | None = None
+    ) -> Command:
+        """Register a command before it is published, so even an instant reply is matched.
+
+        It times out after ``timeout_s`` (a caller waiting longer than usual), never before ``ack_timeout_s``.
+        """
+        command = Command(device_id, target, desired_state, max(timeout_s or 0.0, self.ack_timeout_s))
+        self._commands[command.correlation_id] = command
+        pending = self._by_device.get(device_id)
+        if pending is None:
+            pending = self._by_device[device_id] = []
+            event_bus.attach(device_id, self)
+        pending.append(command)
+        self._stats(device_id)["sent"] += 1
+        self._inserts.append({
+            "correlation_id": command.correlation_id,
+            "command": target,
+            "desired_state": desired_state,
+            "device_id": device_pk,
+            "ts": command.issued_at,
+            "result": PENDING,
+        })
+        return command
+
+    def fail(self, command: Command) -> None:
+        self._resolve(command, PUBLISH_FAILED)
+
+    async def wait(self, command: Command, timeout_s: float) -> tuple[str, float | None]:
+        """(result, latency_ms) once the device replies; raises asyncio.TimeoutError after ``timeout_s``."""
+        return await asyncio.wait_for(asyncio.shield(command.done), timeout_s)
+
+    def offer(self, message: dict) -> None:
+        """Event bus sink: called with every event of a device that has commands pending."""
+        data = message.get("data")
+        if message.get("type") != "status" or not isinstance(data, dict):
+            return
+        device_id = message.get("device_id")
+        correlation_id = data.get("cid")
+        if correlation_id:
+            command = self._commands.get(correlation_id)
+            # A cid we no longer track is a late or replayed (retained) reply; don't guess a match for it.
+            if command is not None and command.device_id == device_id:
+                self._resolve(command, ACKED)
+            return
+        for command in tuple(self._by_device.get(device_id, ())):
+            state = data.get(command.target)
+            if command.target == "status" or (isinstance(state, dict) and state.get("state") == command.desired_state):
+                self._resolve(command, ACKED)
+                return
+
+    def expire(self, now: float | None = None) -> int:
+        now = now or time.perf_counter()
+        expired = [c for c in self._commands.values() if now >= c.deadline]
+        for command in expired:
+            self._resolve(command, TIMEOUT)
+        return len(expired)
+
+    async def flush(self) -> int:
+        """Write queued inserts and result updates in one transaction; inserts go first so updates find their rows."""
+        if not self._inserts and not self._updates:
+            return 0
+        inserts, self._inserts = self._inserts, []
+        updates, self._updates = self._updates, []
+        try:
+            await _write(inserts, updates)
+        except Exception:
+            self._failed_flushes += 1
+            if self._failed_flushes < self.max_flush_attempts:
+                self._inserts = inserts + self._inserts
+                self._updates = updates + self._updates
+                raise
+            # One bad row must not hold the whole backlog forever: write what can be written and drop the rest.
+            logger.exception("control log flush failed repeatedly; writing row by row")
+            written = await self._write_each(inserts, updates)
+            self._failed_flushes = 0
+            return written
+        self._failed_flushes = 0
+        return len(inserts) + len(updates)
+
+    async def _write_each(self, inserts: list[dict[str, Any]], updates: list[dict[str, Any]]) -> int:
+        written = 0
+        rows = [("insert", row, [row], []) for row in inserts] + [("update", row, [], [row]) for row in updates]
+        for kind, row, row_inserts, row_updates in rows:
+            try:
+                await _write(row_inserts, row_updates)
+            except Exception as exc:
+                self.dropped_rows += 1
+                CONTROL_LOG_DROPPED.inc(kind=kind)
+                logger.error("dropped control log %s: %s", kind, exc, extra={"row": row})
+            else:
+                written += 1
+        return written
+
+    def latency_stats(self) -> dict[str, dict[str, Any]]:
+        """Per-device command counts and acknowledgement latency over the most recent commands."""
+        report = {}
+        for device_id, stats in list(self._device_stats.items()):
+            latencies = sorted(stats["latencies"])
+            entry = {key: stats[key] for key in ("sent", "acked", "timeouts", "failed")}
+            entry["pending"] = len(self._by_device.get(device_id, ()))
+            if latencies:
+                entry.update(
+                    p50_ms=_nearest_rank(latencies, 0.50),
+                    p95_ms=_nearest_rank(latencies, 0.95),
+                    max_ms=latencies[-1],
+                )
+            report[device_id] = entry
+        return report
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "pending": len(self._commands),
+            "queued_inserts": len(self._inserts),
+            "queued_updates": len(self._updates),
+            "failed_flushes": self._failed_flushes,
+            "dropped_rows": self.dropped_rows,
+        }
+
+    def _resolve(self, command: Command, result: str) -> None:
+        if self._commands.pop(command.correlation_id, None) is None:
+            return
+        pending = self._by_device.get(command.device_id, [])
+        if command in pending:
+            pending.remove(command)
+        if not pending:
+            self._by_device.pop(command.device_id, None)
+            event_bus.detach(command.device_id, self)
+        latency_ms = None
+        stats = self._stats(command.device_id)
+        if result == ACKED:
+            elapsed = time.perf_counter() - command.started
+            latency_ms = round(elapsed * 1000, 3)
+            COMMAND_ACK_SECONDS.observe(elapsed, target=command.target)
+            stats["acked"] += 1
+            stats["latencies"].append(latency_ms)
+        elif result == TIMEOUT:
+            stats["timeouts"] += 1
+        else:
+            stats["failed"] += 1
+        COMMANDS.inc(target=command.target, result=result)
+        self._updates.append({
+            "b_correlation_id": command.correlation_id,
+            "b_result": result,
+            "b_acked_at": datetime.utcnow() if result == ACKED else None,
+            "b_latency_ms": latency_ms,
+        })
+        if not command.done.done():
+            command.done.set_result((result, latency_ms))
+
+    def _stats(self, device_id: str) -> dict[str, Any]:
+        stats = self._device_stats.get(device_id)
+        if stats is None:
+            stats = self._device_stats[device_id] = {
+                "sent": 0,
+                "acked": 0,
+                "timeouts": 0,
+                "failed": 0,
+                "latencies": deque(maxlen=self.latency_window),
+            }
+        return stats
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval_s)
+            self.expire()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("control log flush failed")
+
+
+def _nearest_rank(ordered: list[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+@timed(DB_COMMIT_SECONDS, op="control_log")
+async def _write(inserts: list[dict[str, Any]], updates: list[dict[str, Any]]) -> None:
+    async with get_async_engine().begin() as conn:
+        if inserts:
+            await conn.execute(insert(_logs), inserts)
+        if updates:
+            await conn.execute(_UPDATE_RESULT, updates)
+
+
+command_tracker = CommandTracker()
+
+Gauge("control_commands_pending", "Commands awaiting acknowledgement", fn=lambda: len(command_tracker._commands))
@@ -0,0 +1,244 @@
+import json
+import math
+import struct
+from datetime import datetime, timezone
+from typing import Any, NamedTuple
+
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:  # pragma: no cover - orjson is in requirements, stdlib is the fallback
+    loads = json.loads
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# First byte of a MessagePack map (fixmap, map16, map32).
+_MSGPACK_MAP = frozenset(range(0x80, 0x90)) | {0xDE, 0xDF}
+
+# Upper bound on readings in one telemetry message, so one payload can't flood the ingest queue.
+MAX_TELEMETRY_READINGS = 1000
+
+
+class DecodeError(ValueError):
+    """Payload is malformed or its value is outside the sensor's range; the reading is not stored."""
+
+    def __init__(self, reason: str, detail: str) -> None:
+        super().__init__(detail)
+        self.reason = reason
+
+
+class Decoded(NamedTuple):
+    value_numeric: float | None
+    value_text: str | None
+    extras: dict[str, Any]
+
+
+class TelemetryReading(NamedTuple):
+    sensor_type: str
+    ts: datetime | None
+    decoded: Decoded
+
+
+def parse_map(payload: bytes) -> dict[str, Any] | None:
+    """Decode a JSON object or MessagePack map; None if the payload is neither."""
+    if not payload:
+        return None
+    fields = None
+    if payload[0] == 0x7B:  # "{"
+        try:
+            fields = loads(payload)
+        except ValueError:
+            pass
+    elif payload[0] in _MSGPACK_MAP and msgpack is not None:
+        try:
+            fields = msgpack.unpackb(payload, raw=False)
+        except Exception:
+            pass
+    return fields if isinstance(fields, dict) else None
+
+
+def parse_timestamp(value: Any) -> datetime | None:
+    """Naive UTC datetime from epoch seconds/milliseconds or ISO 8601; None if absent or unreadable."""
+    if isinstance(value, bool):
+        return None
+    try:
+        if isinstance(value, (int, float)):
+            # Anything this large is epoch milliseconds.
+            seconds = value / 1000 if value > 1e11 else value
+            return datetime.fromtimestamp(seconds, tz=timezone.utc).replace(tzinfo=None)
+        if isinstance(value, str):
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            if parsed.tzinfo is not None:
+                parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+            return parsed
+    except (ValueError, OverflowError, OSError):
+        return None
+    return None
+
+
+class SensorDecoder:
+    """How one sensor type is published: its value field, unit, valid range and optional extras.
+
+    ``struct_format`` describes the compact binary form (little-endian, as sent by the ESP32), one
+    struct field per name in ``struct_fields`` (default ``(field, *extras)``). Text extras can't be
+    packed, so a decoder with one lists only its numeric fields there.
+    """
+
+    def __init__(
+        self,
+        sensor_type: str,
+        field: str,
+        unit: str | None = None,
+        min_value: float | None = None,
+        max_value: float | None = None,
+        extras: tuple[str, ...] = (),
+        struct_format: str | None = None,
+        struct_fields: tuple[str, ...] | None = None,
+    ) -> None:
+        self.sensor_type = sensor_type
+        self.field = field
+        self.unit = unit
+        self.min_value = min_value
+        self.max_value = max_value
+        self.extras = extras
+        self.struct = struct.Struct(struct_format) if struct_format else None
+        self.struct_fields = struct_fields or (field, *extras)
+        if self.struct is not None and len(self.struct.unpack(bytes(self.struct.size))) != len(self.struct_fields):
+            raise ValueError(f"{sensor_type}: {struct_format!r} doesn't have one field per name in {self.struct_fields}")
+
+    def decode(self, payload: bytes) -> Decoded:
+        return self.from_fields(self.parse(payload))
+
+    def parse(self, payload: bytes) -> dict[str, Any]:
+        """Turn a JSON, MessagePack or packed-struct payload into a field dict."""
+        if not payload:
+            raise DecodeError("malformed", "empty payload")
+        fields = parse_map(payload)
+        if fields is not None:
+            return fields
+        # A packed struct has no marker, so it is recognised by its exact size.
+        if self.struct is not None and len(payload) == self.struct.size:
+            return dict(zip(self.struct_fields, self.struct.unpack(payload)))
+        raise DecodeError("malformed", f"unrecognised {self.sensor_type} payload ({len(payload)} bytes)")
+
+    def from_fields(self, fields: dict[str, Any]) -> Decoded:
+        value = fields.get(self.field)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise DecodeError("malformed", f"{self.field} missing or not a number")
+        value = float(value)
+        if not math.isfinite(value):
+            raise DecodeError("out_of_range", f"{self.field}={value}")
+        if (self.min_value is not None and value < self.min_value) or (
+            self.max_value is not None and value > self.max_value
+        ):
+            raise DecodeError("out_of_range", f"{self.field}={value} outside [{self.min_value}, {self.max_value}]")
+        extras = {
+            name: fields[name]
+            for name in self.extras
+            if isinstance(fields.get(name), (int, float, str)) and not isinstance(fields.get(name), bool)
+        }
+        return Decoded(value, None, extras)
+
+    def pack(self, fields: dict[str, Any]) -> bytes:
+        """Compact binary form of ``fields``, for device firmware and load generators."""
+        if self.struct is None:
+            raise ValueError(f"{self.sensor_type} has no binary format")
+        return self.struct.pack(*(fields[name] for name in self.struct_fields))
+
+
+class DecoderRegistry:
+    def __init__(self) -> None:
+        self._decoders: dict[str, SensorDecoder] = {}
+        # Types nobody registered still accept a plain numeric "value" field.
+        self.fallback = SensorDecoder("generic", "value")
+
+    def register(self, decoder: SensorDecoder) -> SensorDecoder:
+        self._decoders[decoder.sensor_type] = decoder
+        return decoder
+
+    def get(self, sensor_type: str) -> SensorDecoder:
+        return self._decoders.get(sensor_type, self.fallback)
+
+    def unit(self, sensor_type: str) -> str | None:
+        return self.get(sensor_type).unit
+
+    def decode(self, sensor_type: str, payload: bytes) -> Decoded:
+        return self.get(sensor_type).decode(payload)
+
+    def decode_telemetry(self, payload: bytes) -> tuple[list[TelemetryReading], list[tuple[str, DecodeError]]]:
+        """Split a multi-reading telemetry payload into validated readings and per-reading rejections.
+
+        The payload is one sample or ``{"samples": [sample, ...]}``; a sample maps sensor types to
+        their usual field dict (or a bare number for the value field) plus an optional ``ts``::
+
+            {"ts": 1760000000, "temperature": {"value_c": 23.4}, "humidity": 55.1}
+        """
+        message = parse_map(payload)
+        if message is None:
+            raise DecodeError("malformed", "telemetry payload is not a JSON object or MessagePack map")
+        samples = message.get("samples", [message])
+        if not isinstance(samples, list):
+            raise DecodeError("malformed", "samples must be a list")
+        readings: list[TelemetryReading] = []
+        rejected: list[tuple[str, DecodeError]] = []
+        for sample in samples:
+            if not isinstance(sample, dict):
+                raise DecodeError("malformed", "each sample must be an object")
+            ts = parse_timestamp(sample.get("ts"))
+            for sensor_type, fields in sample.items():
+                if sensor_type == "ts":
+                    continue
+                decoder = self._decoders.get(sensor_type)
+                if decoder is None:
+                    # Unlike per-sensor topics, nothing upstream restricts the keys of a telemetry payload.
+                    rejected.append((sensor_type, DecodeError("unknown_type", f"no decoder for {sensor_type!r}")))
+                    continue
+                if not isinstance(fields, dict):
+                    fields = {decoder.field: fields}
+                try:
+                    readings.append(TelemetryReading(sensor_type, ts, decoder.from_fields(fields)))
+                except DecodeError as exc:
+                    rejected.append((sensor_type, exc))
+            if len(readings) + len(rejected) > MAX_TELEMETRY_READINGS:
+                raise DecodeError("too_large", f"more than {MAX_TELEMETRY_READINGS} readings in one message")
+        return readings, rejected
+
+
+decoder_registry = DecoderRegistry()
+decoder_registry.register(
+    SensorDecoder("temperature", "value_c", unit="C", min_value=-40, max_value=85, struct_format="<f")
+)
+decoder_registry.register(
+    SensorDecoder("humidity", "value_pct", unit="%", min_value=0, max_value=100, struct_format="<f")
+)
+decoder_registry.register(
+    SensorDecoder(
+        "waterflow",
+        "l_per_min",
+        unit="L/min",
+        min_value=0,
+        max_value=100,
+        extras=("total_liters", "avg_l_per_min", "pulses"),
+        struct_format="<fffI",
+    )
+)
+decoder_registry.register(
+    SensorDecoder("waterlevel", "cm", unit="cm", min_value=0, max_value=1000, struct_format="<f")
+)
+decoder_registry.register(
+    SensorDecoder(
+        "tds",
+        "ppm",
+        unit="ppm",
+        min_value=0,
+        max_value=5000,
+        extras=("quality",),
+        # quality is a label, only sent in JSON/MessagePack
+        struct_format="<f",
+        struct_fields=("ppm",),
+    )
+)
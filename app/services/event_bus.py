@@ -1,20 +1,383 @@
 import asyncio
-from collections import defaultdict
-from typing import AsyncIterator, Dict
+import itertools
+import json
+import logging
+import os
+import socket
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, Set
 
+import aiomqtt
+
+from app.core.metrics import Counter, Gauge, per_scrape
+from app.services.decoders import loads
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+
+
+class Subscription:
+    """Bounded per-subscriber buffer; a slow consumer loses old events instead of growing memory."""
+
+    def __init__(self, bus: "DeviceEventBus", device_id: str, maxsize: int, policy: str) -> None:
+        self.device_id = device_id
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self.delivered = 0
+        self.closed = False
+        self._bus = bus
+        self._pending: OrderedDict[Any, dict] = OrderedDict()
+        self._seq = itertools.count()
+        self._ready = asyncio.Event()
+
+    def offer(self, message: dict) -> None:
+        if self.closed:
+            return
+        key = self._key(message)
+        if key in self._pending:
+            # Latest-wins: replace the stale reading for the same sensor in place.
+            self._pending[key] = message
+            self.dropped += 1
+            return
+        if len(self._pending) >= self.maxsize:
+            self._pending.popitem(last=False)
+            self.dropped += 1
+        self._pending[key] = message
+        self._ready.set()
+
+    async def get(self) -> dict | None:
+        """Next event, or None once the subscription is closed."""
+        while not self._pending:
+            if self.closed:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        _, message = self._pending.popitem(last=False)
+        self.delivered += 1
+        return message
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self._pending.clear()
+        self._ready.set()
+        self._bus._remove(self)
+
+    def __aiter__(self) -> "Subscription":
+        return self
+
+    async def __anext__(self) -> dict:
+        message = await self.get()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+    def _key(self, message: dict) -> Any:
+        if self.policy == COALESCE and "alert" not in message:
+            sensor_id = message.get("sensor_id")
+            if sensor_id is not None:
+                return sensor_id
+            if message.get("type") == "status":
+                return "status"
+        return next(self._seq)
+
+
+class MemoryBackend:
+    """Events only reach subscribers in the publishing process (single API process)."""
+
+    name = "memory"
 
-class DeviceEventBus:
     def __init__(self) -> None:
-        self._queues: Dict[str, asyncio.Queue] = defaultdict(asyncio.Queue)
+        self._deliver: Callable[[str, dict], None] = lambda device_id, message: None
+
+    def attach(self, deliver: Callable[[str, dict], None]) -> None:
+        self._deliver = deliver
+
+    def publish(self, device_id: str, message: dict) -> None:
+        self._deliver(device_id, message)
+
+    def watch(self, device_id: str) -> None:
+        pass
+
+    def unwatch(self, device_id: str) -> None:
+        pass
+
+    def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    def stats(self) -> dict[str, Any]:
+        return {}
+
+
+class MqttBackend(MemoryBackend):
+    """Fans events out through the MQTT broker so any API process can serve any device's stream.
+
+    Every publisher sends events to ``<prefix>/<device_id>``. A process subscribes to a device's event
+    topic only while it has at least one local subscriber for it, and delivers what comes back. It uses
+    its own connection and bounded queue, so a burst of events can't crowd out alerts or control
+    commands on the shared publisher.
+    """
+
+    name = "mqtt"
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str | None = None,
+        password: str | None = None,
+        topic_prefix: str = "vfarm/events",
+        max_outbound: int = 10000,
+        reconnect_interval_s: float = 5.0,
+    ) -> None:
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.topic_prefix = topic_prefix.rstrip("/")
+        self.reconnect_interval_s = reconnect_interval_s
+        self._outbound: asyncio.Queue = asyncio.Queue(maxsize=max_outbound)
+        self._ops: asyncio.Queue = asyncio.Queue()
+        self._watched: set[str] = set()
+        self._task: asyncio.Task | None = None
+        self.connected = False
+        self.sent = 0
+        self.received = 0
+        self.outbound_dropped = 0
+
+    def publish(self, device_id: str, message: dict) -> None:
+        try:
+            self._outbound.put_nowait((f"{self.topic_prefix}/{device_id}", json.dumps(message, default=str).encode("utf-8")))
+        except asyncio.QueueFull:
+            self.outbound_dropped += 1
+
+    def watch(self, device_id: str) -> None:
+        self._watched.add(device_id)
+        self._ops.put_nowait(device_id)
+
+    def unwatch(self, device_id: str) -> None:
+        self._watched.discard(device_id)
+        self._ops.put_nowait(device_id)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self.connected = False
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "connected": self.connected,
+            "watched_devices": len(self._watched),
+            "outbound_depth": self._outbound.qsize(),
+            "sent": self.sent,
+            "received": self.received,
+            "outbound_dropped": self.outbound_dropped,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                async with aiomqtt.Client(
+                    hostname=self.host,
+                    port=self.port,
+                    username=self.username,
+                    password=self.password,
+                    client_id=f"vfarm-events-{socket.gethostname()}-{os.getpid()}",
+                ) as client:
+                    self.connected = True
+                    # Everything watched right now is subscribed below, so ops queued while offline are moot.
+                    while not self._ops.empty():
+                        self._ops.get_nowait()
+                    for device_id in tuple(self._watched):
+                        await client.subscribe(self._topic(device_id), qos=0)
+                    async with client.messages() as messages:
+                        # If any of the three fails, the group cancels the others and the connection is rebuilt.
+                        async with asyncio.TaskGroup() as tasks:
+                            tasks.create_task(self._read(messages))
+                            tasks.create_task(self._send(client))
+                            tasks.create_task(self._sync_subscriptions(client))
+            except* aiomqtt.MqttError:
+                self.connected = False
+                logger.warning("event bus mqtt backend disconnected, retrying", extra={"sleep_s": self.reconnect_interval_s})
+                await asyncio.sleep(self.reconnect_interval_s)
+            except* Exception:
+                self.connected = False
+                logger.exception("event bus mqtt backend failed, reconnecting", extra={"sleep_s": self.reconnect_interval_s})
+                await asyncio.sleep(self.reconnect_interval_s)
+
+    async def _read(self, messages) -> None:
+        async for message in messages:
+            self._receive(message)
+
+    async def _send(self, client: aiomqtt.Client) -> None:
+        while True:
+            topic, payload = await self._outbound.get()
+            await client.publish(topic, payload, qos=0)
+            self.sent += 1
+
+    async def _sync_subscriptions(self, client: aiomqtt.Client) -> None:
+        # Ops only name a device; the current watched set decides, so stale or repeated ops are harmless.
+        while True:
+            device_id = await self._ops.get()
+            if device_id in self._watched:
+                await client.subscribe(self._topic(device_id), qos=0)
+            else:
+                await client.unsubscribe(self._topic(device_id))
+
+    def _receive(self, message: aiomqtt.Message) -> None:
+        device_id = message.topic.value[len(self.topic_prefix) + 1 :]
+        try:
+            event = loads(message.payload)
+        except ValueError:
+            return
+        self.received += 1
+        self._deliver(device_id, event)
+
+    def _topic(self, device_id: str) -> str:
+        return f"{self.topic_prefix}/{device_id}"
+
+
+def build_event_backend(settings: Any) -> MemoryBackend:
+    if settings.event_bus_backend == MemoryBackend.name:
+        return MemoryBackend()
+    if settings.event_bus_backend == MqttBackend.name:
+        return MqttBackend(
+            host=settings.mqtt_broker_host,
+            port=settings.mqtt_broker_port,
+            username=settings.mqtt_username,
+            password=settings.mqtt_password,
+            topic_prefix=settings.event_bus_topic_prefix,
+        )
+    raise ValueError(f"unknown event bus backend: {settings.event_bus_backend}")
+
+
+def require_shared_event_bus(settings: Any) -> None:
+    """Fail at startup when ingestion runs in another process but events would stay in this one.
+
+    With the memory backend, status replies seen by an ingestion worker never reach the API process,
+    so WebSocket streams stay silent and control commands can only time out.
+    """
+    if settings.event_bus_backend == MemoryBackend.name:
+        raise RuntimeError(
+            "EVENT_BUS_BACKEND=memory can't deliver events between ingestion workers and the API; "
+            "set EVENT_BUS_BACKEND=mqtt on every process"
+        )
+
+
+class DeviceEventBus:
+    def __init__(self, max_queue: int = 100, policy: str = DROP_OLDEST) -> None:
+        self.max_queue = max_queue
+        self.policy = policy
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self.published = 0
+        self._retired_dropped = 0
+        self.backend: MemoryBackend = MemoryBackend()
+        self.backend.attach(self._deliver)
+
+    def configure(self, max_queue: int, policy: str, backend: MemoryBackend | None = None) -> None:
+        if policy not in (DROP_OLDEST, COALESCE):
+            raise ValueError(f"unknown event bus policy: {policy}")
+        self.max_queue = max_queue
+        self.policy = policy
+        if backend is not None:
+            self.backend = backend
+            self.backend.attach(self._deliver)
+            for device_id in self._subscribers:
+                self.backend.watch(device_id)
+
+    def start(self) -> None:
+        self.backend.start()
+
+    async def stop(self) -> None:
+        await self.backend.stop()
 
     async def publish(self, device_id: str, message: dict) -> None:
-        await self._queues[device_id].put(message)
+        self.published += 1
+        self.backend.publish(device_id, message)
+
+    def _deliver(self, device_id: str, message: dict) -> None:
+        # Events for devices nobody is watching are discarded rather than buffered.
+        for sub in tuple(self._subscribers.get(device_id, ())):
+            sub.offer(message)
+
+    def open(self, device_id: str, max_queue: int | None = None, policy: str | None = None) -> Subscription:
+        sub = Subscription(self, device_id, max_queue or self.max_queue, policy or self.policy)
+        self.attach(device_id, sub)
+        return sub
+
+    def attach(self, device_id: str, sink: Any) -> None:
+        """Route ``device_id``'s events to ``sink.offer``; a sink may be attached to many devices."""
+        group = self._subscribers.get(device_id)
+        if group is None:
+            # First local subscriber for this device: start pulling its events from the backend.
+            group = self._subscribers[device_id] = set()
+            self.backend.watch(device_id)
+        group.add(sink)
+
+    def detach(self, device_id: str, sink: Any) -> None:
+        group = self._subscribers.get(device_id)
+        if group is None:
+            return
+        group.discard(sink)
+        if not group:
+            del self._subscribers[device_id]
+            self.backend.unwatch(device_id)
+
+    def retire(self, sink: Any) -> None:
+        """Keep a closed sink's drops in the running total once it is no longer attached."""
+        self._retired_dropped += sink.dropped
 
     async def subscribe(self, device_id: str) -> AsyncIterator[dict]:
-        queue = self._queues[device_id]
-        while True:
-            data = await queue.get()
-            yield data
+        sub = self.open(device_id)
+        try:
+            async for data in sub:
+                yield data
+        finally:
+            sub.close()
+
+    def stats(self) -> dict[str, Any]:
+        subs = {sub for group in self._subscribers.values() for sub in group}
+        return {
+            "devices": len(self._subscribers),
+            "subscribers": len(subs),
+            "published": self.published,
+            "dropped": self._retired_dropped + sum(sub.dropped for sub in subs),
+            "queue_depth_max": max((sub.depth for sub in subs), default=0),
+            "backend": self.backend.name,
+            **self.backend.stats(),
+        }
+
+    def _remove(self, sub: Subscription) -> None:
+        self.detach(sub.device_id, sub)
+        self.retire(sub)
 
 
 event_bus = DeviceEventBus()
+
+_scrape_stats = per_scrape(event_bus.stats)
+Gauge("event_bus_subscribers", "Open WebSocket subscriptions", fn=lambda: _scrape_stats()["subscribers"])
+Gauge("event_bus_queue_depth_max", "Deepest pending buffer across subscriptions", fn=lambda: _scrape_stats()["queue_depth_max"])
+Counter("event_bus_events_published_total", "Events published to the bus", fn=lambda: event_bus.published)
+Counter("event_bus_events_dropped_total", "Events dropped or coalesced for slow subscribers", fn=lambda: _scrape_stats()["dropped"])
@@ -0,0 +1,118 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Iterator
+
+from sqlalchemy import and_, or_, select
+
+from app.db.session import SessionLocal
+from app.models.models import SensorData
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+def arrow_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def iter_pages(
+    sensor_pk: int,
+    start: datetime | None,
+    end: datetime | None,
+    page_size: int,
+) -> Iterator[list[tuple[int, datetime, float | None, str | None]]]:
+    """Yield pages of (id, ts, value_numeric, value_text) in (ts, id) order using keyset pagination.
+
+    Each page seeks past the last (ts, id) seen on ux_sensor_data_sensor_ts instead of using OFFSET,
+    so every page costs the same no matter how deep into the range it is.
+    """
+    last: tuple[datetime, int] | None = None
+    with SessionLocal() as db:
+        while True:
+            stmt = select(SensorData.id, SensorData.ts, SensorData.value_numeric, SensorData.value_text).where(
+                SensorData.sensor_id == sensor_pk
+            )
+            if start is not None:
+                stmt = stmt.where(SensorData.ts >= start)
+            if end is not None:
+                stmt = stmt.where(SensorData.ts < end)
+            if last is not None:
+                stmt = stmt.where(
+                    or_(SensorData.ts > last[0], and_(SensorData.ts == last[0], SensorData.id > last[1]))
+                )
+            stmt = stmt.order_by(SensorData.ts, SensorData.id).limit(page_size)
+            page = [tuple(row) for row in db.execute(stmt.execution_options(stream_results=True))]
+            # Release the connection between pages so a slow client doesn't pin it.
+            db.rollback()
+            if not page:
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            last = (page[-1][1], page[-1][0])
+
+
+def stream_ndjson(sensor_id: str, pages: Iterator[list]) -> Iterator[bytes]:
+    for page in pages:
+        yield "".join(
+            json.dumps(
+                {
+                    "sensor_id": sensor_id,
+                    "ts": ts.isoformat(),
+                    "value_numeric": value_numeric,
+                    "value_text": value_text,
+                }
+            )
+            + "\n"
+            for _, ts, value_numeric, value_text in page
+        ).encode("utf-8")
+
+
+def stream_csv(sensor_id: str, pages: Iterator[list]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(("sensor_id", "ts", "value_numeric", "value_text"))
+    for page in pages:
+        writer.writerows((sensor_id, ts.isoformat(), value_numeric, value_text) for _, ts, value_numeric, value_text in page)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def stream_arrow(sensor_id: str, pages: Iterator[list]) -> Iterator[bytes]:
+    import pyarrow as pa
+
+    schema = pa.schema(
+        [
+            ("ts", pa.timestamp("us")),
+            ("value_numeric", pa.float64()),
+            ("value_text", pa.string()),
+        ],
+        metadata={"sensor_id": sensor_id},
+    )
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+
+    def drain() -> bytes:
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    for page in pages:
+        _, ts, value_numeric, value_text = zip(*page)
+        writer.write_batch(pa.record_batch([pa.array(ts), pa.array(value_numeric), pa.array(value_text)], schema=schema))
+        yield drain()
+    writer.close()
+    yield drain()
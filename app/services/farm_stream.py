@@ -0,0 +1,186 @@
+"""One multiplexed event stream per dashboard connection, instead of one WebSocket per device.
+
+The client picks devices with control messages; the stream filters by sensor type or alerts, holds
+back readings for a sensor sent less than ``throttle_s`` ago (the newest one wins), and hands the
+socket whole batches so a busy farm costs one frame per window rather than one per reading.
+"""
+import asyncio
+import itertools
+import time
+from collections import OrderedDict
+from typing import Any, Iterable
+
+from app.services.event_bus import DeviceEventBus
+
+STATUS = "status"
+
+
+class FarmStream:
+    def __init__(
+        self,
+        bus: DeviceEventBus,
+        max_pending: int = 1000,
+        max_devices: int = 500,
+        batch_max: int = 200,
+        batch_window_s: float = 0.05,
+        throttle_s: float = 0.0,
+        min_throttle_s: float = 0.0,
+    ) -> None:
+        self.max_pending = max_pending
+        self.max_devices = max_devices
+        self.batch_max = batch_max
+        self.batch_window_s = batch_window_s
+        self.min_throttle_s = min_throttle_s
+        self.throttle_s = max(throttle_s, min_throttle_s)
+        self.devices: set[str] = set()
+        self.sensor_types: set[str] | None = None
+        self.alerts_only = False
+        self.dropped = 0
+        self.delivered = 0
+        self.closed = False
+        self._bus = bus
+        self._pending: OrderedDict[Any, dict] = OrderedDict()
+        self._last_sent: dict[Any, float] = {}
+        self._last_frame = 0.0
+        self._seq = itertools.count()
+        self._ready = asyncio.Event()
+
+    def subscribe(self, devices: Iterable[str]) -> list[str]:
+        """Attach to ``devices``; returns the ones that were added (the rest were already watched)."""
+        added = []
+        for device_id in devices:
+            if device_id in self.devices:
+                continue
+            if len(self.devices) >= self.max_devices:
+                raise ValueError(f"at most {self.max_devices} devices per stream")
+            self.devices.add(device_id)
+            self._bus.attach(device_id, self)
+            added.append(device_id)
+        return added
+
+    def unsubscribe(self, devices: Iterable[str]) -> list[str]:
+        removed = []
+        for device_id in devices:
+            if device_id not in self.devices:
+                continue
+            self.devices.discard(device_id)
+            self._bus.detach(device_id, self)
+            removed.append(device_id)
+        # Nothing more will arrive for these devices, so their throttle state can go too.
+        gone = set(removed)
+        for key in [key for key in self._pending if isinstance(key, tuple) and key[0] in gone]:
+            del self._pending[key]
+        for key in [key for key in self._last_sent if key[0] in gone]:
+            del self._last_sent[key]
+        return removed
+
+    def set_filter(
+        self,
+        sensor_types: Iterable[str] | None = None,
+        alerts_only: bool | None = None,
+        throttle_s: float | None = None,
+    ) -> None:
+        if sensor_types is not None:
+            # An empty list clears the filter.
+            self.sensor_types = set(sensor_types) or None
+        if alerts_only is not None:
+            self.alerts_only = alerts_only
+        if throttle_s is not None:
+            self.throttle_s = max(throttle_s, self.min_throttle_s)
+
+    def offer(self, message: dict) -> None:
+        """Called by the event bus for every event of a watched device."""
+        if self.closed or not self._wanted(message):
+            return
+        self._put(self._key(message), message)
+
+    def reply(self, message: dict) -> None:
+        """Queue a control acknowledgement or error; it goes out in order with the events."""
+        if not self.closed:
+            self._put(next(self._seq), message)
+
+    async def next_batch(self) -> list[dict] | None:
+        """Next frame's worth of events, or None once the stream is closed."""
+        while not self.closed:
+            wait = None
+            if self._pending:
+                now = time.monotonic()
+                # The first event after a quiet spell goes out at once; after that, at most one frame per window.
+                wait = self._last_frame + self.batch_window_s - now
+                if wait <= 0:
+                    batch, wait = self._take(now)
+                    if batch:
+                        self._last_frame = now
+                        self.delivered += len(batch)
+                        return batch
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+        return None
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        for device_id in tuple(self.devices):
+            self._bus.detach(device_id, self)
+        self.devices.clear()
+        self._pending.clear()
+        self._ready.set()
+        self._bus.retire(self)
+
+    def _wanted(self, message: dict) -> bool:
+        alert = message.get("alert")
+        if alert is not None:
+            return self.sensor_types is None or alert.get("type") in self.sensor_types
+        if self.alerts_only:
+            return False
+        if self.sensor_types is None:
+            return True
+        return message.get("type") in self.sensor_types
+
+    def _key(self, message: dict) -> Any:
+        # Readings and status are latest-wins per sensor; alerts are always delivered individually.
+        if "alert" not in message:
+            device_id = message.get("device_id")
+            if message.get("type") == STATUS:
+                return (device_id, STATUS)
+            sensor_id = message.get("sensor_id")
+            if sensor_id is not None:
+                return (device_id, sensor_id)
+        return next(self._seq)
+
+    def _put(self, key: Any, message: dict) -> None:
+        if key in self._pending:
+            self._pending[key] = message
+            self.dropped += 1
+            return
+        if len(self._pending) >= self.max_pending:
+            self._pending.popitem(last=False)
+            self.dropped += 1
+        self._pending[key] = message
+        self._ready.set()
+
+    def _take(self, now: float) -> tuple[list[dict], float | None]:
+        """Pop sendable events in arrival order; also how long until a held-back one becomes sendable."""
+        batch: list[dict] = []
+        retry: float | None = None
+        for key in list(self._pending):
+            if len(batch) >= self.batch_max:
+                retry = 0.0
+                break
+            if isinstance(key, tuple):
+                last = self._last_sent.get(key)
+                if last is not None and now - last < self.throttle_s:
+                    remaining = last + self.throttle_s - now
+                    retry = remaining if retry is None else min(retry, remaining)
+                    continue
+                self._last_sent[key] = now
+            batch.append(self._pending.pop(key))
+        return batch, retry
@@ -0,0 +1,395 @@
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from app.core.metrics import Counter, Histogram
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_REQUESTS = Counter("inference_requests_total", "Image classification requests by outcome", ("result",))
+INFERENCE_SECONDS = Histogram(
+    "inference_request_seconds",
+    "Time to classify one uploaded image, by stage",
+    ("stage",),
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+INFERENCE_BATCH_SIZE = Histogram(
+    "inference_batch_size", "Images per model invocation", buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+
+
+class ModelUnavailable(RuntimeError):
+    """No model is loaded (none configured, or it failed to load)."""
+
+
+def preprocess(data: bytes, size: int) -> np.ndarray:
+    """Decode an uploaded image the way the training pipeline did: RGB, nearest-neighbour resize, scaled to 0..1."""
+    if Image is None:
+        raise ModelUnavailable("Pillow is not installed")
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            # Full decode, no JPEG draft mode: Keras' load_img in training picks nearest pixels from the
+            # full-resolution image, and a draft-scaled decode would pick different ones.
+            pixels = img.convert("RGB").resize((size, size), Image.NEAREST)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        raise ValueError("unsupported or corrupt image") from e
+    return np.asarray(pixels, dtype=np.float32) / 255.0
+
+
+class KerasRuntime:
+    """The training notebook's saved ``.h5``/``.keras`` model, run with TensorFlow."""
+
+    name = "keras"
+
+    def __init__(self, path: Path, threads: int) -> None:
+        import tensorflow as tf
+
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        self._model = tf.keras.models.load_model(path, compile=False)
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        # Calling the model directly skips model.predict()'s per-call dataset setup.
+        return np.asarray(self._model(batch, training=False))
+
+
+class TFLiteRuntime:
+    """A converted ``.tflite`` model; quantized inputs and outputs are (de)quantized here."""
+
+    name = "tflite"
+
+    def __init__(self, path: Path, threads: int) -> None:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+        self._interpreter = Interpreter(model_path=str(path), num_threads=threads)
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = 0
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        interpreter = self._interpreter
+        if len(batch) != self._batch_size:
+            interpreter.resize_tensor_input(self._input["index"], batch.shape)
+            interpreter.allocate_tensors()
+            self._input = interpreter.get_input_details()[0]
+            self._output = interpreter.get_output_details()[0]
+            self._batch_size = len(batch)
+        interpreter.set_tensor(self._input["index"], _quantize(batch, self._input))
+        interpreter.invoke()
+        output = interpreter.get_tensor(self._output["index"])
+        scale, zero_point = self._output["quantization"]
+        if scale:
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+
+class OnnxRuntime:
+    """A converted ``.onnx`` model on the onnxruntime CPU provider."""
+
+    name = "onnx"
+
+    def __init__(self, path: Path, threads: int) -> None:
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        self._session = ort.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+        self._input_name = self._session.get_inputs()[0].name
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return self._session.run(None, {self._input_name: batch})[0]
+
+
+def _quantize(batch: np.ndarray, details: dict[str, Any]) -> np.ndarray:
+    dtype = details["dtype"]
+    if dtype == np.float32:
+        return batch
+    scale, zero_point = details["quantization"]
+    info = np.iinfo(dtype)
+    return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(dtype)
+
+
+def load_runtime(path: str | Path, threads: int):
+    path = Path(path)
+    if path.suffix == ".tflite":
+        return TFLiteRuntime(path, threads)
+    if path.suffix == ".onnx":
+        return OnnxRuntime(path, threads)
+    return KerasRuntime(path, threads)
+
+
+def load_labels(path: str | Path | None, count: int) -> list[str]:
+    """Class names from a JSON list or a one-per-line text file, in the model's output order."""
+    if path is None:
+        logger.warning("no inference labels file configured; reporting class indices")
+        return [f"class_{i}" for i in range(count)]
+    text = Path(path).read_text(encoding="utf-8")
+    labels = json.loads(text) if str(path).endswith(".json") else [line.strip() for line in text.splitlines() if line.strip()]
+    if len(labels) != count:
+        raise ValueError(f"{path} has {len(labels)} labels but the model outputs {count} classes")
+    return labels
+
+
+class InferenceService:
+    """Plant disease classification for uploaded images.
+
+    Images are decoded in a small thread pool, then queued; a batcher collects whatever arrives within
+    ``batch_window_s`` (up to ``batch_max`` images) into one model call on a dedicated thread, so the event
+    loop never runs the model and concurrent uploads share invocations. Results are cached by the image's
+    SHA-256, and identical uploads already in flight wait for the same result.
+    """
+
+    def __init__(self) -> None:
+        self.model_path: str | None = None
+        self.labels_path: str | None = None
+        self.img_size = 224
+        self.batch_max = 16
+        self.batch_window_s = 0.01
+        self.decode_workers = 2
+        self.model_threads = 2
+        self.cache_size = 1024
+        self.top_k = 3
+        self.runtime = None
+        self.labels: list[str] = []
+        self._cache: OrderedDict[str, dict[str, Any]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self._decode_pool: ThreadPoolExecutor | None = None
+        self._model_pool: ThreadPoolExecutor | None = None
+        self.batches = 0
+        self.images = 0
+        self.cache_hits = 0
+
+    def configure(
+        self,
+        model_path: str | None,
+        labels_path: str | None,
+        img_size: int,
+        batch_max: int,
+        batch_window_ms: int,
+        decode_workers: int,
+        model_threads: int,
+        cache_size: int,
+    ) -> None:
+        self.model_path = model_path
+        self.labels_path = labels_path
+        self.img_size = img_size
+        self.batch_max = batch_max
+        self.batch_window_s = batch_window_ms / 1000
+        self.decode_workers = decode_workers
+        self.model_threads = model_threads
+        self.cache_size = cache_size
+
+    @property
+    def ready(self) -> bool:
+        return self._task is not None
+
+    async def start(self) -> None:
+        """Load the model once, off the event loop; a model that fails to load leaves inference disabled."""
+        if self.model_path is None or self._task is not None:
+            return
+        self._model_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference-model")
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._model_pool, self._load)
+        except Exception:
+            logger.exception("inference model failed to load", extra={"path": self.model_path})
+            self._model_pool.shutdown(wait=False)
+            self._model_pool = None
+            return
+        self._decode_pool = ThreadPoolExecutor(max_workers=self.decode_workers, thread_name_prefix="inference-decode")
+        self._queue = asyncio.Queue(maxsize=self.batch_max * 8)
+        self._task = asyncio.create_task(self._run())
+        logger.info("inference model loaded", extra={"runtime": self.runtime.name, "classes": len(self.labels)})
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        while self._queue is not None and not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(ModelUnavailable("inference service stopped"))
+        for pool in (self._decode_pool, self._model_pool):
+            if pool is not None:
+                pool.shutdown(wait=False)
+        self._decode_pool = self._model_pool = None
+
+    async def classify(self, data: bytes) -> dict[str, Any]:
+        """Top classes for one encoded image; raises ValueError for undecodable images."""
+        if not self.ready:
+            raise ModelUnavailable("no inference model loaded")
+        started = time.perf_counter()
+        digest = hashlib.sha256(data).hexdigest()
+        cached = self._cache.get(digest)
+        if cached is not None:
+            self._cache.move_to_end(digest)
+            self.cache_hits += 1
+            INFERENCE_REQUESTS.inc(result="cache_hit")
+            return {**cached, "cached": True, "latency_ms": round((time.perf_counter() - started) * 1000, 3)}
+
+        task = self._inflight.get(digest)
+        if task is None:
+            task = self._inflight[digest] = asyncio.ensure_future(self._classify(digest, data))
+            task.add_done_callback(lambda _: self._inflight.pop(digest, None))
+        try:
+            # Shielded: one client disconnecting doesn't cancel a result others are waiting for.
+            result = await asyncio.shield(task)
+        except ValueError:
+            INFERENCE_REQUESTS.inc(result="invalid")
+            raise
+        except Exception:
+            INFERENCE_REQUESTS.inc(result="error")
+            raise
+        elapsed = time.perf_counter() - started
+        INFERENCE_SECONDS.observe(elapsed, stage="total")
+        INFERENCE_REQUESTS.inc(result="ok")
+        return {**result, "cached": False, "latency_ms": round(elapsed * 1000, 3)}
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "runtime": self.runtime.name if self.runtime is not None else None,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self.batches,
+            "images": self.images,
+            "avg_batch_size": round(self.images / self.batches, 2) if self.batches else None,
+            "cache_entries": len(self._cache),
+            "cache_hits": self.cache_hits,
+        }
+
+    def _load(self) -> None:
+        runtime = load_runtime(self.model_path, self.model_threads)
+        # Warm-up call: allocates tensors and tells us the number of classes.
+        probs = runtime.predict(np.zeros((1, self.img_size, self.img_size, 3), dtype=np.float32))
+        self.labels = load_labels(self.labels_path, probs.shape[-1])
+        self.runtime = runtime
+
+    async def _classify(self, digest: str, data: bytes) -> dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        image = await loop.run_in_executor(self._decode_pool, preprocess, data, self.img_size)
+        INFERENCE_SECONDS.observe(time.perf_counter() - started, stage="decode")
+        future = loop.create_future()
+        await self._queue.put((image, future))
+        probs = await future
+        top = np.argsort(probs)[::-1][: self.top_k]
+        result = {
+            "label": self.labels[top[0]],
+            "confidence": round(float(probs[top[0]]), 4),
+            "top": [{"label": self.labels[i], "confidence": round(float(probs[i]), 4)} for i in top],
+            "model": self.runtime.name,
+            "sha256": digest,
+        }
+        self._cache[digest] = result
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window_s
+            while len(items) < self.batch_max:
+                try:
+                    items.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            batch = np.stack([image for image, _ in items])
+            started = time.perf_counter()
+            try:
+                probs = await loop.run_in_executor(self._model_pool, self.runtime.predict, batch)
+            except Exception as e:
+                logger.exception("inference batch failed", extra={"size": len(items)})
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            INFERENCE_SECONDS.observe(time.perf_counter() - started, stage="model")
+            INFERENCE_BATCH_SIZE.observe(len(items))
+            self.batches += 1
+            self.images += len(items)
+            for (_, future), row in zip(items, probs):
+                if not future.done():
+                    future.set_result(row)
+
+
+def convert(source: str, fmt: str, output: str | None, quantize: str) -> Path:
+    """Convert the trained Keras model to a TFLite or ONNX file for the lighter CPU runtimes."""
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(source, compile=False)
+    target = Path(output) if output else Path(source).with_suffix(f".{fmt}")
+    if fmt == "tflite":
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        if quantize != "none":
+            # Dynamic-range int8 weights; float16 halves the size with no accuracy loss to speak of.
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            if quantize == "float16":
+                converter.target_spec.supported_types = [tf.float16]
+        target.write_bytes(converter.convert())
+        return target
+
+    import tf2onnx
+
+    spec = (tf.TensorSpec((None, *model.input_shape[1:]), tf.float32, name="input"),)
+    if quantize == "none":
+        tf2onnx.convert.from_keras(model, input_signature=spec, output_path=str(target))
+        return target
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    unquantized = target.with_suffix(".fp32.onnx")
+    tf2onnx.convert.from_keras(model, input_signature=spec, output_path=str(unquantized))
+    quantize_dynamic(str(unquantized), str(target), weight_type=QuantType.QUInt8)
+    unquantized.unlink()
+    return target
+
+
+inference_service = InferenceService()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the plant disease model for CPU inference")
+    parser.add_argument("command", choices=["convert"])
+    parser.add_argument("model", help="Trained .h5/.keras model")
+    parser.add_argument("--format", choices=["tflite", "onnx"], default="tflite")
+    parser.add_argument("--output")
+    parser.add_argument("--quantize", choices=["dynamic", "float16", "none"], default="dynamic")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.format == "onnx" and args.quantize == "float16":
+        parser.error("float16 quantization is only available for tflite")
+    print(convert(args.model, args.format, args.output, args.quantize))
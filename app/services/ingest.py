@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any
+
+from sqlalchemy import insert, select, tuple_
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+
+from app.core.metrics import Counter, Gauge, Histogram, timed
+from app.db.session import DB_COMMIT_SECONDS, get_async_engine
+from app.models.models import RollupDirty, SensorData
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+INGEST_ROWS = Counter("ingest_rows_total", "Sensor readings written to the database")
+INGEST_DUPLICATE_ROWS = Counter("ingest_duplicate_rows_total", "Redelivered readings skipped by the (sensor_id, ts) key")
+INGEST_DROPPED_ROWS = Counter("ingest_dropped_rows_total", "Sensor readings lost to failed batch inserts")
+INGEST_FLUSH_RETRIES = Counter("ingest_flush_retries_total", "Batch inserts retried after a connection or server error")
+INGEST_LATENCY = Histogram("ingest_latency_seconds", "Time from a reading being queued to its batch being committed")
+
+
+class IngestionPipeline:
+    """Bounded write-behind queue that bulk-inserts sensor readings in batches."""
+
+    def __init__(
+        self,
+        max_queue: int = 10000,
+        batch_size: int = 500,
+        flush_interval_s: float = 1.0,
+        max_flush_attempts: int = 5,
+        retry_backoff_s: float = 0.5,
+    ) -> None:
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        # A batch that hits a transient DB error is retried, doubling the wait, before its rows are dropped.
+        self.max_flush_attempts = max_flush_attempts
+        self.retry_backoff_s = retry_backoff_s
+        # Readings older than this may fall in rollup buckets already closed; None when rollups are off.
+        self.late_after: timedelta | None = timedelta(seconds=120)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._task: asyncio.Task | None = None
+
+        self.queue_high_water = 0
+        self.backpressure_waits = 0
+        self.batches = 0
+        self.rows_written = 0
+        self.failed_batches = 0
+        self.flush_retries = 0
+        self.dropped_rows = 0
+        self.duplicate_rows = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    def configure(
+        self,
+        max_queue: int,
+        batch_size: int,
+        flush_interval_s: float,
+        late_after_s: float | None = 120.0,
+        max_flush_attempts: int = 5,
+    ) -> None:
+        if self._task is not None:
+            raise RuntimeError("cannot reconfigure a running ingestion pipeline")
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.max_flush_attempts = max_flush_attempts
+        self.late_after = None if late_after_s is None else timedelta(seconds=late_after_s)
+        self._queue = asyncio.Queue(maxsize=max_queue)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def submit(self, row: dict[str, Any]) -> None:
+        if self._queue.full():
+            # The flusher is behind; block the caller (and with it the MQTT reader) until space frees up.
+            self.backpressure_waits += 1
+        await self._queue.put((time.perf_counter(), row))
+        depth = self._queue.qsize()
+        if depth > self.queue_high_water:
+            self.queue_high_water = depth
+
+    async def submit_many(self, rows: list[dict[str, Any]]) -> None:
+        # Queued back to back, so they normally land in the same bulk insert.
+        for row in rows:
+            await self.submit(row)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_max": self.max_queue,
+            "queue_high_water": self.queue_high_water,
+            "backpressure_waits": self.backpressure_waits,
+            "batches": self.batches,
+            "rows_written": self.rows_written,
+            "failed_batches": self.failed_batches,
+            "flush_retries": self.flush_retries,
+            "dropped_rows": self.dropped_rows,
+            "duplicate_rows": self.duplicate_rows,
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "avg_batch_size": round(self.rows_written / self.batches, 2) if self.batches else 0.0,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self._total_flush_ms / self.batches, 3) if self.batches else 0.0,
+        }
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval_s
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[tuple[float, dict[str, Any]]]) -> None:
+        started = time.perf_counter()
+        # Backfilled telemetry can land in buckets the rollup compactor has already closed. The mark goes
+        # to the DB with the rows, because the compactor may run in another process.
+        oldest = min(row["ts"] for _, row in batch)
+        late = self.late_after is not None and oldest < datetime.utcnow() - self.late_after
+        rows = [row for _, row in batch]
+        attempt = 1
+        while True:
+            try:
+                inserted = await _bulk_insert(rows, oldest if late else None)
+                break
+            except Exception as e:
+                if _retryable(e) and attempt < self.max_flush_attempts:
+                    # The queue keeps filling meanwhile, so a long outage pushes back on the MQTT reader.
+                    delay = self.retry_backoff_s * 2 ** (attempt - 1)
+                    self.flush_retries += 1
+                    INGEST_FLUSH_RETRIES.inc()
+                    logger.warning(
+                        "sensor batch flush failed, retrying",
+                        extra={"batch_size": len(batch), "attempt": attempt, "sleep_s": delay},
+                    )
+                    attempt += 1
+                    await asyncio.sleep(delay)
+                    continue
+                self.failed_batches += 1
+                self.dropped_rows += len(batch)
+                INGEST_DROPPED_ROWS.inc(len(batch))
+                logger.exception("sensor batch flush failed", extra={"batch_size": len(batch), "attempts": attempt})
+                return
+        committed = time.perf_counter()
+        for queued_at, _ in batch:
+            INGEST_LATENCY.observe(committed - queued_at)
+        duplicates = len(batch) - inserted
+        if duplicates:
+            self.duplicate_rows += duplicates
+            INGEST_DUPLICATE_ROWS.inc(duplicates)
+        INGEST_ROWS.inc(inserted)
+        elapsed_ms = (committed - started) * 1000
+        self.batches += 1
+        self.rows_written += inserted
+        self.last_batch_size = len(batch)
+        self.max_batch_size = max(self.max_batch_size, len(batch))
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self._total_flush_ms += elapsed_ms
+        logger.debug("flushed sensor batch", extra={"batch_size": len(batch), "flush_ms": elapsed_ms})
+
+
+def _retryable(exc: Exception) -> bool:
+    """Lost connections and server-side errors (lock wait, deadlock) can succeed on a retry; bad data can't."""
+    if isinstance(exc, (OperationalError, InterfaceError)):
+        return True
+    return isinstance(exc, DBAPIError) and exc.connection_invalidated
+
+
+def _insert_ignoring_duplicates(dialect: str):
+    """INSERT that skips rows already stored under the same (sensor_id, ts) unique key."""
+    if dialect == "mysql":
+        stmt = mysql.insert(SensorData)
+        # A no-op update rather than INSERT IGNORE, which would also hide truncation and other errors.
+        # It still reports one affected row per duplicate, so _bulk_insert looks the keys up first.
+        return stmt.on_duplicate_key_update(ts=stmt.inserted.ts)
+    if dialect == "sqlite":
+        return sqlite.insert(SensorData).on_conflict_do_nothing(index_elements=["sensor_id", "ts"])
+    if dialect == "postgresql":
+        return postgresql.insert(SensorData).on_conflict_do_nothing(index_elements=["sensor_id", "ts"])
+    return insert(SensorData)
+
+
+@timed(DB_COMMIT_SECONDS, op="sensor_batch")
+async def _bulk_insert(rows: list[dict[str, Any]], dirty_since: datetime | None = None) -> int:
+    """Insert ``rows``, and a rollup dirty mark if given, in one transaction; returns how many rows were new."""
+    engine = get_async_engine()
+    # Core connection rather than a session: the ORM bulk path doesn't report a rowcount.
+    async with engine.begin() as conn:
+        if engine.dialect.name == "mysql":
+            rows = await _unstored_rows(conn, rows)
+            if rows:
+                await conn.execute(_insert_ignoring_duplicates("mysql"), rows)
+            inserted = len(rows)
+        else:
+            result = await conn.execute(_insert_ignoring_duplicates(engine.dialect.name), rows)
+            # Some drivers can't report a rowcount for executemany; assume nothing was skipped then.
+            inserted = result.rowcount if result.rowcount >= 0 else len(rows)
+        if dirty_since is not None:
+            await conn.execute(insert(RollupDirty).values(since=dirty_since))
+    return inserted
+
+
+def _round_ms(ts: datetime) -> datetime:
+    """Round to the millisecond like MySQL does when storing into DATETIME(3)."""
+    return ts.replace(microsecond=0) + timedelta(milliseconds=(ts.microsecond + 500) // 1000)
+
+
+async def _unstored_rows(conn, rows: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """The rows whose (sensor_id, ts) isn't stored yet, with ``ts`` at the column's millisecond precision.
+
+    MySQL's drivers connect with CLIENT_FOUND_ROWS, so ON DUPLICATE KEY UPDATE counts a skipped
+    duplicate as an affected row and the rowcount can't be used. A duplicate written by another
+    process between this lookup and the insert is still skipped, but counted as new.
+    """
+    unique: dict[tuple[int, datetime], dict[str, Any]] = {}
+    for row in rows:
+        key = (row["sensor_id"], _round_ms(row["ts"]))
+        if key not in unique:
+            unique[key] = {**row, "ts": key[1]}
+    stored = await conn.execute(
+        select(SensorData.sensor_id, SensorData.ts).where(tuple_(SensorData.sensor_id, SensorData.ts).in_(list(unique)))
+    )
+    for key in stored:
+        unique.pop(tuple(key), None)
+    return list(unique.values())
+
+
+ingest_pipeline = IngestionPipeline()
+
+Gauge("ingest_queue_depth", "Readings waiting to be written", fn=lambda: ingest_pipeline._queue.qsize())
+Counter("ingest_backpressure_waits_total", "Submits that blocked on a full queue", fn=lambda: ingest_pipeline.backpressure_waits)
@@ -0,0 +1,161 @@
+import threading
+import time
+from datetime import datetime
+from typing import Any, Iterable
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.models import Device, Sensor, SensorData
+
+
+class LastValueCache:
+    """Latest reading per sensor, kept current by ingestion and filled from the DB on a cold read."""
+
+    def __init__(self) -> None:
+        self._devices: dict[str, dict[str, dict[str, Any]]] = {}
+        # Devices whose entries are known to cover every sensor (loaded from the DB or first seen live),
+        # mapped to the monotonic time they became complete.
+        self._complete: dict[str, float] = {}
+        self._farm_loaded_at: float | None = None
+        # None: this process ingests every reading, so entries never go stale.
+        self.ttl_s: float | None = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, ttl_s: float | None) -> None:
+        """Expire completeness after ``ttl_s`` when other processes ingest some of the readings."""
+        self.ttl_s = ttl_s
+
+    def _fresh(self, since: float | None) -> bool:
+        if since is None:
+            return False
+        return self.ttl_s is None or time.monotonic() - since < self.ttl_s
+
+    def update(
+        self,
+        device_id: str,
+        sensor_id: str,
+        sensor_type: str,
+        ts: datetime,
+        value_numeric: float | None,
+        value_text: str | None,
+    ) -> None:
+        latest = self._devices.get(device_id)
+        if latest is None:
+            with self._lock:
+                latest = self._devices.setdefault(device_id, {})
+                if self._farm_loaded_at is not None:
+                    # Not present after a farm-wide load means it had no readings then.
+                    self._complete.setdefault(device_id, self._farm_loaded_at)
+        current = latest.get(sensor_id)
+        if current is not None and current["ts"] > ts:
+            return
+        latest[sensor_id] = {
+            "sensor_id": sensor_id,
+            "type": sensor_type,
+            "ts": ts,
+            "value_numeric": value_numeric,
+            "value_text": value_text,
+        }
+
+    def mark_empty(self, device_id: str) -> None:
+        """Record a freshly created device that cannot have readings yet."""
+        with self._lock:
+            self._devices.setdefault(device_id, {})
+            self._complete[device_id] = time.monotonic()
+
+    def get(self, device_id: str) -> list[dict[str, Any]] | None:
+        if not self._fresh(self._complete.get(device_id)):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return list(self._devices.get(device_id, {}).values())
+
+    def get_many(self, device_ids: Iterable[str] | None) -> tuple[dict[str, list[dict[str, Any]]], list[str] | None]:
+        """Return cached devices and the ids that still need a DB load (None: the whole farm)."""
+        if device_ids is None:
+            if not self._fresh(self._farm_loaded_at):
+                self.misses += 1
+                return {}, None
+            self.hits += 1
+            return {d: list(v.values()) for d, v in list(self._devices.items())}, []
+        found: dict[str, list[dict[str, Any]]] = {}
+        missing: list[str] = []
+        for device_id in device_ids:
+            latest = self.get(device_id)
+            if latest is None:
+                missing.append(device_id)
+            else:
+                found[device_id] = latest
+        return found, missing
+
+    async def load(self, db: AsyncSession, device_ids: list[str] | None) -> dict[str, list[dict[str, Any]]]:
+        """Fill the cache for ``device_ids`` (or the whole farm) with a single query."""
+        loaded: dict[str, dict[str, dict[str, Any]]] = {}
+        started = time.monotonic()
+        for row in await db.execute(_latest_query(device_ids)):
+            # Outer joins yield a row for devices and sensors without readings; unknown ids yield none.
+            latest = loaded.setdefault(row.device_id, {})
+            if row.ts is not None:
+                latest[row.sensor_id] = {
+                    "sensor_id": row.sensor_id,
+                    "type": row.type,
+                    "ts": row.ts,
+                    "value_numeric": row.value_numeric,
+                    "value_text": row.value_text,
+                }
+        with self._lock:
+            for device_id, from_db in loaded.items():
+                latest = self._devices.setdefault(device_id, {})
+                for sensor_id, entry in from_db.items():
+                    current = latest.get(sensor_id)
+                    if current is None or current["ts"] < entry["ts"]:
+                        latest[sensor_id] = entry
+                self._complete[device_id] = started
+            if device_ids is None:
+                self._farm_loaded_at = started
+        return {d: list(self._devices[d].values()) for d in loaded}
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "devices": len(self._devices),
+            "complete_devices": len(self._complete),
+            "farm_loaded": self._farm_loaded_at is not None,
+            "ttl_s": self.ttl_s,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def _latest_query(device_ids: list[str] | None):
+    newest = (
+        select(SensorData.sensor_id, func.max(SensorData.ts).label("ts"))
+        .join(Sensor, Sensor.id == SensorData.sensor_id)
+        .join(Device, Device.id == Sensor.device_id)
+        .group_by(SensorData.sensor_id)
+    )
+    if device_ids is not None:
+        newest = newest.where(Device.device_id.in_(device_ids))
+    newest = newest.subquery()
+    stmt = (
+        select(
+            Device.device_id,
+            Sensor.sensor_id,
+            Sensor.type,
+            SensorData.ts,
+            SensorData.value_numeric,
+            SensorData.value_text,
+        )
+        .outerjoin(Sensor, Sensor.device_id == Device.id)
+        .outerjoin(newest, newest.c.sensor_id == Sensor.id)
+        .outerjoin(SensorData, and_(SensorData.sensor_id == newest.c.sensor_id, SensorData.ts == newest.c.ts))
+        .order_by(SensorData.id)
+    )
+    if device_ids is not None:
+        stmt = stmt.where(Device.device_id.in_(device_ids))
+    return stmt
+
+
+last_value_cache = LastValueCache()
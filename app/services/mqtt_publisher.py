@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import time
+from typing import Any
+
+import aiomqtt
+
+from app.core.metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+
+class MqttPublisher:
+    """Long-lived MQTT connection shared by every outbound publish (alerts, control commands)."""
+
+    def __init__(self, max_queue: int = 1000, reconnect_interval_s: float = 5.0) -> None:
+        self.host = "localhost"
+        self.port = 1883
+        self.username: str | None = None
+        self.password: str | None = None
+        self.reconnect_interval_s = reconnect_interval_s
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._task: asyncio.Task | None = None
+        self.connected = False
+
+        self.published = 0
+        self.failed = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self.last_latency_ms = 0.0
+        self.max_latency_ms = 0.0
+        self._total_latency_ms = 0.0
+
+    def configure(
+        self,
+        host: str,
+        port: int,
+        username: str | None = None,
+        password: str | None = None,
+        max_queue: int = 1000,
+    ) -> None:
+        if self._task is not None:
+            raise RuntimeError("cannot reconfigure a running mqtt publisher")
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self._queue = asyncio.Queue(maxsize=max_queue)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self.connected = False
+
+    async def publish(
+        self,
+        topic: str,
+        payload: bytes,
+        qos: int = 1,
+        retain: bool = False,
+        timeout: float | None = None,
+    ) -> None:
+        """Queue a message and wait until the broker connection has sent it."""
+        done = asyncio.get_running_loop().create_future()
+        await self._queue.put((topic, payload, qos, retain, done, time.perf_counter()))
+        await asyncio.wait_for(done, timeout)
+
+    def publish_nowait(self, topic: str, payload: bytes, qos: int = 1, retain: bool = False) -> bool:
+        """Queue a message without waiting; returns False if the outbound queue is full."""
+        try:
+            self._queue.put_nowait((topic, payload, qos, retain, None, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("mqtt outbound queue full, dropping message", extra={"topic": topic})
+            return False
+        return True
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "connected": self.connected,
+            "queue_depth": self._queue.qsize(),
+            "published": self.published,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "reconnects": self.reconnects,
+            "last_latency_ms": round(self.last_latency_ms, 3),
+            "max_latency_ms": round(self.max_latency_ms, 3),
+            "avg_latency_ms": round(self._total_latency_ms / self.published, 3) if self.published else 0.0,
+        }
+
+    async def _run(self) -> None:
+        pending = None
+        while True:
+            try:
+                async with aiomqtt.Client(
+                    hostname=self.host,
+                    port=self.port,
+                    username=self.username,
+                    password=self.password,
+                ) as client:
+                    self.connected = True
+                    logger.info("mqtt publisher connected", extra={"host": self.host, "port": self.port})
+                    while True:
+                        if pending is None:
+                            pending = await self._queue.get()
+                        topic, payload, qos, retain, done, enqueued_at = pending
+                        if done is not None and done.done():
+                            # Caller already gave up (timeout/cancel); don't send a stale command.
+                            pending = None
+                            continue
+                        try:
+                            await client.publish(topic, payload, qos=qos, retain=retain)
+                        except aiomqtt.MqttError:
+                            raise
+                        except Exception as e:
+                            pending = None
+                            self.failed += 1
+                            _resolve(done, e)
+                            logger.warning("mqtt publish rejected", extra={"topic": topic, "error": str(e)})
+                            continue
+                        pending = None
+                        self._record(enqueued_at)
+                        _resolve(done)
+            except aiomqtt.MqttError as e:
+                self.connected = False
+                self.reconnects += 1
+                if pending is not None:
+                    _, _, _, _, done, _ = pending
+                    # Fail the waiting caller fast; fire-and-forget messages are retried after reconnect.
+                    if done is not None:
+                        self.failed += 1
+                        _resolve(done, e)
+                        pending = None
+                logger.warning("mqtt publisher disconnected, retrying", extra={"sleep_s": self.reconnect_interval_s})
+                await asyncio.sleep(self.reconnect_interval_s)
+
+    def _record(self, enqueued_at: float) -> None:
+        latency_ms = (time.perf_counter() - enqueued_at) * 1000
+        self.published += 1
+        self.last_latency_ms = latency_ms
+        self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+        self._total_latency_ms += latency_ms
+
+
+def _resolve(done: asyncio.Future | None, error: Exception | None = None) -> None:
+    if done is None or done.done():
+        return
+    if error is None:
+        done.set_result(None)
+    else:
+        done.set_exception(error)
+
+
+mqtt_publisher = MqttPublisher()
+
+Gauge("mqtt_publisher_connected", "1 while the outbound MQTT connection is up", fn=lambda: int(mqtt_publisher.connected))
+Gauge("mqtt_publisher_queue_depth", "Outbound messages waiting to be sent", fn=lambda: mqtt_publisher._queue.qsize())
+Counter("mqtt_publisher_published_total", "Outbound messages sent", fn=lambda: mqtt_publisher.published)
+Counter("mqtt_publisher_failed_total", "Outbound messages that failed to send", fn=lambda: mqtt_publisher.failed)
+Counter("mqtt_publisher_dropped_total", "Outbound messages dropped on a full queue", fn=lambda: mqtt_publisher.dropped)
@@ -2,18 +2,37 @@ import asyncio
 import json
 import logging
 from contextlib import AsyncExitStack
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import AsyncIterator
 
 import aiomqtt
-from sqlalchemy.orm import Session
 
-from app.db.session import SessionLocal
-from app.models.models import Sensor, SensorData, Device, Threshold
-from app.services.event_bus import event_bus
+from app.core.config import get_settings
+from app.core.metrics import Counter, Histogram, timed
+from app.services.anomaly import anomaly_detector, parse_rates, snapshot_path_for
+from app.services.decoders import DecodeError, Decoded, decoder_registry, loads, parse_map, parse_timestamp
+from app.services.event_bus import build_event_backend, event_bus
+from app.services.ingest import ingest_pipeline
+from app.services.last_values import last_value_cache
+from app.services.mqtt_publisher import mqtt_publisher
+from app.services.presence import presence_tracker
+from app.services.registry import SensorRef, device_registry
+from app.services.threshold_engine import threshold_engine
 
 logger = logging.getLogger(__name__)
 
+MQTT_MESSAGES = Counter("mqtt_messages_total", "MQTT messages received", ("kind",))
+MQTT_REJECTED = Counter("mqtt_messages_rejected_total", "Sensor readings rejected as malformed or out of range", ("kind", "reason"))
+MQTT_ERRORS = Counter("mqtt_message_errors_total", "MQTT messages whose handling raised")
+MQTT_HANDLE_SECONDS = Histogram("mqtt_message_handle_seconds", "Time to handle one MQTT message, including queueing")
+CLOCK_FALLBACKS = Counter(
+    "reading_clock_fallbacks_total", "Readings whose device timestamp was implausible and replaced by arrival time"
+)
+ALERTS_PUBLISHED = Counter("alerts_published_total", "Threshold alerts raised", ("type", "result"))
+
+# Actuators reported on farm/<id>/status as {"<name>": {"state": "on" | "off"}}
+ACTUATOR_TYPES = ("light", "relay")
+
 TOPIC_FILTERS = [
     "farm/+/sensor/temperature",
     "farm/+/sensor/humidity",
@@ -21,42 +40,10 @@ TOPIC_FILTERS = [
     "farm/+/sensor/waterlevel",
     "farm/+/sensor/tds",
     "farm/+/status",
+    "farm/+/telemetry",
 ]
 
 
-def _map_payload_to_value(sensor_type: str, payload: dict) -> tuple[float | None, str | None]:
-    if sensor_type == "temperature":
-        return payload.get("value_c"), None
-    if sensor_type == "humidity":
-        return payload.get("value_pct"), None
-    if sensor_type == "waterflow":
-        return payload.get("l_per_min"), None
-    if sensor_type == "waterlevel":
-        return payload.get("cm"), None
-    if sensor_type == "tds":
-        return payload.get("ppm"), None
-    val = payload.get("value")
-    if isinstance(val, (int, float)):
-        return float(val), None
-    return None, json.dumps(payload)
-
-
-def _ensure_device_and_sensor(db: Session, device_id: str, sensor_type: str) -> Sensor:
-    device = db.query(Device).filter(Device.device_id == device_id).first()
-    if not device:
-        device = Device(device_id=device_id, type=None, location=None, status="online")
-        db.add(device)
-        db.commit()
-        db.refresh(device)
-    sensor = db.query(Sensor).filter(Sensor.sensor_id == f"{device_id}-{sensor_type}").first()
-    if not sensor:
-        sensor = Sensor(sensor_id=f"{device_id}-{sensor_type}", type=sensor_type, unit=None, device_id=device.id)
-        db.add(sensor)
-        db.commit()
-        db.refresh(sensor)
-    return sensor
-
-
 async def handle_message(topic, payload_bytes: bytes) -> None:
     topic_str = getattr(topic, "value", None) or str(topic)
     parts = topic_str.split("/")
@@ -66,8 +53,15 @@ async def handle_message(topic, payload_bytes: bytes) -> None:
     
     # Handle status messages (farm/device_id/status)
     if len(parts) == 3 and parts[2] == "status":
+        MQTT_MESSAGES.inc(kind="status")
+        online = _presence_flag(payload_bytes)
+        if online is None:
+            await presence_tracker.seen(device_id)
+        else:
+            await presence_tracker.report(device_id, online)
+            return
         try:
-            payload = json.loads(payload_bytes.decode("utf-8"))
+            payload = loads(payload_bytes)
             # Publish status directly to WebSocket
             await event_bus.publish(device_id, {
                 "type": "status",
@@ -75,101 +69,318 @@ async def handle_message(topic, payload_bytes: bytes) -> None:
                 "data": payload,
                 "ts": datetime.utcnow().isoformat()
             })
-            logger.info("published status message", extra={"device_id": device_id, "payload": payload})
+            logger.debug("published status message", extra={"device_id": device_id, "payload": payload})
+            # Relay/light states are also stored as readings (1 = on) for light-hours and duty-cycle analytics.
+            # The payload's own timestamp is device uptime, so arrival time is used.
+            now = datetime.utcnow()
+            actuators = [
+                (name, now, Decoded(1.0 if state == "on" else 0.0, state, {}))
+                for name in ACTUATOR_TYPES
+                if isinstance(payload, dict)
+                and isinstance(payload.get(name), dict)
+                and (state := payload[name].get("state")) in ("on", "off")
+            ]
+            if actuators:
+                await _ingest_readings(device_id, actuators)
         except Exception as e:
             logger.error("failed to process status message", extra={"device_id": device_id, "error": str(e)})
         return
     
+    await presence_tracker.seen(device_id)
+
+    # Handle multi-reading telemetry (farm/device_id/telemetry)
+    if len(parts) == 3 and parts[2] == "telemetry":
+        MQTT_MESSAGES.inc(kind="telemetry")
+        await _handle_telemetry(device_id, payload_bytes)
+        return
+
     # Handle sensor messages (farm/device_id/sensor/type)
     if len(parts) < 4:
         return
     sensor_type = parts[3]
+    MQTT_MESSAGES.inc(kind=sensor_type)
 
+    decoder = decoder_registry.get(sensor_type)
     try:
-        payload = json.loads(payload_bytes.decode("utf-8"))
-    except Exception:
-        payload = {"raw": payload_bytes.decode("utf-8", errors="ignore")}
+        fields = decoder.parse(payload_bytes)
+        decoded = decoder.from_fields(fields)
+    except DecodeError as exc:
+        # Rejected before it can reach the database, the caches or any alert.
+        MQTT_REJECTED.inc(kind=sensor_type, reason=exc.reason)
+        logger.debug("rejected mqtt reading", extra={"device_id": device_id, "type": sensor_type, "error": str(exc)})
+        return
+    ts = _reading_ts(parse_timestamp(fields.get("ts")), datetime.utcnow())
+    await _ingest_readings(device_id, [(sensor_type, ts, decoded)])
+
+
+def _reading_ts(device_ts: datetime | None, now: datetime) -> datetime:
+    """Device timestamp if plausible, else arrival time.
+
+    Stable device timestamps are what make a QoS 1 redelivery land on the same (sensor, ts) key
+    and get ignored instead of stored twice.
+    """
+    if device_ts is None:
+        return now
+    settings = get_settings()
+    if now - timedelta(seconds=settings.telemetry_max_backfill_s) <= device_ts <= now + timedelta(
+        seconds=settings.telemetry_max_clock_skew_s
+    ):
+        return device_ts
+    # No RTC sync yet (ESP32 millis() uptime) or a clock far off.
+    CLOCK_FALLBACKS.inc()
+    return now
 
-    value_numeric, value_text = _map_payload_to_value(sensor_type, payload)
 
-    db: Session = SessionLocal()
+async def _handle_telemetry(device_id: str, payload_bytes: bytes) -> None:
     try:
-        sensor = _ensure_device_and_sensor(db, device_id, sensor_type)
-        reading = SensorData(
-            sensor_id=sensor.id,
-            ts=datetime.utcnow(),
-            value_numeric=value_numeric,
-            value_text=value_text,
-        )
-        db.add(reading)
-        db.commit()
-        logger.info("ingested mqtt message", extra={"device_id": device_id, "sensor": sensor.sensor_id, "type": sensor.type, "value_numeric": value_numeric})
+        readings, rejected = decoder_registry.decode_telemetry(payload_bytes)
+    except DecodeError as exc:
+        MQTT_REJECTED.inc(kind="telemetry", reason=exc.reason)
+        logger.debug("rejected telemetry message", extra={"device_id": device_id, "error": str(exc)})
+        return
+    for sensor_type, exc in rejected:
+        MQTT_REJECTED.inc(kind="telemetry", reason=exc.reason)
+        logger.debug("rejected telemetry reading", extra={"device_id": device_id, "type": sensor_type, "error": str(exc)})
+
+    now = datetime.utcnow()
+    # Buffered samples without a usable ts all fall back to ``now``. Only one row per (sensor, ts) can be
+    # stored, so the latest sample of each sensor type is kept and the others are counted as rejected.
+    latest: dict[tuple[str, datetime], Decoded] = {}
+    for sensor_type, ts, decoded in readings:
+        key = (sensor_type, _reading_ts(ts, now))
+        if key in latest:
+            MQTT_REJECTED.inc(kind="telemetry", reason="duplicate_ts")
+        latest[key] = decoded
+    if latest:
+        await _ingest_readings(device_id, [(sensor_type, ts, decoded) for (sensor_type, ts), decoded in latest.items()])
+
+
+async def _ingest_readings(device_id: str, readings: list[tuple[str, datetime, Decoded]]) -> None:
+    sensors = []
+    for sensor_type, _, _ in readings:
+        sensor = device_registry.get(device_id, sensor_type)
+        if sensor is None:
+            sensor = await device_registry.resolve(device_id, sensor_type)
+        sensors.append(sensor)
+
+    await ingest_pipeline.submit_many(
+        [
+            {
+                "sensor_id": sensor.id,
+                "ts": ts,
+                "value_numeric": decoded.value_numeric,
+                "value_text": decoded.value_text,
+            }
+            for sensor, (_, ts, decoded) in zip(sensors, readings)
+        ]
+    )
+
+    for sensor, (_, ts, (value_numeric, value_text, extras)) in zip(sensors, readings):
+        last_value_cache.update(device_id, sensor.sensor_id, sensor.type, ts, value_numeric, value_text)
+        logger.debug("queued mqtt reading", extra={"device_id": device_id, "sensor": sensor.sensor_id, "type": sensor.type, "value_numeric": value_numeric})
 
         # publish to event bus for websocket listeners
         ws_message = {
             "device_id": device_id,
             "sensor_id": sensor.sensor_id,
             "type": sensor.type,
-            "ts": reading.ts.isoformat(),
+            "ts": ts.isoformat(),
             "value_numeric": value_numeric,
             "value_text": value_text,
         }
-        # Enrich waterflow with additional metrics if present in payload
-        if sensor.type == "waterflow" and isinstance(payload, dict):
-            extra_keys = ("total_liters", "avg_l_per_min", "pulses")
-            for k in extra_keys:
-                if k in payload:
-                    ws_message[k] = payload[k]
+        # Registered extras (e.g. waterflow totals, TDS quality) are forwarded to listeners only
+        ws_message.update(extras)
         await event_bus.publish(device_id, ws_message)
 
-        # Threshold check and alert
-        if value_numeric is not None:
-            thr = (
-                db.query(Threshold)
-                .filter(Threshold.device_id == sensor.device_id, Threshold.sensor_type == sensor.type)
-                .first()
-            )
-            breached = False
-            reason = None
-            if thr:
-                if thr.min_value is not None and value_numeric < thr.min_value:
-                    breached = True
-                    reason = "below_min"
-                if thr.max_value is not None and value_numeric > thr.max_value:
-                    breached = True
-                    reason = "above_max"
-            if breached:
-                alert = {
-                    "device_id": device_id,
-                    "sensor_id": sensor.sensor_id,
-                    "type": sensor.type,
-                    "ts": reading.ts.isoformat(),
-                    "value": value_numeric,
-                    "reason": reason,
-                }
-                await event_bus.publish(device_id, {"alert": alert})
-                # Also publish to MQTT alert topic (non-retained)
-                try:
-                    async with aiomqtt.Client(hostname="mosquitto", port=1883) as client:
-                        await client.publish(f"farm/{device_id}/alert/{sensor.type}", json.dumps(alert).encode("utf-8"), qos=1, retain=False)
-                except Exception:
-                    logger.warning("failed to publish alert mqtt", extra=alert)
-    finally:
-        db.close()
-
-
-async def mqtt_runner(host: str, port: int) -> None:
+        if value_numeric is not None and sensor.type not in ACTUATOR_TYPES:
+            await _check_thresholds(device_id, sensor, ts, value_numeric)
+            if anomaly_detector.enabled:
+                for anomaly in anomaly_detector.observe(sensor.id, sensor.type, ts, value_numeric):
+                    await _publish_alert(device_id, sensor, ts, anomaly.value, "anomaly", {
+                        "kind": anomaly.kind,
+                        "expected": anomaly.expected,
+                        "detail": anomaly.detail,
+                    })
+
+
+async def _check_thresholds(device_id: str, sensor: SensorRef, ts: datetime, value: float) -> None:
+    # Evaluated in memory; see threshold_engine
+    breach = threshold_engine.evaluate(sensor.device_id, sensor.type, value, ts)
+    if breach is None:
+        return
+    try:
+        # The cooldown is claimed in the DB so two ingestion workers can't both alert for one breach.
+        if not await threshold_engine.claim_alert(breach.threshold_id, ts):
+            ALERTS_PUBLISHED.inc(type=sensor.type, result="duplicate")
+            return
+    except Exception:
+        logger.warning(
+            "failed to persist threshold last_alerted_at",
+            extra={"device_id": device_id, "threshold_id": breach.threshold_id},
+        )
+    await _publish_alert(device_id, sensor, ts, value, breach.reason)
+
+
+async def _publish_alert(
+    device_id: str,
+    sensor: SensorRef,
+    ts: datetime,
+    value: float,
+    reason: str,
+    extra: dict | None = None,
+) -> dict:
+    alert = {
+        "device_id": device_id,
+        "sensor_id": sensor.sensor_id,
+        "type": sensor.type,
+        "ts": ts.isoformat(),
+        "value": value,
+        "reason": reason,
+        **(extra or {}),
+    }
+    await event_bus.publish(device_id, {"alert": alert})
+    # Also publish to MQTT alert topic (non-retained) over the shared publisher connection
+    queued = mqtt_publisher.publish_nowait(
+        f"farm/{device_id}/alert/{sensor.type}",
+        json.dumps(alert).encode("utf-8"),
+        qos=get_settings().mqtt_alert_qos,
+        retain=False,
+    )
+    ALERTS_PUBLISHED.inc(type=sensor.type, result="queued" if queued else "dropped")
+    return alert
+
+
+def _presence_flag(payload: bytes) -> bool | None:
+    """The ``online`` flag of a presence/Last Will status payload; None for other status messages."""
+    text = payload.strip().lower()
+    if text in (b"online", b"offline"):
+        return text == b"online"
+    fields = parse_map(payload)
+    if fields is not None and isinstance(fields.get("online"), bool):
+        return fields["online"]
+    return None
+
+
+def subscription_filters(shared_group: str | None) -> list[str]:
+    # MQTT v5 shared subscriptions: the broker hands each message to one member of the group.
+    if not shared_group:
+        return list(TOPIC_FILTERS)
+    return [f"$share/{shared_group}/{tf}" for tf in TOPIC_FILTERS]
+
+
+async def start_ingest_services(sweep_presence: bool = True, process_name: str = "api", ingest: bool = True) -> None:
+    """Bring up everything handle_message depends on; shared by the API process and app.worker.
+
+    An API process that doesn't ingest (``ingest=False``) only needs the event bus, the MQTT publisher
+    and presence; the ingestion pipeline, registry, thresholds and anomaly detector stay off.
+    Offline timeouts are decided by the API process alone (``sweep_presence``); workers only report
+    what they see, and an API process that doesn't ingest picks that up from the DB. Anomaly state is
+    snapshotted by each ingesting process to its own file named after ``process_name``.
+    """
+    settings = get_settings()
+    event_bus.configure(
+        max_queue=settings.event_bus_queue_max,
+        policy=settings.event_bus_policy,
+        backend=build_event_backend(settings),
+    )
+    event_bus.start()
+    mqtt_publisher.configure(
+        host=settings.mqtt_broker_host,
+        port=settings.mqtt_broker_port,
+        username=settings.mqtt_username,
+        password=settings.mqtt_password,
+        max_queue=settings.mqtt_publisher_queue_max,
+    )
+    mqtt_publisher.start()
+    presence_tracker.configure(
+        offline_timeout_s=settings.presence_offline_timeout_s,
+        flush_interval_s=settings.presence_flush_interval_s,
+        sweep=sweep_presence,
+        refresh=sweep_presence and not ingest,
+    )
+    try:
+        await presence_tracker.load()
+    except Exception:
+        logger.exception("presence load failed; devices start unknown until heard from")
+    presence_tracker.start()
+    if not ingest:
+        return
+
+    ingest_pipeline.configure(
+        max_queue=settings.ingest_queue_max,
+        batch_size=settings.ingest_batch_size,
+        flush_interval_s=settings.ingest_flush_interval_s,
+        late_after_s=settings.rollup_lag_s if settings.rollup_enabled else None,
+    )
+    ingest_pipeline.start()
+    try:
+        await device_registry.warm()
+    except Exception:
+        logger.exception("device registry warm-up failed; entries will load on first sight")
+    threshold_engine.configure(
+        cooldown_s=settings.alert_cooldown_s,
+        hysteresis_ratio=settings.alert_hysteresis_ratio,
+        reload_interval_s=settings.threshold_reload_interval_s,
+    )
+    try:
+        await threshold_engine.load()
+    except Exception:
+        logger.exception("threshold engine load failed; alerts disabled until the next reload")
+    threshold_engine.start()
+    anomaly_detector.configure(
+        enabled=settings.anomaly_enabled,
+        window=settings.anomaly_window,
+        min_samples=settings.anomaly_min_samples,
+        z_threshold=settings.anomaly_z_threshold,
+        drift_threshold=settings.anomaly_drift_threshold,
+        stuck_count=settings.anomaly_stuck_count,
+        stuck_s=settings.anomaly_stuck_s,
+        cooldown_s=settings.anomaly_cooldown_s,
+        max_rate=parse_rates(settings.anomaly_max_rate_by_type),
+        snapshot_path=snapshot_path_for(settings.anomaly_snapshot_path, process_name),
+        snapshot_interval_s=settings.anomaly_snapshot_interval_s,
+    )
+    if anomaly_detector.enabled:
+        anomaly_detector.load()
+        anomaly_detector.start()
+
+
+async def stop_ingest_services() -> None:
+    await ingest_pipeline.stop()
+    await threshold_engine.stop()
+    await presence_tracker.stop()
+    await anomaly_detector.stop()
+    await mqtt_publisher.stop()
+    await event_bus.stop()
+
+
+async def mqtt_runner(host: str, port: int, shared_group: str | None = None) -> None:
     reconnect_interval = 5
+    settings = get_settings()
+    filters = subscription_filters(shared_group)
     while True:
         try:
-            logger.info("mqtt connecting", extra={"host": host, "port": port})
-            async with aiomqtt.Client(hostname=host, port=port) as client:
-                for tf in TOPIC_FILTERS:
+            logger.info("mqtt connecting", extra={"host": host, "port": port, "shared_group": shared_group})
+            async with aiomqtt.Client(
+                hostname=host,
+                port=port,
+                username=settings.mqtt_username,
+                password=settings.mqtt_password,
+                protocol=aiomqtt.ProtocolVersion.V5 if shared_group else None,
+            ) as client:
+                for tf in filters:
                     await client.subscribe(tf, qos=1)
                     logger.info("mqtt subscribed", extra={"topic": tf})
                 async with client.messages() as messages:
                     async for message in messages:
-                        asyncio.create_task(handle_message(message.topic, message.payload))
+                        # Handled inline so a full ingestion queue pushes back on the broker
+                        # instead of piling up unbounded tasks.
+                        try:
+                            with timed(MQTT_HANDLE_SECONDS):
+                                await handle_message(message.topic, message.payload)
+                        except Exception:
+                            MQTT_ERRORS.inc()
+                            logger.exception("failed to handle mqtt message", extra={"topic": str(message.topic)})
         except aiomqtt.MqttError:
             logger.warning("mqtt disconnected, retrying", extra={"sleep_s": reconnect_interval})
             await asyncio.sleep(reconnect_interval)
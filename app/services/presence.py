@@ -0,0 +1,237 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, NamedTuple
+
+from sqlalchemy import bindparam, select, update
+
+from app.core.metrics import Counter, Gauge, timed
+from app.db.session import DB_COMMIT_SECONDS, AsyncSessionLocal, get_async_engine
+from app.models.models import Device
+from app.services.event_bus import event_bus
+from app.services.response_cache import DEVICES_TAG, response_cache
+
+logger = logging.getLogger(__name__)
+
+ONLINE = "online"
+OFFLINE = "offline"
+
+PRESENCE_TRANSITIONS = Counter("device_presence_transitions_total", "Device online/offline transitions", ("status", "reason"))
+
+_devices = Device.__table__
+_UPDATE_PRESENCE = (
+    update(_devices)
+    .where(_devices.c.device_id == bindparam("b_device_id"))
+    .values(status=bindparam("b_status"), last_seen_at=bindparam("b_last_seen_at"))
+)
+
+
+class Presence(NamedTuple):
+    status: str
+    last_seen_at: datetime | None
+    # When the current status began; None if it was loaded from the DB rather than observed.
+    since: datetime | None
+
+
+class PresenceTracker:
+    """Online/offline state per device, kept in memory and written back in periodic batches.
+
+    Every MQTT message marks its device as seen; ``farm/<id>/status`` payloads with an ``online`` flag
+    (including a device's retained Last Will, ``{"online": false}``) set the status outright. A device
+    not heard from for ``offline_timeout_s`` is marked offline by the sweep.
+    """
+
+    def __init__(self, offline_timeout_s: float = 120.0, flush_interval_s: float = 5.0) -> None:
+        self.offline_timeout = timedelta(seconds=offline_timeout_s)
+        self.flush_interval_s = flush_interval_s
+        self.sweep = True
+        self.refresh = False
+        self._state: dict[str, Presence] = {}
+        self._dirty: set[str] = set()
+        # A status change is waiting to be flushed; the cached device list is stale once it is.
+        self._status_changed = False
+        self._task: asyncio.Task | None = None
+        self._started_at = datetime.utcnow()
+        self.flushes = 0
+        self.rows_written = 0
+
+    def configure(self, offline_timeout_s: float, flush_interval_s: float, sweep: bool, refresh: bool) -> None:
+        """``sweep``: this process decides timeouts. ``refresh``: adopt what other processes wrote to the DB."""
+        self.offline_timeout = timedelta(seconds=offline_timeout_s)
+        self.flush_interval_s = flush_interval_s
+        self.sweep = sweep
+        self.refresh = refresh
+
+    async def load(self) -> None:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(select(Device.device_id, Device.status, Device.last_seen_at))).all()
+        for row in rows:
+            if row.device_id not in self._state:
+                self._state[row.device_id] = Presence(row.status, row.last_seen_at, None)
+        logger.info("presence loaded", extra={"devices": len(rows)})
+
+    def add(self, device_id: str, status: str) -> None:
+        """Track a newly registered device that hasn't been heard from yet."""
+        self._state.setdefault(device_id, Presence(status, None, None))
+
+    def start(self) -> None:
+        if self._task is None:
+            self._started_at = datetime.utcnow()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("final presence flush failed")
+
+    async def seen(self, device_id: str, now: datetime | None = None, reason: str = "message") -> None:
+        """Record traffic from ``device_id``; called for every MQTT message, so the common case is a dict write."""
+        now = now or datetime.utcnow()
+        current = self._state.get(device_id)
+        if current is not None and current.status == ONLINE:
+            self._state[device_id] = current._replace(last_seen_at=now)
+            self._dirty.add(device_id)
+            return
+        await self._transition(device_id, ONLINE, reason, now, now)
+
+    async def report(self, device_id: str, online: bool, now: datetime | None = None) -> None:
+        """Explicit status from the device (or its Last Will, delivered by the broker on its behalf)."""
+        now = now or datetime.utcnow()
+        if online:
+            await self.seen(device_id, now, reason="status")
+            return
+        current = self._state.get(device_id)
+        last_seen_at = current.last_seen_at if current is not None else None
+        if current is None or current.status != OFFLINE:
+            await self._transition(device_id, OFFLINE, "will", last_seen_at, now)
+
+    def snapshot(self, status: str | None = None) -> list[dict[str, Any]]:
+        return [
+            {"device_id": device_id, "status": p.status, "last_seen_at": p.last_seen_at, "since": p.since}
+            for device_id, p in list(self._state.items())
+            if status is None or p.status == status
+        ]
+
+    async def sweep_once(self, now: datetime | None = None) -> int:
+        """Mark devices silent for longer than the timeout offline; returns how many changed."""
+        now = now or datetime.utcnow()
+        cutoff = now - self.offline_timeout
+        if cutoff < self._started_at:
+            # Give devices a full timeout after startup before judging them on timestamps loaded from the DB.
+            return 0
+        stale = [
+            (device_id, p)
+            for device_id, p in list(self._state.items())
+            if p.status == ONLINE and (p.last_seen_at is None or p.last_seen_at < cutoff)
+        ]
+        for device_id, p in stale:
+            await self._transition(device_id, OFFLINE, "timeout", p.last_seen_at, now)
+        return len(stale)
+
+    async def flush(self) -> int:
+        """Write every device changed since the last flush in one batched UPDATE."""
+        if not self._dirty:
+            return 0
+        dirty, self._dirty = self._dirty, set()
+        status_changed, self._status_changed = self._status_changed, False
+        rows = [
+            {"b_device_id": device_id, "b_status": p.status, "b_last_seen_at": p.last_seen_at}
+            for device_id in dirty
+            if (p := self._state.get(device_id)) is not None
+        ]
+        try:
+            await _write(rows)
+        except Exception:
+            self._dirty |= dirty
+            self._status_changed |= status_changed
+            raise
+        if status_changed:
+            await response_cache.ainvalidate(DEVICES_TAG)
+        self.flushes += 1
+        self.rows_written += len(rows)
+        return len(rows)
+
+    async def refresh_once(self) -> None:
+        """Adopt newer presence written by other processes (ingestion workers)."""
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(select(Device.device_id, Device.status, Device.last_seen_at))).all()
+        now = datetime.utcnow()
+        for row in rows:
+            current = self._state.get(row.device_id)
+            if current is None:
+                self._state[row.device_id] = Presence(row.status, row.last_seen_at, None)
+                continue
+            newer = row.last_seen_at is not None and (current.last_seen_at is None or row.last_seen_at > current.last_seen_at)
+            if row.status != current.status and (newer or row.last_seen_at == current.last_seen_at):
+                if row.status in (ONLINE, OFFLINE):
+                    await self._transition(row.device_id, row.status, "worker", row.last_seen_at, now, persist=False)
+            elif newer:
+                self._state[row.device_id] = current._replace(last_seen_at=row.last_seen_at)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "devices": len(self._state),
+            "online": sum(1 for p in list(self._state.values()) if p.status == ONLINE),
+            "dirty": len(self._dirty),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+        }
+
+    async def _transition(
+        self,
+        device_id: str,
+        status: str,
+        reason: str,
+        last_seen_at: datetime | None,
+        now: datetime,
+        persist: bool = True,
+    ) -> None:
+        self._state[device_id] = Presence(status, last_seen_at, now)
+        if persist:
+            self._dirty.add(device_id)
+            self._status_changed = True
+        else:
+            # Another process already wrote it.
+            await response_cache.ainvalidate(DEVICES_TAG)
+        PRESENCE_TRANSITIONS.inc(status=status, reason=reason)
+        await event_bus.publish(device_id, {
+            "type": "presence",
+            "device_id": device_id,
+            "status": status,
+            "reason": reason,
+            "last_seen_at": last_seen_at.isoformat() if last_seen_at else None,
+            "ts": now.isoformat(),
+        })
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval_s)
+            try:
+                if self.refresh:
+                    await self.refresh_once()
+                if self.sweep:
+                    await self.sweep_once()
+                await self.flush()
+            except Exception:
+                logger.exception("presence flush failed")
+
+
+@timed(DB_COMMIT_SECONDS, op="presence")
+async def _write(rows: list[dict[str, Any]]) -> None:
+    # Rows for devices not created yet (seen only on the status topic) simply match nothing.
+    async with get_async_engine().begin() as conn:
+        await conn.execute(_UPDATE_PRESENCE, rows)
+
+
+presence_tracker = PresenceTracker()
+
+Gauge("devices_online", "Devices currently online", fn=lambda: presence_tracker.stats()["online"])
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import threading
+from typing import Any, NamedTuple
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.metrics import timed
+from app.db.session import DB_COMMIT_SECONDS, AsyncSessionLocal
+from app.services.decoders import decoder_registry
+from app.models.models import Device, Sensor
+
+logger = logging.getLogger(__name__)
+
+
+class SensorRef(NamedTuple):
+    id: int
+    device_id: int
+    sensor_id: str
+    type: str
+
+
+class DeviceRegistry:
+    """In-memory map of MQTT device/sensor identifiers to their primary keys.
+
+    Sensors are keyed by ``(device_id, sensor_type)``, the pair a topic names, and map to the sensor
+    row ``<device_id>-<sensor_type>`` that ingestion reads into.
+    """
+
+    def __init__(self) -> None:
+        self._devices: dict[str, int] = {}
+        self._sensors: dict[tuple[str, str], SensorRef] = {}
+        self._lock = threading.Lock()
+        self._miss_lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    async def warm(self) -> None:
+        async with AsyncSessionLocal() as db:
+            devices = {row.device_id: row.id for row in await db.execute(select(Device.id, Device.device_id))}
+            rows = await db.execute(
+                select(Sensor.id, Sensor.device_id, Sensor.sensor_id, Sensor.type, Device.device_id.label("device_key"))
+                .join(Device, Sensor.device_id == Device.id)
+            )
+            sensors = {
+                (row.device_key, row.type): SensorRef(row.id, row.device_id, row.sensor_id, row.type)
+                for row in rows
+                # Sensors registered under other ids through the API are never looked up by ingestion.
+                if row.sensor_id == f"{row.device_key}-{row.type}"
+            }
+        with self._lock:
+            self._devices.update(devices)
+            self._sensors.update(sensors)
+        logger.info("device registry warmed", extra={"devices": len(devices), "sensors": len(sensors)})
+
+    def get(self, device_id: str, sensor_type: str) -> SensorRef | None:
+        ref = self._sensors.get((device_id, sensor_type))
+        if ref is not None:
+            self.hits += 1
+        return ref
+
+    def device_pk(self, device_id: str) -> int | None:
+        return self._devices.get(device_id)
+
+    async def resolve(self, device_id: str, sensor_type: str) -> SensorRef:
+        """Return the sensor for a reading, creating the device and sensor rows on first sight."""
+        ref = self.get(device_id, sensor_type)
+        if ref is not None:
+            return ref
+        async with self._miss_lock:
+            sensor_key = f"{device_id}-{sensor_type}"
+            ref = self._sensors.get((device_id, sensor_type))
+            if ref is not None:
+                return ref
+            self.misses += 1
+            async with AsyncSessionLocal() as db:
+                device_pk = self._devices.get(device_id)
+                if device_pk is None:
+                    # Status starts as the model default ("unknown"); the presence tracker owns it from here.
+                    device_pk = (
+                        await _get_or_insert(
+                            db,
+                            select(Device.id).where(Device.device_id == device_id),
+                            lambda: Device(device_id=device_id, type=None, location=None),
+                        )
+                    ).id
+                    with self._lock:
+                        self._devices[device_id] = device_pk
+                row = await _get_or_insert(
+                    db,
+                    select(Sensor.id, Sensor.device_id, Sensor.sensor_id, Sensor.type).where(Sensor.sensor_id == sensor_key),
+                    lambda: Sensor(
+                        sensor_id=sensor_key,
+                        type=sensor_type,
+                        unit=decoder_registry.unit(sensor_type),
+                        device_id=device_pk,
+                    ),
+                )
+            ref = SensorRef(row.id, row.device_id, row.sensor_id, row.type)
+            with self._lock:
+                self._sensors[(device_id, sensor_type)] = ref
+            return ref
+
+    def invalidate_device(self, device_id: str) -> None:
+        with self._lock:
+            self._devices.pop(device_id, None)
+            for key in [k for k in self._sensors if k[0] == device_id]:
+                del self._sensors[key]
+
+    def invalidate_sensor(self, sensor_id: str) -> None:
+        with self._lock:
+            for key in [k for k, ref in self._sensors.items() if ref.sensor_id == sensor_id]:
+                del self._sensors[key]
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "devices": len(self._devices),
+            "sensors": len(self._sensors),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+async def _get_or_insert(db: AsyncSession, stmt, factory):
+    row = (await db.execute(stmt)).first()
+    if row is not None:
+        return row
+    db.add(factory())
+    try:
+        with timed(DB_COMMIT_SECONDS, op="registry_insert"):
+            await db.commit()
+    except IntegrityError:
+        # Another worker created the same row between our SELECT and INSERT.
+        await db.rollback()
+    return (await db.execute(stmt)).one()
+
+
+device_registry = DeviceRegistry()
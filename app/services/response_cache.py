@@ -0,0 +1,254 @@
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, NamedTuple, Sequence
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from app.core.metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+DEVICES_TAG = "devices"
+
+CACHE_REQUESTS = Counter("response_cache_requests_total", "Cached REST responses by outcome", ("name", "result"))
+
+
+def thresholds_tag(device_id: str) -> str:
+    return f"thresholds:{device_id}"
+
+
+class CacheEntry(NamedTuple):
+    body: bytes
+    etag: str
+    # Tag generations the body was computed under; a bumped tag makes the entry stale.
+    generations: tuple[int, ...]
+
+
+class CacheLookup:
+    """Result of ``ResponseCache.lookup``; pass it back to ``store`` after a miss."""
+
+    __slots__ = ("key", "tags", "generations", "entry")
+
+    def __init__(self, key: str, tags: tuple[str, ...], generations: tuple[int, ...], entry: CacheEntry | None) -> None:
+        self.key = key
+        self.tags = tags
+        self.generations = generations
+        self.entry = entry
+
+
+class MemoryCacheBackend:
+    """Per-process LRU with per-entry expiry; invalidation only reaches this process."""
+
+    name = "memory"
+    remote = False
+
+    def __init__(self, max_entries: int = 1024) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, CacheEntry]] = OrderedDict()
+        self._generations: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> CacheEntry | None:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            if item[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return item[1]
+
+    def put(self, key: str, entry: CacheEntry, ttl_s: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl_s, entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def generations(self, tags: Sequence[str]) -> tuple[int, ...]:
+        return tuple(self._generations.get(tag, 0) for tag in tags)
+
+    def bump(self, tags: Sequence[str]) -> None:
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+
+    def stats(self) -> dict[str, Any]:
+        return {"entries": len(self._entries)}
+
+
+class RedisCacheBackend:
+    """Entries and tag generations in Redis, shared by every API process and ingestion worker."""
+
+    name = "redis"
+    remote = True
+
+    def __init__(self, url: str, prefix: str = "vfarm:cache:") -> None:
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+        self._tags_key = f"{prefix}tags"
+
+    def get(self, key: str) -> CacheEntry | None:
+        raw = self._redis.get(self._prefix + key)
+        if raw is None:
+            return None
+        etag, generations, body = raw.split(b"\n", 2)
+        return CacheEntry(body, etag.decode(), tuple(json.loads(generations)))
+
+    def put(self, key: str, entry: CacheEntry, ttl_s: float) -> None:
+        raw = entry.etag.encode() + b"\n" + json.dumps(entry.generations).encode() + b"\n" + entry.body
+        self._redis.set(self._prefix + key, raw, px=max(1, math.ceil(ttl_s * 1000)))
+
+    def generations(self, tags: Sequence[str]) -> tuple[int, ...]:
+        if not tags:
+            return ()
+        return tuple(int(v or 0) for v in self._redis.hmget(self._tags_key, list(tags)))
+
+    def bump(self, tags: Sequence[str]) -> None:
+        pipe = self._redis.pipeline(transaction=False)
+        for tag in tags:
+            pipe.hincrby(self._tags_key, tag, 1)
+        pipe.execute()
+
+    def stats(self) -> dict[str, Any]:
+        return {}
+
+
+def build_cache_backend(settings: Any):
+    if settings.response_cache_backend == MemoryCacheBackend.name:
+        return MemoryCacheBackend(settings.response_cache_max_entries)
+    if settings.response_cache_backend == RedisCacheBackend.name:
+        return RedisCacheBackend(settings.response_cache_redis_url)
+    raise ValueError(f"unknown response cache backend: {settings.response_cache_backend}")
+
+
+class ResponseCache:
+    """TTL + invalidation cache of serialized JSON responses for read-heavy endpoints, with ETags.
+
+    Entries are tagged (``devices``, ``thresholds:<device_id>``); writes bump a tag's generation, which
+    makes every entry computed under the old generation stale. Generations are read before the response
+    is computed, so a write that lands mid-computation can't leave a stale body cached as current.
+    Every response carries an ETag, and a matching ``If-None-Match`` gets a 304 without a body, even
+    when caching is disabled.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = True
+        self.ttl_s = 30.0
+        self.backend = MemoryCacheBackend()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.errors = 0
+
+    def configure(self, enabled: bool, ttl_s: float, backend=None) -> None:
+        self.enabled = enabled
+        self.ttl_s = ttl_s
+        if backend is not None:
+            self.backend = backend
+
+    def lookup(self, key: str, tags: Sequence[str] = ()) -> CacheLookup:
+        tags = tuple(tags)
+        if not self.enabled:
+            return CacheLookup(key, tags, (), None)
+        try:
+            generations = self.backend.generations(tags)
+            entry = self.backend.get(key)
+        except Exception:
+            # A cache outage degrades to uncached responses, never to failed requests.
+            self.errors += 1
+            logger.exception("response cache lookup failed")
+            return CacheLookup(key, tags, (), None)
+        name = key.split(":", 1)[0]
+        if entry is not None and entry.generations == generations:
+            self.hits += 1
+            CACHE_REQUESTS.inc(name=name, result="hit")
+        else:
+            entry = None
+            self.misses += 1
+            CACHE_REQUESTS.inc(name=name, result="miss")
+        return CacheLookup(key, tags, generations, entry)
+
+    def store(self, lookup: CacheLookup, payload: Any, ttl_s: float | None = None) -> CacheEntry:
+        body = json.dumps(jsonable_encoder(payload), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        entry = CacheEntry(body, f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"', lookup.generations)
+        lookup.entry = entry
+        if self.enabled and len(lookup.generations) == len(lookup.tags):
+            try:
+                self.backend.put(lookup.key, entry, self.ttl_s if ttl_s is None else ttl_s)
+            except Exception:
+                self.errors += 1
+                logger.exception("response cache store failed")
+        return entry
+
+    def invalidate(self, *tags: str) -> None:
+        """Make every entry tagged with one of ``tags`` stale; call after the write has committed."""
+        if not tags:
+            return
+        try:
+            self.backend.bump(tags)
+        except Exception:
+            # Entries still expire after the TTL.
+            self.errors += 1
+            logger.exception("response cache invalidation failed", extra={"tags": tags})
+
+    async def alookup(self, key: str, tags: Sequence[str] = ()) -> CacheLookup:
+        if self.backend.remote:
+            return await asyncio.to_thread(self.lookup, key, tags)
+        return self.lookup(key, tags)
+
+    async def astore(self, lookup: CacheLookup, payload: Any, ttl_s: float | None = None) -> CacheEntry:
+        if self.backend.remote:
+            return await asyncio.to_thread(self.store, lookup, payload, ttl_s)
+        return self.store(lookup, payload, ttl_s)
+
+    async def ainvalidate(self, *tags: str) -> None:
+        if self.backend.remote:
+            await asyncio.to_thread(self.invalidate, *tags)
+        else:
+            self.invalidate(*tags)
+
+    def respond(self, request: Request, lookup: CacheLookup) -> Response:
+        entry = lookup.entry
+        # no-cache: clients may keep the body but revalidate every time, which is cheap with the ETag.
+        headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+        if _etag_matches(request.headers.get("if-none-match"), entry.etag):
+            self.not_modified += 1
+            CACHE_REQUESTS.inc(name=lookup.key.split(":", 1)[0], result="not_modified")
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry.body, media_type="application/json", headers=headers)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "backend": self.backend.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "errors": self.errors,
+            **self.backend.stats(),
+        }
+
+
+def _etag_matches(header: str | None, etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison, as RFC 9110 requires for If-None-Match.
+    return any(candidate.strip().removeprefix("W/") == etag for candidate in header.split(","))
+
+
+response_cache = ResponseCache()
+
+Gauge("response_cache_entries", "Cached REST responses held in this process", fn=lambda: response_cache.backend.stats().get("entries", 0))
@@ -0,0 +1,373 @@
+import argparse
+import asyncio
+import csv
+import gzip
+import logging
+import os
+import time
+from array import array
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Iterable
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.orm import Session
+
+from app.core.metrics import Histogram, timed
+from app.db.session import SessionLocal, advisory_lock
+from app.models.models import Sensor, SensorData
+
+logger = logging.getLogger(__name__)
+
+RETENTION_SECONDS = Histogram("retention_run_seconds", "Duration of a retention pass", buckets=(1, 5, 15, 60, 300, 900, 3600))
+
+ARCHIVE_COLUMNS = ("id", "sensor_id", "sensor_key", "sensor_type", "ts", "value_numeric", "value_text")
+
+
+def parse_retention(spec: str | None) -> dict[str, int]:
+    """Parse ``"temperature=30,tds=90"`` into per-sensor-type retention days."""
+    result: dict[str, int] = {}
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        sensor_type, _, days = item.partition("=")
+        result[sensor_type.strip()] = int(days)
+    return result
+
+
+class ArchiveWriter:
+    """Writes expired rows to a new compressed columnar (Parquet) or gzip CSV file.
+
+    An existing archive is never reopened or overwritten: if the name is taken, a numeric suffix is added.
+    """
+
+    def __init__(self, path: Path, fmt: str) -> None:
+        self.fmt = fmt
+        if fmt == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                logger.warning("pyarrow not installed, archiving as csv.gz instead")
+                self.fmt = "csv"
+        suffix = ".parquet" if self.fmt == "parquet" else ".csv.gz"
+        self.path = path.with_suffix(suffix)
+        n = 1
+        while self.path.exists():
+            self.path = path.with_name(f"{path.name}-{n}").with_suffix(suffix)
+            n += 1
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.rows = 0
+        self._writer = None
+        self._file = None
+
+    def write(self, rows: list[tuple]) -> None:
+        if not rows:
+            return
+        if self.fmt == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.table({name: [r[i] for r in rows] for i, name in enumerate(ARCHIVE_COLUMNS)})
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema, compression="zstd")
+            self._writer.write_table(table)
+        else:
+            if self._file is None:
+                # "x": fail rather than clobber a file that appeared since the name was chosen.
+                self._file = gzip.open(self.path, "xt", newline="")
+                self._writer = csv.writer(self._file)
+                self._writer.writerow(ARCHIVE_COLUMNS)
+            self._writer.writerows(rows)
+        self.rows += len(rows)
+
+    def close(self) -> None:
+        """Close the file and fsync it, so the rows are on disk before they are deleted from the DB."""
+        if self.fmt == "parquet" and self._writer is not None:
+            self._writer.close()
+        if self._file is not None:
+            self._file.close()
+        if self._writer is not None and self.path.exists():
+            _fsync(self.path)
+            _fsync(self.path.parent)
+        self._writer = None
+        self._file = None
+
+    def verify(self) -> None:
+        """Read the closed file back and check it holds every row written; raises if not."""
+        if self.rows == 0:
+            return
+        if self.fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            found = pq.ParquetFile(self.path).metadata.num_rows
+        else:
+            with gzip.open(self.path, "rt", newline="") as f:
+                found = sum(1 for _ in csv.reader(f)) - 1
+        if found != self.rows:
+            raise RuntimeError(f"archive {self.path} holds {found} rows, expected {self.rows}")
+
+
+def _archive_select():
+    return select(
+        SensorData.id,
+        SensorData.sensor_id,
+        Sensor.sensor_id.label("sensor_key"),
+        Sensor.type,
+        SensorData.ts,
+        SensorData.value_numeric,
+        SensorData.value_text,
+    ).join(Sensor, Sensor.id == SensorData.sensor_id)
+
+
+class RetentionManager:
+    """Expires raw sensor_data: archives then drops whole monthly partitions (MySQL) and
+    deletes shorter-lived sensor types in small primary-key chunks."""
+
+    def __init__(self) -> None:
+        self.default_days = 90
+        self.days_by_type: dict[str, int] = {}
+        self.archive_dir = Path("archive")
+        self.archive_format = "csv"
+        self.chunk_size = 5000
+        self.chunk_pause_s = 0.05
+        # Rows per archive file; each file's rows are deleted before the next is written.
+        self.window_rows = 100_000
+        self.interval_s = 3600.0
+        self.partition_months_ahead = 2
+        self._task: asyncio.Task | None = None
+        self.runs = 0
+        self.rows_deleted = 0
+        self.rows_archived = 0
+        self.partitions_dropped = 0
+        self.last_run_ms = 0.0
+        self.skipped_runs = 0
+
+    def configure(
+        self,
+        default_days: int,
+        days_by_type: dict[str, int],
+        archive_dir: str,
+        archive_format: str,
+        chunk_size: int,
+        interval_s: float,
+    ) -> None:
+        self.default_days = default_days
+        self.days_by_type = days_by_type
+        self.archive_dir = Path(archive_dir)
+        self.archive_format = archive_format
+        self.chunk_size = chunk_size
+        self.interval_s = interval_s
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def run_once(self, now: datetime | None = None) -> dict[str, int]:
+        """One retention pass, unless another process (e.g. another API worker) is running one."""
+        with advisory_lock("vfarm:retention") as acquired:
+            if not acquired:
+                self.skipped_runs += 1
+                return {"partitions_dropped": 0, "rows_deleted": 0, "rows_archived": 0}
+            return self._run_once(now)
+
+    @timed(RETENTION_SECONDS)
+    def _run_once(self, now: datetime | None) -> dict[str, int]:
+        started = time.perf_counter()
+        now = now or datetime.utcnow()
+        summary = {"partitions_dropped": 0, "rows_deleted": 0, "rows_archived": 0}
+        # A whole partition can only go once every sensor type in it has expired.
+        partition_days = max([self.default_days, *self.days_by_type.values()])
+        with SessionLocal() as db:
+            partitioned = _is_partitioned(db)
+            if partitioned:
+                self.ensure_partitions(db, now)
+                for name, upper in _partitions(db):
+                    if upper is not None and upper <= now - timedelta(days=partition_days):
+                        summary["rows_archived"] += self.drop_partition(db, name)
+                        summary["partitions_dropped"] += 1
+
+            types = [t for (t,) in db.execute(select(Sensor.type).distinct())]
+            for sensor_type in types:
+                days = self.days_by_type.get(sensor_type, self.default_days)
+                if partitioned and days >= partition_days:
+                    continue
+                archived, deleted = self.delete_expired(db, sensor_type, now - timedelta(days=days), now)
+                summary["rows_archived"] += archived
+                summary["rows_deleted"] += deleted
+
+        self.runs += 1
+        self.partitions_dropped += summary["partitions_dropped"]
+        self.rows_deleted += summary["rows_deleted"]
+        self.rows_archived += summary["rows_archived"]
+        self.last_run_ms = (time.perf_counter() - started) * 1000
+        logger.info("retention run finished", extra=summary)
+        return summary
+
+    def delete_expired(self, db: Session, sensor_type: str, cutoff: datetime, now: datetime) -> tuple[int, int]:
+        """Archive expired rows in windows of ``window_rows``, one new file each, deleting exactly the
+        archived rows of a window before starting the next.
+
+        Nothing is deleted until its archive is closed, fsynced and read back, so a failed write loses no
+        data, and a backlog of expired rows needs no more memory or disk than one window.
+        """
+        sensor_pks = [pk for (pk,) in db.execute(select(Sensor.id).where(Sensor.type == sensor_type))]
+        if not sensor_pks:
+            return 0, 0
+        total_archived = total_deleted = 0
+        after = 0
+        window = 0
+        while True:
+            writer = ArchiveWriter(
+                self.archive_dir / f"sensor_data_{sensor_type}_{now:%Y%m%dT%H%M%S}_{window:04d}", self.archive_format
+            )
+            # Ids of the window's archived rows, 8 bytes each; only these are deleted.
+            archived = array("q")
+            try:
+                while len(archived) < self.window_rows:
+                    rows = db.execute(
+                        _archive_select()
+                        .where(SensorData.sensor_id.in_(sensor_pks), SensorData.ts < cutoff, SensorData.id > after)
+                        .order_by(SensorData.id)
+                        .limit(min(self.chunk_size, self.window_rows - len(archived)))
+                    ).all()
+                    if not rows:
+                        break
+                    writer.write([tuple(r) for r in rows])
+                    archived.extend(r.id for r in rows)
+                    after = archived[-1]
+                db.rollback()
+            finally:
+                writer.close()
+            if not archived:
+                return total_archived, total_deleted
+            writer.verify()
+
+            for start in range(0, len(archived), self.chunk_size):
+                # Short transactions keyed by primary key keep row locks brief on the live table.
+                db.execute(delete(SensorData).where(SensorData.id.in_(archived[start : start + self.chunk_size].tolist())))
+                db.commit()
+                total_deleted += min(self.chunk_size, len(archived) - start)
+                time.sleep(self.chunk_pause_s)
+            total_archived += writer.rows
+            window += 1
+
+    def drop_partition(self, db: Session, name: str) -> int:
+        writer = ArchiveWriter(self.archive_dir / f"sensor_data_{name}", self.archive_format)
+        try:
+            result = db.execute(
+                _archive_select()
+                .with_hint(SensorData, f"PARTITION ({name})", "mysql")
+                .execution_options(stream_results=True, yield_per=self.chunk_size)
+            )
+            for chunk in result.partitions():
+                writer.write([tuple(r) for r in chunk])
+        finally:
+            writer.close()
+        writer.verify()
+        db.execute(text(f"ALTER TABLE sensor_data DROP PARTITION {name}"))
+        db.commit()
+        logger.info("dropped sensor_data partition", extra={"partition": name, "archived_rows": writer.rows, "archive": str(writer.path)})
+        return writer.rows
+
+    def ensure_partitions(self, db: Session, now: datetime) -> None:
+        """Split pmax so there is always a partition for the next few months."""
+        existing = {name for name, _ in _partitions(db)}
+        month = now.date().replace(day=1)
+        new = []
+        for _ in range(self.partition_months_ahead + 1):
+            upper = _next_month(month)
+            name = f"p{month:%Y%m}"
+            if name not in existing:
+                new.append(f"PARTITION {name} VALUES LESS THAN (TO_DAYS('{upper:%Y-%m-%d}'))")
+            month = upper
+        if new:
+            new.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+            db.execute(text(f"ALTER TABLE sensor_data REORGANIZE PARTITION pmax INTO ({', '.join(new)})"))
+            db.commit()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "rows_deleted": self.rows_deleted,
+            "rows_archived": self.rows_archived,
+            "partitions_dropped": self.partitions_dropped,
+            "last_run_ms": round(self.last_run_ms, 3),
+            "skipped_runs": self.skipped_runs,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.run_once)
+            except Exception:
+                logger.exception("retention run failed")
+            await asyncio.sleep(self.interval_s)
+
+
+def _fsync(path: Path) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _next_month(d: date) -> date:
+    return date(d.year + (d.month == 12), d.month % 12 + 1, 1)
+
+
+def _is_partitioned(db: Session) -> bool:
+    if db.get_bind().dialect.name != "mysql":
+        return False
+    return any(True for _ in _partitions(db))
+
+
+def _partitions(db: Session) -> Iterable[tuple[str, datetime | None]]:
+    """(name, exclusive upper bound) for each sensor_data partition; pmax has no bound."""
+    rows = db.execute(
+        text(
+            "SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'sensor_data' AND PARTITION_NAME IS NOT NULL "
+            "ORDER BY PARTITION_ORDINAL_POSITION"
+        )
+    ).all()
+    for name, description in rows:
+        if description == "MAXVALUE":
+            yield name, None
+        else:
+            # TO_DAYS() counts from year 0; date.toordinal() counts from year 1.
+            yield name, datetime.fromordinal(int(description) - 365)
+
+
+retention_manager = RetentionManager()
+
+
+if __name__ == "__main__":
+    from app.core.config import get_settings
+
+    parser = argparse.ArgumentParser(description="Expire and archive raw sensor_data")
+    parser.add_argument("command", choices=["run"])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    settings = get_settings()
+    retention_manager.configure(
+        default_days=settings.retention_raw_days,
+        days_by_type=parse_retention(settings.retention_by_type),
+        archive_dir=settings.retention_archive_dir,
+        archive_format=settings.retention_archive_format,
+        chunk_size=settings.retention_delete_chunk,
+        interval_s=settings.retention_interval_s,
+    )
+    print(retention_manager.run_once())
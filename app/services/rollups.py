@@ -0,0 +1,181 @@
+import argparse
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from app.core.metrics import Histogram, timed
+from app.db.session import SessionLocal, advisory_lock
+from app.models.models import RollupDirty, SensorData, SensorRollup1h, SensorRollup1m
+from app.services.aggregation import bucket_rows, floor_ts, rollup_watermark
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_SECONDS = Histogram("rollup_compaction_seconds", "Duration of a rollup compaction pass", buckets=(0.1, 0.5, 1, 5, 15, 60, 300))
+
+# (target table, bucket seconds, source, rebuild chunk)
+LEVELS = (
+    (SensorRollup1m, 60, SensorData, timedelta(hours=6)),
+    (SensorRollup1h, 3600, SensorRollup1m, timedelta(days=7)),
+)
+
+
+def rebuild(db: Session, table, size_s: int, source, start: datetime, end: datetime, chunk: timedelta) -> int:
+    """Recompute ``table`` buckets in [start, end) from ``source``; idempotent, one transaction per chunk."""
+    written = 0
+    chunk_start = floor_ts(start, size_s)
+    end = floor_ts(end, size_s)
+    while chunk_start < end:
+        chunk_end = min(chunk_start + chunk, end)
+        rows = [
+            {
+                "sensor_id": sensor_pk,
+                "bucket_start": bucket,
+                "value_min": vmin,
+                "value_max": vmax,
+                "value_sum": vsum,
+                "value_count": vcount,
+                "last_ts": last_ts,
+                "last_value": last_value,
+            }
+            for sensor_pk, bucket, vmin, vmax, vsum, vcount, last_ts, last_value in bucket_rows(
+                db, source, size_s, chunk_start, chunk_end
+            )
+        ]
+        db.execute(delete(table).where(table.bucket_start >= chunk_start, table.bucket_start < chunk_end))
+        if rows:
+            db.execute(insert(table), rows)
+        db.commit()
+        written += len(rows)
+        chunk_start = chunk_end
+    return written
+
+
+class RollupCompactor:
+    """Background task that folds closed raw buckets into the 1-minute and 1-hour rollup tables."""
+
+    def __init__(self, interval_s: float = 60.0, lag_s: float = 120.0) -> None:
+        self.interval_s = interval_s
+        # Readings can sit in the write-behind queue for a while; don't close a bucket before they land.
+        self.lag = timedelta(seconds=lag_s)
+        self._task: asyncio.Task | None = None
+        self.runs = 0
+        self.buckets_written = 0
+        self.last_run_ms = 0.0
+        self.watermarks: dict[str, datetime | None] = {}
+        self.late_rebuilds = 0
+        self.skipped_runs = 0
+
+    def configure(self, interval_s: float, lag_s: float) -> None:
+        self.interval_s = interval_s
+        self.lag = timedelta(seconds=lag_s)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def compact_once(self, now: datetime | None = None) -> int:
+        """One compaction pass, unless another process (e.g. another API worker) is running one."""
+        with advisory_lock("vfarm:rollup_compaction") as acquired:
+            if not acquired:
+                self.skipped_runs += 1
+                return 0
+            return self._compact(now)
+
+    @timed(ROLLUP_SECONDS)
+    def _compact(self, now: datetime | None) -> int:
+        started = time.perf_counter()
+        upper = (now or datetime.utcnow()) - self.lag
+        written = 0
+        with SessionLocal() as db:
+            # Late readings are marked in rollup_dirty by whichever process ingested them (see ingest).
+            # Only the marks read here are removed, once the rebuild they asked for has committed.
+            marks = db.execute(select(RollupDirty.id, RollupDirty.since)).all()
+            dirty = min((mark.since for mark in marks), default=None)
+            for table, size_s, source, chunk in LEVELS:
+                upper = floor_ts(upper, size_s)
+                start = rollup_watermark(db, table, size_s)
+                if start is None:
+                    start = _first_source_ts(db, source)
+                elif dirty is not None and dirty < start:
+                    start = dirty
+                if start is not None and start < upper:
+                    written += rebuild(db, table, size_s, source, start, upper, chunk)
+                self.watermarks[table.__tablename__] = rollup_watermark(db, table, size_s)
+                # The next level may only consume buckets this level has closed.
+                upper = min(upper, self.watermarks[table.__tablename__] or upper)
+            if marks:
+                db.execute(delete(RollupDirty).where(RollupDirty.id.in_([mark.id for mark in marks])))
+                db.commit()
+        if dirty is not None:
+            self.late_rebuilds += 1
+        self.runs += 1
+        self.buckets_written += written
+        self.last_run_ms = (time.perf_counter() - started) * 1000
+        return written
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "buckets_written": self.buckets_written,
+            "late_rebuilds": self.late_rebuilds,
+            "skipped_runs": self.skipped_runs,
+            "last_run_ms": round(self.last_run_ms, 3),
+            "watermarks": self.watermarks,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.compact_once)
+            except Exception:
+                logger.exception("rollup compaction failed")
+            await asyncio.sleep(self.interval_s)
+
+
+def _first_source_ts(db: Session, source) -> datetime | None:
+    column = source.ts if source is SensorData else source.bucket_start
+    return db.execute(select(func.min(column))).scalar()
+
+
+def backfill(start: datetime, end: datetime) -> int:
+    """Recompute every rollup level over [start, end), e.g. after importing historic readings."""
+    written = 0
+    with SessionLocal() as db:
+        for table, size_s, source, chunk in LEVELS:
+            written += rebuild(db, table, size_s, source, start, end, chunk)
+    return written
+
+
+rollup_compactor = RollupCompactor()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain sensor_data rollup tables")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("compact", help="Roll up everything closed since the last compaction")
+    backfill_parser = sub.add_parser("backfill", help="Recompute rollups over a time range")
+    backfill_parser.add_argument("--start", type=datetime.fromisoformat, required=True)
+    backfill_parser.add_argument("--end", type=datetime.fromisoformat, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "compact":
+        count = rollup_compactor.compact_once()
+    else:
+        count = backfill(args.start, args.end or datetime.utcnow())
+    print(f"{count} rollup buckets written")
@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from sqlalchemy import select, update
+
+from app.core.metrics import timed
+from app.db.session import DB_COMMIT_SECONDS, AsyncSessionLocal
+from app.models.models import Threshold
+
+logger = logging.getLogger(__name__)
+
+
+class Breach(NamedTuple):
+    threshold_id: int
+    reason: str
+
+
+class _Rule:
+    __slots__ = ("threshold_id", "min_value", "max_value", "clear_min", "clear_max", "last_alerted_at", "breached")
+
+    def __init__(
+        self,
+        threshold_id: int,
+        min_value: float | None,
+        max_value: float | None,
+        last_alerted_at: datetime | None,
+        hysteresis_ratio: float,
+    ) -> None:
+        self.threshold_id = threshold_id
+        self.min_value = min_value
+        self.max_value = max_value
+        # A breach only clears once the value is back inside the band by a margin,
+        # so readings hovering on the limit don't toggle the alert state.
+        self.clear_min = None if min_value is None else min_value + abs(min_value) * hysteresis_ratio
+        self.clear_max = None if max_value is None else max_value - abs(max_value) * hysteresis_ratio
+        self.last_alerted_at = last_alerted_at
+        self.breached = False
+
+
+class ThresholdEngine:
+    """In-memory min/max index keyed by (device pk, sensor type) with alert cooldown.
+
+    Every ingesting process holds its own copy and reloads it from the DB every ``reload_interval_s``,
+    so threshold changes made through any API process reach ingestion workers within that interval.
+    The cooldown is shared through ``thresholds.last_alerted_at``: ``claim_alert`` only succeeds for the
+    first process to alert within the window. Breach/hysteresis state stays per process, so under a
+    shared subscription a sustained breach can alert again once the cooldown has passed, from a worker
+    that had not seen it start.
+    """
+
+    def __init__(self, cooldown_s: float = 300.0, hysteresis_ratio: float = 0.02) -> None:
+        self.cooldown = timedelta(seconds=cooldown_s)
+        self.hysteresis_ratio = hysteresis_ratio
+        self.reload_interval_s = 30.0
+        self._rules: dict[tuple[int, str], _Rule] = {}
+        self._lock = threading.Lock()
+        self._task: asyncio.Task | None = None
+        self.reloads = 0
+
+    def configure(self, cooldown_s: float, hysteresis_ratio: float, reload_interval_s: float = 30.0) -> None:
+        self.cooldown = timedelta(seconds=cooldown_s)
+        self.hysteresis_ratio = hysteresis_ratio
+        self.reload_interval_s = reload_interval_s
+
+    def start(self) -> None:
+        if self._task is None and self.reload_interval_s > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def load(self) -> None:
+        async with AsyncSessionLocal() as db:
+            rows = (
+                await db.execute(
+                    select(
+                        Threshold.id,
+                        Threshold.device_id,
+                        Threshold.sensor_type,
+                        Threshold.min_value,
+                        Threshold.max_value,
+                        Threshold.last_alerted_at,
+                    )
+                )
+            ).all()
+        now = datetime.utcnow()
+        rules = {}
+        with self._lock:
+            current = self._rules
+        for row in rows:
+            key = (row.device_id, row.sensor_type)
+            rule = _Rule(row.id, row.min_value, row.max_value, row.last_alerted_at, self.hysteresis_ratio)
+            previous = current.get(key)
+            if previous is not None and previous.threshold_id == row.id:
+                # A reload keeps what this process has seen; the DB adds alerts raised by other processes.
+                rule.breached = previous.breached
+                if previous.last_alerted_at is not None and (
+                    rule.last_alerted_at is None or previous.last_alerted_at > rule.last_alerted_at
+                ):
+                    rule.last_alerted_at = previous.last_alerted_at
+            else:
+                # Assume a recently alerted sensor is still out of range so a restart doesn't re-alert.
+                rule.breached = row.last_alerted_at is not None and now - row.last_alerted_at < self.cooldown
+            rules[key] = rule
+        with self._lock:
+            # Rules set() while the query ran are newer than the rows it returned.
+            for key, rule in self._rules.items():
+                if rule is not current.get(key):
+                    rules[key] = rule
+            self._rules = rules
+        self.reloads += 1
+        logger.debug("threshold engine loaded", extra={"thresholds": len(rules)})
+
+    def set(self, threshold: Threshold) -> None:
+        key = (threshold.device_id, threshold.sensor_type)
+        rule = _Rule(
+            threshold.id,
+            threshold.min_value,
+            threshold.max_value,
+            threshold.last_alerted_at,
+            self.hysteresis_ratio,
+        )
+        with self._lock:
+            previous = self._rules.get(key)
+            if previous is not None:
+                rule.last_alerted_at = previous.last_alerted_at
+            self._rules[key] = rule
+
+    def evaluate(self, device_pk: int, sensor_type: str, value: float, ts: datetime) -> Breach | None:
+        """Return a breach if this reading should raise an alert."""
+        rule = self._rules.get((device_pk, sensor_type))
+        if rule is None:
+            return None
+        reason = None
+        if rule.min_value is not None and value < rule.min_value:
+            reason = "below_min"
+        if rule.max_value is not None and value > rule.max_value:
+            reason = "above_max"
+        if reason is None:
+            if rule.breached and (rule.clear_min is None or value >= rule.clear_min) and (
+                rule.clear_max is None or value <= rule.clear_max
+            ):
+                rule.breached = False
+            return None
+        if rule.breached:
+            return None
+        # Only the transition into breach alerts, and at most once per cooldown window.
+        rule.breached = True
+        if rule.last_alerted_at is not None and ts - rule.last_alerted_at < self.cooldown:
+            return None
+        rule.last_alerted_at = ts
+        return Breach(rule.threshold_id, reason)
+
+    @timed(DB_COMMIT_SECONDS, op="alert_timestamp")
+    async def claim_alert(self, threshold_id: int, ts: datetime) -> bool:
+        """Record the alert unless another process already alerted within the cooldown; True if this one may."""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(Threshold)
+                .where(
+                    Threshold.id == threshold_id,
+                    (Threshold.last_alerted_at.is_(None)) | (Threshold.last_alerted_at <= ts - self.cooldown),
+                )
+                .values(last_alerted_at=ts)
+            )
+            await db.commit()
+        return result.rowcount > 0
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.reload_interval_s)
+            try:
+                await self.load()
+            except Exception:
+                logger.exception("threshold reload failed")
+
+
+threshold_engine = ThresholdEngine()
@@ -0,0 +1,103 @@
+"""Standalone MQTT ingestion worker, separate from the API process.
+
+Run as many as needed; with ``MQTT_SHARED_GROUP`` set (default ``ingest``) they join one MQTT v5
+shared subscription and the broker splits messages between them::
+
+    MQTT_INGEST_IN_API=false uvicorn app.main:app      # API only
+    python -m app.worker                               # one or more ingestion workers
+"""
+import argparse
+import asyncio
+import logging
+import signal
+import socket
+
+from app.core import metrics
+from app.core.config import get_settings
+from app.services.event_bus import require_shared_event_bus
+from app.services.mqtt_service import mqtt_runner, start_ingest_services, stop_ingest_services
+from app.services.response_cache import build_cache_backend, response_cache
+
+logger = logging.getLogger(__name__)
+
+
+async def _serve_metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    # Just enough HTTP for a Prometheus scrape; the worker has no web framework.
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+        body = metrics.render().encode("utf-8")
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii")
+            + body
+        )
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def run(shared_group: str, metrics_port: int | None, worker_id: str) -> None:
+    settings = get_settings()
+    require_shared_event_bus(settings)
+    # Presence flushes here invalidate the API's cached device list when the backend is shared.
+    response_cache.configure(
+        enabled=settings.response_cache_enabled,
+        ttl_s=settings.response_cache_ttl_s,
+        backend=build_cache_backend(settings),
+    )
+    await start_ingest_services(sweep_presence=False, process_name=f"worker-{worker_id}")
+    server = None
+    if metrics_port:
+        server = await asyncio.start_server(_serve_metrics, "0.0.0.0", metrics_port)
+    runner = asyncio.create_task(mqtt_runner(settings.mqtt_broker_host, settings.mqtt_broker_port, shared_group))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    logger.info(
+        "ingest worker running",
+        extra={"shared_group": shared_group, "metrics_port": metrics_port, "worker_id": worker_id},
+    )
+    try:
+        await stop.wait()
+    finally:
+        runner.cancel()
+        try:
+            await runner
+        except asyncio.CancelledError:
+            pass
+        if server is not None:
+            server.close()
+        # Flush whatever is still queued before exiting.
+        await stop_ingest_services()
+        logger.info("ingest worker stopped")
+
+
+def main() -> None:
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description="MQTT ingestion worker")
+    parser.add_argument("--group", default=settings.mqtt_shared_group or "ingest", help="MQTT v5 shared subscription group")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port")
+    parser.add_argument(
+        "--worker-id",
+        default=socket.gethostname(),
+        help="names this worker's anomaly snapshot file (default: the hostname); "
+        "give each worker on one host its own stable id",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=settings.log_level)
+    try:
+        asyncio.run(run(args.group, args.metrics_port, args.worker_id))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
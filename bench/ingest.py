@@ -0,0 +1,371 @@
+"""End-to-end ingestion benchmark.
+
+Simulates virtual ESP32 devices publishing the same topics and payloads as ``Vframe.ino`` and drives
+them through ``handle_message`` (in-process, default) or a real MQTT broker (``--broker``), while
+WebSocket clients and REST pollers run against the app. Reports messages/sec, ingest-to-WebSocket
+latency, DB rows/sec and memory. Runs offline against a throwaway SQLite database by default::
+
+    python -m bench.ingest --devices 50 --cycles 40
+    python -m bench.ingest --devices 50 --cycles 40 --save-baseline bench/baseline.json
+    python -m bench.ingest --devices 50 --cycles 40 --baseline bench/baseline.json  # exits 1 on regression
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+# Metrics compared by --baseline: name -> True if higher is better.
+GATED_METRICS = {
+    "messages_per_s": True,
+    "rows_per_s": True,
+    "handle_p99_ms": False,
+    "ws_p99_ms": False,
+}
+
+
+def percentile(samples: list[float], pct: float) -> float | None:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return round(ordered[index], 3)
+
+
+def device_messages(device_id: str, cycle: int, rng: random.Random) -> list[tuple[str, bytes]]:
+    """One publish cycle of a device, mirroring the payloads built in Vframe.ino."""
+    pulses = cycle * rng.randint(40, 60)
+    messages = [
+        (f"farm/{device_id}/sensor/temperature", {"value_c": round(rng.uniform(18, 30), 2)}),
+        (f"farm/{device_id}/sensor/humidity", {"value_pct": round(rng.uniform(40, 80), 2)}),
+        (
+            f"farm/{device_id}/sensor/waterflow",
+            {
+                "l_per_min": round(rng.uniform(0, 3), 2),
+                "total_liters": round(pulses / 450, 2),
+                "avg_l_per_min": round(rng.uniform(0.5, 2), 2),
+                "pulses": pulses,
+            },
+        ),
+        (f"farm/{device_id}/sensor/tds", {"ppm": round(rng.uniform(300, 900), 2), "quality": "Good"}),
+    ]
+    if cycle % 10 == 0:
+        # Relay/light status is only published on change; roughly one in ten cycles.
+        key = "relay" if cycle % 20 == 0 else "light"
+        messages.append(
+            (f"farm/{device_id}/status", {key: {"state": rng.choice(("on", "off")), "timestamp": cycle * 5000}})
+        )
+    return [(topic, json.dumps(payload).encode("utf-8")) for topic, payload in messages]
+
+
+def telemetry_messages(device_id: str, cycle: int, rng: random.Random) -> list[tuple[str, bytes]]:
+    """The same cycle batched into one ``farm/<device>/telemetry`` message."""
+    sample: dict[str, Any] = {"ts": time.time()}
+    status = []
+    for topic, payload in device_messages(device_id, cycle, rng):
+        if is_sensor_topic(topic):
+            sample[topic.rsplit("/", 1)[1]] = json.loads(payload)
+        else:
+            status.append((topic, payload))
+    return [(f"farm/{device_id}/telemetry", json.dumps(sample).encode("utf-8")), *status]
+
+
+def readings_in(topic: str, payload: bytes) -> int:
+    if is_sensor_topic(topic):
+        return 1
+    if topic.endswith("/telemetry"):
+        return len(json.loads(payload)) - 1
+    return 0
+
+
+def is_sensor_topic(topic: str) -> bool:
+    return "/sensor/" in topic
+
+
+def cycle_messages(args: argparse.Namespace):
+    return telemetry_messages if args.telemetry else device_messages
+
+
+class Recorder:
+    """Thread-safe sample collection; WebSocket readers and REST pollers run on their own threads."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.samples: dict[str, list[float]] = {}
+        self.counts: dict[str, int] = {}
+
+    def add(self, name: str, value_ms: float) -> None:
+        with self._lock:
+            self.samples.setdefault(name, []).append(value_ms)
+
+    def incr(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def summary(self, name: str) -> dict[str, Any]:
+        samples = self.samples.get(name, [])
+        return {"count": len(samples), "p50_ms": percentile(samples, 50), "p99_ms": percentile(samples, 99)}
+
+
+async def run_devices_inproc(args: argparse.Namespace, recorder: Recorder) -> int:
+    from app.services.mqtt_service import handle_message
+
+    async def device(index: int) -> int:
+        rng = random.Random(args.seed + index)
+        device_id = f"{args.prefix}{index:04d}"
+        sent = 0
+        loop = asyncio.get_running_loop()
+        next_at = loop.time()
+        for cycle in range(args.cycles):
+            for topic, payload in cycle_messages(args)(device_id, cycle, rng):
+                started = time.perf_counter()
+                await handle_message(topic, payload)
+                recorder.add("handle", (time.perf_counter() - started) * 1000)
+                recorder.incr("readings", readings_in(topic, payload))
+                sent += 1
+            if args.interval:
+                next_at += args.interval
+                await asyncio.sleep(max(0.0, next_at - loop.time()))
+            else:
+                # Let the flusher and WebSocket senders run between cycles, as a real network would.
+                await asyncio.sleep(0)
+        return sent
+
+    return sum(await asyncio.gather(*(device(i) for i in range(args.devices))))
+
+
+async def run_devices_broker(args: argparse.Namespace, recorder: Recorder) -> int:
+    import aiomqtt
+
+    host, _, port = args.broker.partition(":")
+
+    async def device(index: int) -> int:
+        rng = random.Random(args.seed + index)
+        device_id = f"{args.prefix}{index:04d}"
+        sent = 0
+        async with aiomqtt.Client(hostname=host, port=int(port or 1883), client_id=f"bench-{device_id}") as client:
+            for cycle in range(args.cycles):
+                for topic, payload in cycle_messages(args)(device_id, cycle, rng):
+                    started = time.perf_counter()
+                    await client.publish(topic, payload, qos=args.qos)
+                    recorder.add("publish", (time.perf_counter() - started) * 1000)
+                    recorder.incr("readings", readings_in(topic, payload))
+                    sent += 1
+                if args.interval:
+                    await asyncio.sleep(args.interval)
+        return sent
+
+    return sum(await asyncio.gather(*(device(i) for i in range(args.devices))))
+
+
+def ws_reader(ws, recorder: Recorder) -> None:
+    from starlette.websockets import WebSocketDisconnect
+
+    while True:
+        try:
+            event = json.loads(ws.receive_text())
+        except (WebSocketDisconnect, RuntimeError):
+            return
+        ts = event.get("ts")
+        if ts is None or "alert" in event:
+            continue
+        # Server stamps "ts" when the reading is accepted; same process, same clock.
+        recorder.add("ws", (datetime.utcnow() - datetime.fromisoformat(ts)).total_seconds() * 1000)
+        recorder.incr("ws_events")
+
+
+def rest_poller(client, args: argparse.Namespace, recorder: Recorder, stop: threading.Event) -> None:
+    device_ids = ",".join(f"{args.prefix}{i:04d}" for i in range(min(args.devices, 10)))
+    paths = {
+        "rest_latest": f"/api/v1/data/latest?device_ids={device_ids}",
+        "rest_history": f"/api/v1/data/history/{args.prefix}0000-temperature?limit=100",
+    }
+    while not stop.is_set():
+        for name, path in paths.items():
+            started = time.perf_counter()
+            response = client.get(path)
+            recorder.add(name, (time.perf_counter() - started) * 1000)
+            # 404 is expected until the first reading for the device has been ingested.
+            if response.status_code not in (200, 404):
+                recorder.incr(f"{name}_errors")
+        stop.wait(args.rest_interval)
+
+
+def wait_drained(client, expected_rows: int, timeout_s: float) -> dict[str, Any]:
+    deadline = time.monotonic() + timeout_s
+    while True:
+        stats = client.get("/api/v1/stats/ingest").json()
+        done = stats["rows_written"] + stats["dropped_rows"] + stats["duplicate_rows"] >= expected_rows and stats["queue_depth"] == 0
+        if done or time.monotonic() > deadline:
+            return stats
+        time.sleep(0.02)
+
+
+def max_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+    # The app reads its settings and builds its engines at import time, so configure first.
+    workdir = tempfile.mkdtemp(prefix="vfarm-bench-")
+    os.environ.setdefault("SECRET_KEY", "bench")
+    os.environ["DB_URL"] = args.db_url or f"sqlite:///{Path(workdir) / 'bench.db'}"
+    os.environ.setdefault("ROLLUP_ENABLED", "false")
+    os.environ["INGEST_BATCH_SIZE"] = str(args.batch_size)
+    os.environ["INGEST_FLUSH_INTERVAL_S"] = str(args.flush_interval)
+    if args.broker:
+        host, _, port = args.broker.partition(":")
+        os.environ["MQTT_BROKER_HOST"] = host
+        os.environ["MQTT_BROKER_PORT"] = port or "1883"
+    else:
+        # Nothing listens here; keeps the app's own MQTT loops from consuming a real broker's traffic.
+        os.environ["MQTT_BROKER_HOST"] = "127.0.0.1"
+        os.environ["MQTT_BROKER_PORT"] = "1"
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import func, select
+
+    import app.models.models  # noqa: F401
+    from app.db.session import Base, SessionLocal, engine
+    from app.main import app
+    from app.models.models import SensorData
+
+    Base.metadata.create_all(engine)
+    with SessionLocal() as db:
+        rows_before = db.scalar(select(func.count()).select_from(SensorData))
+
+    recorder = Recorder()
+    stop = threading.Event()
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    with TestClient(app) as client, contextlib.ExitStack() as sockets:
+        readers = []
+        for i in range(min(args.ws_clients, args.devices)):
+            ws = sockets.enter_context(client.websocket_connect(f"/api/v1/realtime/{args.prefix}{i:04d}"))
+            readers.append(threading.Thread(target=ws_reader, args=(ws, recorder), daemon=True))
+            # Closing runs before the context exits, so the reader unblocks first.
+            sockets.callback(ws.close)
+        pollers = [
+            threading.Thread(target=rest_poller, args=(client, args, recorder, stop), daemon=True)
+            for _ in range(args.rest_clients)
+        ]
+        for thread in readers + pollers:
+            thread.start()
+
+        started = time.perf_counter()
+        driver = run_devices_broker if args.broker else run_devices_inproc
+        sent = client.portal.call(driver, args, recorder)
+        publish_s = time.perf_counter() - started
+        expected_rows = recorder.counts.get("readings", 0)
+        ingest = wait_drained(client, expected_rows, args.drain_timeout)
+        drained_s = time.perf_counter() - started
+        stop.set()
+        for thread in pollers:
+            thread.join()
+        event_bus_stats = client.get("/api/v1/stats/event-bus").json()
+
+    traced_peak = None
+    if args.tracemalloc:
+        traced_peak = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+        tracemalloc.stop()
+    with SessionLocal() as db:
+        rows = db.scalar(select(func.count()).select_from(SensorData)) - rows_before
+
+    handle = recorder.summary("publish" if args.broker else "handle")
+    ws = recorder.summary("ws")
+    return {
+        "mode": "broker" if args.broker else "inproc",
+        "telemetry": args.telemetry,
+        "devices": args.devices,
+        "messages": sent,
+        "expected_rows": expected_rows,
+        "rows": rows,
+        "publish_s": round(publish_s, 3),
+        "drained_s": round(drained_s, 3),
+        "messages_per_s": round(sent / publish_s, 1),
+        "rows_per_s": round(rows / drained_s, 1),
+        "handle_p50_ms": handle["p50_ms"],
+        "handle_p99_ms": handle["p99_ms"],
+        "ws_events": ws["count"],
+        "ws_p50_ms": ws["p50_ms"],
+        "ws_p99_ms": ws["p99_ms"],
+        "rest": {name: recorder.summary(name) for name in ("rest_latest", "rest_history")},
+        "rest_errors": {k: v for k, v in recorder.counts.items() if k.endswith("_errors")},
+        "ingest": {k: ingest[k] for k in ("batches", "avg_batch_size", "avg_flush_ms", "max_flush_ms", "dropped_rows", "backpressure_waits")},
+        "event_bus": event_bus_stats,
+        "max_rss_mb": max_rss_mb(),
+        "traced_peak_mb": traced_peak,
+    }
+
+
+def compare(result: dict[str, Any], baseline: dict[str, Any], tolerance: float) -> list[str]:
+    failures = []
+    for name, higher_is_better in GATED_METRICS.items():
+        current, reference = result.get(name), baseline.get(name)
+        if current is None or reference is None:
+            continue
+        if higher_is_better and current < reference * (1 - tolerance):
+            failures.append(f"{name}: {current} < {reference} - {tolerance:.0%}")
+        if not higher_is_better and current > reference * (1 + tolerance):
+            failures.append(f"{name}: {current} > {reference} + {tolerance:.0%}")
+    if result["rows"] < result["expected_rows"]:
+        failures.append(f"rows: {result['rows']} of {result['expected_rows']} readings were stored")
+    return failures
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="End-to-end MQTT ingestion benchmark")
+    parser.add_argument("--devices", type=int, default=20, help="virtual ESP32 devices")
+    parser.add_argument("--cycles", type=int, default=50, help="publish cycles per device (4 readings + occasional status)")
+    parser.add_argument("--interval", type=float, default=0.0, help="seconds between cycles per device; 0 = flat out")
+    parser.add_argument("--telemetry", action="store_true", help="publish each cycle as one farm/<device>/telemetry message")
+    parser.add_argument("--prefix", default="bench-", help="device id prefix")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--broker", help="host[:port] of a real MQTT broker; default drives handle_message in-process")
+    parser.add_argument("--qos", type=int, default=0, choices=(0, 1, 2))
+    parser.add_argument("--db-url", help="SQLAlchemy URL; default is a fresh SQLite file")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--flush-interval", type=float, default=0.2)
+    parser.add_argument("--ws-clients", type=int, default=5, help="WebSocket clients, one per device")
+    parser.add_argument("--rest-clients", type=int, default=1, help="threads polling /data/latest and /data/history")
+    parser.add_argument("--rest-interval", type=float, default=0.05)
+    parser.add_argument("--drain-timeout", type=float, default=60.0)
+    parser.add_argument("--tracemalloc", action="store_true", help="report peak traced Python memory (slower)")
+    parser.add_argument("--baseline", help="JSON result to gate against; exits 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed regression vs --baseline")
+    parser.add_argument("--save-baseline", help="write this run's result as a baseline file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    # The in-process mode has no broker; the app's reconnect warnings are expected noise.
+    logging.getLogger("app.services.mqtt_service").setLevel(logging.ERROR)
+    logging.getLogger("app.services.mqtt_publisher").setLevel(logging.ERROR)
+
+    result = run(args)
+    print(json.dumps(result, indent=2))
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(result, indent=2) + "\n")
+    if args.baseline:
+        failures = compare(result, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for failure in failures:
+            print(f"REGRESSION {failure}", file=sys.stderr)
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
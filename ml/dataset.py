@@ -0,0 +1,43 @@
+"""Readers for the arrays written by ``ml.preprocess``.
+
+Images are memory-mapped, so opening a split costs nothing and each batch reads only its own rows;
+no JPEG is decoded during training. Augmentation can still be applied per batch, e.g. with
+``ImageDataGenerator(...).flow(split.images, keras.utils.to_categorical(split.labels))`` when the
+manifest lists no failed images.
+"""
+import json
+from pathlib import Path
+from typing import Any, Iterator, NamedTuple
+
+import numpy as np
+
+
+class Split(NamedTuple):
+    images: np.ndarray  # (n, size, size, 3) uint8, memory-mapped read-only
+    labels: np.ndarray  # (n,) int16 class index, -1 for an image that could not be decoded
+    classes: list[str]
+    rows: np.ndarray  # indices of the decoded images
+
+
+def load_manifest(root: str | Path) -> dict[str, Any]:
+    return json.loads((Path(root) / "manifest.json").read_text(encoding="utf-8"))
+
+
+def load_split(root: str | Path, split: str) -> Split:
+    root = Path(root)
+    images = np.load(root / f"{split}_images.npy", mmap_mode="r")
+    labels = np.load(root / f"{split}_labels.npy")
+    return Split(images, labels, load_manifest(root)["classes"], np.flatnonzero(labels >= 0))
+
+
+def batches(
+    split: Split, batch_size: int = 32, shuffle: bool = True, seed: int = 42, epoch: int = 0
+) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """``(x, y)`` batches: float32 images scaled to 0..1 (as the notebook's ``rescale=1./255``) and one-hot labels."""
+    order = np.random.default_rng((seed, epoch)).permutation(split.rows) if shuffle else split.rows
+    eye = np.eye(len(split.classes), dtype=np.float32)
+    for start in range(0, len(order), batch_size):
+        # Reading rows in file order keeps memmap access mostly sequential; order within a batch doesn't matter.
+        idx = np.sort(order[start : start + batch_size])
+        yield split.images[idx].astype(np.float32) / 255.0, eye[split.labels[idx]]
+
@@ -0,0 +1,246 @@
+"""Offline dataset preprocessing for the plant disease model.
+
+Replaces the training notebook's manual folder deletion, ``splitfolders`` copy and per-epoch JPEG
+decoding: classes are filtered, each class is split deterministically, and every image is decoded and
+resized once, in parallel, into uint8 ``.npy`` arrays that training memory-maps (see ``ml.dataset``).
+The source is the extracted dataset folder or the downloaded zip itself::
+
+    python -m ml.preprocess dataset.zip data/plantvillage --workers 8
+    python -m ml.preprocess Plant_leave_diseases_dataset_without_augmentation data/plantvillage
+
+Re-running with the same source and options is a no-op unless ``--force`` is given.
+"""
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 2
+SPLITS = ("train", "val", "test")
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png")
+CHUNK_SIZE = 256
+
+# Classes the notebook deleted by hand: crops not grown in the farm.
+EXCLUDED_CLASSES = (
+    "Apple___Apple_scab",
+    "Apple___Black_rot",
+    "Apple___Cedar_apple_rust",
+    "Apple___healthy",
+    "Soybean___powdery_mildew",
+    "Soybean___healthy",
+    "Cherry___healthy",
+    "Cherry___Powdery_mildew",
+    "Blueberry___healthy",
+    "Grape___Black_rot",
+    "Grape___Esca_(Black_Measles)",
+    "Grape___Leaf_blight_(Isariopsis_Leaf_Spot)",
+    "Grape___healthy",
+    "Orange___Haunglongbing_(Citrus_greening)",
+    "Corn___gray_leaf_spot",
+    "Corn___Common_rust",
+    "Corn___healthy",
+    "Corn___Northern_Leaf_Blight",
+    "Corn___Cercospora_leaf_spot Gray_leaf_spot",
+    "Squash___Powdery_mildew",
+    "Raspberry___healthy",
+    "Peach___Bacterial_spot",
+    "Peach___healthy",
+)
+
+
+def list_images(source: Path) -> dict[str, list[str]]:
+    """Image paths (relative to the folder, or zip member names) grouped by class folder, sorted."""
+    if source.suffix == ".zip":
+        with zipfile.ZipFile(source) as archive:
+            names = [n for n in archive.namelist() if n.lower().endswith(IMAGE_SUFFIXES)]
+    else:
+        names = [
+            p.relative_to(source).as_posix()
+            for p in source.rglob("*")
+            if p.suffix.lower() in IMAGE_SUFFIXES and p.is_file()
+        ]
+    by_class: dict[str, list[str]] = {}
+    for name in names:
+        parts = name.split("/")
+        if len(parts) >= 2:
+            by_class.setdefault(parts[-2], []).append(name)
+    return {cls: sorted(files) for cls, files in sorted(by_class.items())}
+
+
+def select_classes(available: list[str], include: list[str] | None, exclude: list[str]) -> list[str]:
+    if include:
+        missing = sorted(set(include) - set(available))
+        if missing:
+            raise ValueError(f"classes not in the dataset: {', '.join(missing)}")
+        return sorted(include)
+    return [cls for cls in available if cls not in exclude]
+
+
+def split_files(
+    by_class: dict[str, list[str]], classes: list[str], ratio: tuple[float, float, float], seed: int
+) -> dict[str, list[tuple[str, int]]]:
+    """Stratified split: each class is shuffled with one seeded generator, then cut by ``ratio``.
+
+    The input lists are sorted, so the same files, seed and ratio always give the same split.
+    """
+    rng = np.random.default_rng(seed)
+    splits: dict[str, list[tuple[str, int]]] = {split: [] for split in SPLITS}
+    for label, cls in enumerate(classes):
+        files = by_class[cls]
+        order = rng.permutation(len(files))
+        n_train = int(len(files) * ratio[0])
+        n_val = int(len(files) * ratio[1])
+        cuts = {"train": order[:n_train], "val": order[n_train : n_train + n_val], "test": order[n_train + n_val :]}
+        for split, idx in cuts.items():
+            splits[split].extend((files[i], label) for i in idx)
+    return splits
+
+
+def decode(data: bytes, size: int) -> np.ndarray:
+    """RGB, nearest-neighbour resize to ``size`` x ``size``, uint8; the same steps as the inference service."""
+    with Image.open(io.BytesIO(data)) as img:
+        return np.asarray(img.convert("RGB").resize((size, size), Image.NEAREST), dtype=np.uint8)
+
+
+def _decode_chunk(source: str, names: list[str], out_path: str, offset: int, size: int) -> list[int]:
+    """Worker: decode ``names`` straight into rows ``offset..`` of the output array; returns failed rows."""
+    images = np.load(out_path, mmap_mode="r+")
+    failed = []
+    archive = zipfile.ZipFile(source) if source.endswith(".zip") else None
+    try:
+        for i, name in enumerate(names):
+            try:
+                data = archive.read(name) if archive is not None else (Path(source) / name).read_bytes()
+                images[offset + i] = decode(data, size)
+            except (OSError, SyntaxError, ValueError, KeyError):
+                failed.append(offset + i)
+    finally:
+        if archive is not None:
+            archive.close()
+        images.flush()
+    return failed
+
+
+def write_split(
+    source: Path, files: list[tuple[str, int]], out_dir: Path, split: str, size: int, workers: int
+) -> list[str]:
+    """Decode one split into ``<split>_images.npy``; returns the files that could not be decoded."""
+    images_path = out_dir / f"{split}_images.npy"
+    partial = out_dir / f"{split}_images.partial.npy"
+    labels = np.array([label for _, label in files], dtype=np.int16)
+    names = [name for name, _ in files]
+    np.lib.format.open_memmap(partial, mode="w+", dtype=np.uint8, shape=(len(files), size, size, 3)).flush()
+
+    failed: list[int] = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = [
+            pool.submit(_decode_chunk, str(source), names[start : start + CHUNK_SIZE], str(partial), start, size)
+            for start in range(0, len(names), CHUNK_SIZE)
+        ]
+        for done, job in enumerate(jobs, 1):
+            failed.extend(job.result())
+            logger.info("%s: %d/%d chunks", split, done, len(jobs))
+
+    # Undecodable images keep a zeroed row; label -1 tells the loader to skip it.
+    labels[failed] = -1
+    np.save(out_dir / f"{split}_labels.npy", labels)
+    (out_dir / f"{split}_files.txt").write_text("\n".join(names) + "\n", encoding="utf-8")
+    os.replace(partial, images_path)
+    return [names[i] for i in failed]
+
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+    source = Path(args.source)
+    out_dir = Path(args.output)
+    ratio = tuple(args.ratio)
+    by_class = list_images(source)
+    classes = select_classes(list(by_class), args.include, [] if args.include else args.exclude)
+    splits = split_files(by_class, classes, ratio, args.seed)
+
+    # Identifies the inputs and options; an existing output with the same fingerprint is reused.
+    fingerprint = hashlib.sha256(
+        json.dumps(
+            {"files": [splits[s] for s in SPLITS], "size": args.img_size, "version": MANIFEST_VERSION}
+        ).encode()
+    ).hexdigest()
+    manifest_path = out_dir / "manifest.json"
+    if manifest_path.exists() and not args.force:
+        existing = json.loads(manifest_path.read_text(encoding="utf-8"))
+        if existing.get("fingerprint") == fingerprint:
+            logger.info("%s is up to date", out_dir)
+            return existing
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path.unlink(missing_ok=True)
+    started = time.perf_counter()
+    failed: list[str] = []
+    for split in SPLITS:
+        failed += write_split(source, splits[split], out_dir, split, args.img_size, args.workers)
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "fingerprint": fingerprint,
+        "source": str(source),
+        "img_size": args.img_size,
+        "seed": args.seed,
+        "ratio": ratio,
+        "classes": classes,
+        "splits": {
+            split: {
+                "count": len(splits[split]),
+                "class_counts": np.bincount([label for _, label in splits[split]], minlength=len(classes)).tolist(),
+            }
+            for split in SPLITS
+        },
+        "failed": failed,
+        "seconds": round(time.perf_counter() - started, 1),
+    }
+    # Class names in label order, also usable as INFERENCE_LABELS_PATH for the trained model.
+    (out_dir / "labels.json").write_text(json.dumps(classes, indent=2) + "\n", encoding="utf-8")
+    manifest_path.write_text(json.dumps(manifest, indent=2) + "\n", encoding="utf-8")
+    return manifest
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Filter, split and pre-decode the plant disease dataset")
+    parser.add_argument("source", help="extracted dataset folder, or the downloaded .zip")
+    parser.add_argument("output", help="directory for the .npy arrays and manifest.json")
+    parser.add_argument("--include", nargs="+", help="keep only these classes (default: all but --exclude)")
+    parser.add_argument("--exclude", nargs="+", default=list(EXCLUDED_CLASSES), help="classes to drop")
+    parser.add_argument("--ratio", nargs=3, type=float, default=(0.8, 0.1, 0.1), metavar=("TRAIN", "VAL", "TEST"))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--img-size", type=int, default=224)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--force", action="store_true", help="rebuild even if the output is up to date")
+    args = parser.parse_args(argv)
+
+    if Image is None:
+        parser.error("Pillow is required: pip install pillow")
+    if abs(sum(args.ratio) - 1.0) > 1e-6:
+        parser.error("--ratio must sum to 1")
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    manifest = run(args)
+    print(json.dumps({k: manifest[k] for k in ("classes", "splits", "failed")}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())